@@ -402,8 +402,9 @@ class CouponAdmin(admin.ModelAdmin):
     _user.allow_tags = True
 
     def _usage(self, o):
-        return models.OrderItem.objects.filter(ticket=None, code=o.code).count()
+        return o.usage
     _usage.short_description = 'usage'
+    _usage.admin_order_field = 'usage'
 
     def _valid(self, o):
         return o.valid(o.user)
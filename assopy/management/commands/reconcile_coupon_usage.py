@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from assopy.models import rebuild_coupon_usage
+
+
+class Command(BaseCommand):
+    """
+    Recounts the usage of all the coupons (Coupon.usage) from the order
+    items; normally it's updated every time an order item is saved or
+    deleted, but not by bulk updates.
+    """
+    def handle(self, *args, **options):
+        fixed = rebuild_coupon_usage()
+        print('Fixed the usage of %d coupons' % fixed)
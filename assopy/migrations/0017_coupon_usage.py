@@ -0,0 +1,36 @@
+# Generated by Django 2.2.24 on 2026-10-18 17:05
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_coupon_usage(apps, schema_editor):
+    Coupon = apps.get_model('assopy', 'Coupon')
+    OrderItem = apps.get_model('assopy', 'OrderItem')
+    usage = dict(
+        OrderItem.objects
+        .filter(ticket=None)
+        .order_by()
+        .values_list('code')
+        .annotate(count=Count('id'))
+    )
+    for coupon in Coupon.objects.all():
+        count = usage.get(coupon.code, 0)
+        if count:
+            Coupon.objects.filter(id=coupon.id).update(usage=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assopy', '0016_null_has_no_effect_on_vat_manytomay_relationship'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='usage',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_coupon_usage, migrations.RunPython.noop),
+    ]
@@ -12,13 +12,16 @@ from django.contrib.admin.utils import quote
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.utils import timezone
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from model_utils import Choices
 
 from assopy.utils import send_email
+from common import pdfcache
 from conference.currencies import normalize_price
 from conference.models import Ticket, Fare
 from conference.users import generate_random_username
@@ -275,6 +278,9 @@ class Coupon(models.Model):
     items_per_usage = models.PositiveIntegerField(default=0, help_text='numero di righe d\'ordine su cui questo coupon ha effetto')
     description = models.CharField(max_length=100, blank=True)
     value = models.CharField(max_length=8, help_text='importo, eg: 10, 15%, 8.5')
+    # Number of discount rows (order items without a ticket) with this code,
+    # kept up to date by update_coupon_usage.
+    usage = models.PositiveIntegerField(default=0, editable=False)
 
     user = models.ForeignKey(AssopyUser, null=True, blank=True, on_delete=models.CASCADE)
     fares = models.ManyToManyField(Fare, blank=True)
@@ -310,7 +316,7 @@ class Coupon(models.Model):
                 return False
 
         if self.max_usage:
-            if OrderItem.objects.filter(ticket=None, code=self.code).count() >= self.max_usage:
+            if self.usage >= self.max_usage:
                 return False
 
         if self.user_id:
@@ -788,6 +794,74 @@ class OrderItem(models.Model):
         return 'payment'
 
 
+def update_coupon_usage(codes):
+    """
+    Recounts the usage of the coupons with the given codes, with a single
+    UPDATE.
+
+    Recounting, instead of incrementing, keeps the counters correct no matter
+    how many times an order item is saved.
+    """
+    usage = OrderItem.objects\
+        .filter(ticket=None, code=OuterRef('code'))\
+        .order_by()\
+        .values('code')\
+        .annotate(count=Count('id'))\
+        .values('count')
+    Coupon.objects\
+        .filter(code__in=codes)\
+        .update(usage=Coalesce(Subquery(usage, output_field=IntegerField()), 0))
+
+
+def rebuild_coupon_usage():
+    """
+    Recounts the usage of all the coupons; returns the number of coupons
+    whose counter was wrong.
+    """
+    usage = dict(
+        OrderItem.objects
+        .filter(ticket=None)
+        .order_by()
+        .values_list('code')
+        .annotate(count=Count('id'))
+    )
+    fixed = 0
+    with transaction.atomic():
+        for coupon in Coupon.objects.select_for_update().only('id', 'code', 'usage'):
+            count = usage.get(coupon.code, 0)
+            if coupon.usage != count:
+                Coupon.objects.filter(id=coupon.id).update(usage=count)
+                fixed += 1
+    return fixed
+
+
+def _coupon_usage_changing(sender, instance, **kwargs):
+    # Remember the previous code of a discount row, for _coupon_usage_changed
+    if instance.pk:
+        instance._previous_coupon_code = OrderItem.objects\
+            .filter(pk=instance.pk, ticket=None)\
+            .values_list('code', flat=True)\
+            .first()
+    else:
+        instance._previous_coupon_code = None
+
+
+def _coupon_usage_changed(sender, instance, **kwargs):
+    codes = set()
+    if instance.ticket_id is None:
+        codes.add(instance.code)
+    previous = getattr(instance, '_previous_coupon_code', None)
+    if previous is not None:
+        codes.add(previous)
+    if codes:
+        update_coupon_usage(codes)
+
+
+pre_save.connect(_coupon_usage_changing, sender=OrderItem)
+post_save.connect(_coupon_usage_changed, sender=OrderItem)
+post_delete.connect(_coupon_usage_changed, sender=OrderItem)
+
+
 def _order_feedback(sender, **kwargs):
     rows = [
         'Ordering person: "%s" (%s)' % (sender.user.name(), sender.user.user.email),
@@ -922,3 +996,12 @@ class Invoice(models.Model):
     @property
     def price_in_local_currency(self):
         return normalize_price(self.price * self.exchange_rate)
+
+
+def _render_invoice_pdf(sender, instance, **kwargs):
+    # Render the PDF in the background, ahead of the first download
+    html = instance.html
+    transaction.on_commit(lambda: pdfcache.render_in_background(html))
+
+
+post_save.connect(_render_invoice_pdf, sender=Invoice)
@@ -6,7 +6,7 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404
 
 from assopy import models
-from common.http import PdfResponse
+from common import pdfcache
 
 log = logging.getLogger('assopy.views')
 
@@ -30,5 +30,8 @@ def invoice(request, order_code, code, mode='html'):
     if mode == 'html':
         return http.HttpResponse(invoice.html)
 
-    return PdfResponse(filename=invoice.get_invoice_filename(),
-                       content=invoice.html)
+    # Normally rendered in the background when the invoice is saved
+    path = pdfcache.get_or_render(invoice.html)
+    response = http.FileResponse(open(path, 'rb'), content_type='application/pdf')
+    response['Content-Disposition'] = 'filename="%s"' % invoice.get_invoice_filename()
+    return response
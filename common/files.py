@@ -0,0 +1,91 @@
+"""
+Helpers for the files generated and stored on disk by the apps (rendered
+PDFs, fetched avatars, search indexes...).
+
+Generating a file can take seconds, so it can be scheduled on a small pool
+of background threads (see `run_in_background`, sized by
+BACKGROUND_WORKERS); `write_file` stores it atomically, so that a request
+served meanwhile never reads a partial file.
+"""
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+log = logging.getLogger('common.files')
+
+
+def write_file(path, data):
+    """
+    Writes `data` to a temporary file and then renames it to `path`, so that
+    a concurrent reader never sees a partially written file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class BackgroundJobs:
+    """
+    A pool of threads, sized by the `workers_setting` setting, which is
+    started on the first job.
+    """
+    def __init__(self, workers_setting, name):
+        self.workers_setting = workers_setting
+        self.name = name
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _run_job(self, key, func, args):
+        try:
+            func(*args)
+        except Exception:
+            log.exception('%s job %s failed', self.name, key)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def run(self, key, func, *args):
+        """
+        Runs `func(*args)` on the pool, unless a job with the same `key` is
+        still pending.
+
+        Returns False if the pool is disabled, and the job hasn't been run.
+        """
+        workers = getattr(settings, self.workers_setting)
+        if workers <= 0:
+            return False
+
+        with self._lock:
+            if key in self._pending:
+                return True
+            self._pending.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=workers,
+                    thread_name_prefix=self.name,
+                )
+        self._executor.submit(self._run_job, key, func, args)
+        return True
+
+
+_jobs = BackgroundJobs('BACKGROUND_WORKERS', 'background')
+
+
+def run_in_background(key, func, *args):
+    """
+    Runs `func(*args)` on the BACKGROUND_WORKERS threads; see
+    `BackgroundJobs.run`.
+    """
+    return _jobs.run(key, func, *args)
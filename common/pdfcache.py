@@ -0,0 +1,74 @@
+"""
+Disk cache of the PDFs rendered (with WeasyPrint) from HTML documents, like
+the invoices.
+
+Files are content-addressed: the name is the hash of the HTML they were
+rendered from, so when the HTML changes (eg. a reissued invoice) a new file
+is rendered and the old one is simply never looked up again.
+
+Rendering takes seconds, so it can be scheduled on a small pool of
+background threads (PDF_RENDER_WORKERS, see `render_in_background`) as soon
+as the HTML is known; `get_or_render` renders inline only if the file is
+still missing.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+
+from common.files import BackgroundJobs, write_file
+
+_renderers = BackgroundJobs('PDF_RENDER_WORKERS', 'pdfcache')
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def pdf_path(content):
+    h = content_hash(content)
+    return os.path.join(settings.PDF_CACHE_DIR, h[:2], h + '.pdf')
+
+
+def cached(content):
+    """
+    Returns the path of the PDF rendered from `content`, or None if it
+    hasn't been rendered yet.
+    """
+    path = pdf_path(content)
+    return path if os.path.exists(path) else None
+
+
+def render(content):
+    """
+    Renders `content` to PDF and stores it in the cache, returns the path of
+    the file.
+    """
+    # Imported here: this module is loaded by assopy.models, and WeasyPrint
+    # (with cairo) is only needed by the processes rendering the PDFs.
+    from weasyprint import HTML
+
+    path = pdf_path(content)
+    write_file(path, HTML(string=content).write_pdf())
+    return path
+
+
+def get_or_render(content):
+    return cached(content) or render(content)
+
+
+def run_in_background(key, func, *args):
+    """
+    Runs the rendering `func(*args)` on the PDF_RENDER_WORKERS threads; see
+    `common.files.BackgroundJobs.run`.
+    """
+    return _renderers.run(key, func, *args)
+
+
+def render_in_background(content):
+    """
+    Schedules the rendering of `content`; does nothing if the PDF is
+    already cached.
+    """
+    if not cached(content):
+        run_in_background(content_hash(content), get_or_render, content)
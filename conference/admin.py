@@ -12,6 +12,7 @@ from django.conf.urls import url as re_path
 from django.contrib.contenttypes.fields import (
     ReverseGenericManyToOneDescriptor,
 )
+from django.db.models import Count, Q
 from django.urls import reverse
 from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
@@ -253,7 +254,7 @@ class ConferenceAdmin(admin.ModelAdmin):
                     if form.cleaned_data['send_email']:
                         from django.contrib import messages
                         c = form.send_emails(uids, request.user.email)
-                        messages.add_message(request, messages.INFO, '{0} emails sent'.format(c))
+                        messages.add_message(request, messages.INFO, '{0} emails queued'.format(c))
                         form.save_email()
                         form = AdminSendMailForm()
         else:
@@ -1126,39 +1127,27 @@ class TicketAdmin(admin.ModelAdmin):
 
     def stats_data(self, request):
         from common.jsonify import json_dumps
-        from django.db.models import Q
-        from collections import defaultdict
 
         conferences = list(models.Conference.objects.order_by('conference_start'))
+        codes = [c.code for c in conferences[-3:]]
 
+        # Daily rollup maintained by conference.tickets.update_ticket_sales
         output = {}
-        for c in conferences[-3:]:
-            tickets = (
-                models.Ticket.objects
-                    .filter(fare__conference=c)
-                    .filter(
-                        Q(orderitem__order___complete=True) | Q(orderitem__order__method__in=('bank', 'admin'))
-                    )
-                    .select_related('fare', 'orderitem__order')
-            )
-            data = {
-                'conference': defaultdict(lambda: 0),
-                'partner': defaultdict(lambda: 0),
-                'event': defaultdict(lambda: 0),
-                'other': defaultdict(lambda: 0),
-            }
-            for t in tickets:
-                tt = t.fare.ticket_type
-                date = t.orderitem.order.created.date()
-                offset = date - c.conference_start
-                data[tt][offset.days] += 1
-
-            for k, v in data.items():
-                data[k] = sorted(v.items())
-
-            output[c.code] = {
-                'data': data,
+        for code in codes:
+            output[code] = {
+                'data': {
+                    'conference': [],
+                    'partner': [],
+                    'event': [],
+                    'other': [],
+                },
             }
+        rows = models.TicketSalesDay.objects\
+            .filter(conference__in=codes, count__gt=0)\
+            .order_by('offset_day')\
+            .values_list('conference', 'ticket_type', 'offset_day', 'count')
+        for code, ticket_type, offset_day, count in rows:
+            output[code]['data'][ticket_type].append((offset_day, count))
 
         return http.HttpResponse(json_dumps(output), 'text/javascript')
 
@@ -1288,6 +1277,73 @@ class StreamSetAdmin(admin.ModelAdmin):
         'enabled',
     )
 
+### Mail queue
+
+@admin.register(models.MailBatch)
+class MailBatchAdmin(admin.ModelAdmin):
+    list_display = (
+        'description',
+        'created',
+        '_queued',
+        '_sent',
+        '_failed',
+        'completed',
+    )
+    readonly_fields = (
+        'created',
+        'completed',
+    )
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        status = models.QueuedEmail.STATUS
+        return qs.annotate(
+            queued=Count(
+                'emails',
+                filter=Q(emails__status__in=(status.QUEUED, status.SENDING)),
+            ),
+            sent=Count('emails', filter=Q(emails__status=status.SENT)),
+            failed=Count('emails', filter=Q(emails__status=status.FAILED)),
+        )
+
+    def _queued(self, o):
+        return o.queued
+    _queued.admin_order_field = 'queued'
+
+    def _sent(self, o):
+        return o.sent
+    _sent.admin_order_field = 'sent'
+
+    def _failed(self, o):
+        return o.failed
+    _failed.admin_order_field = 'failed'
+
+
+@admin.register(models.QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = (
+        'to',
+        'subject',
+        'status',
+        'attempts',
+        'sent',
+        'batch',
+    )
+    list_filter = (
+        'status',
+        'batch',
+    )
+    search_fields = (
+        'to',
+        'subject',
+    )
+    readonly_fields = (
+        'created',
+        'attempts',
+        'last_error',
+        'sent',
+    )
+
 ### Old school registrations:
 
 admin.site.register(models.CaptchaQuestion, CaptchaQuestionAdmin)
@@ -19,18 +19,22 @@ from hashlib import md5
 from django.conf.urls import url as re_path
 from django.contrib.auth.hashers import check_password as django_check_password
 from django.contrib.auth.hashers import is_password_usable
-from django.db.models import Q
+from django.db.models import CharField, F, Q, Value
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from assopy.models import Order, OrderItem
+from conference.dataaccess import cache_me
 from conference.models import (
     AttendeeProfile,
     Conference,
-    Speaker,
+    Talk,
     TalkSpeaker,
     Ticket,
+    ticket_reassigned,
 )
 from pycon.settings import MATRIX_AUTH_API_DEBUG as DEBUG
 from pycon.settings import MATRIX_AUTH_API_ALLOWED_IPS as ALLOWED_IPS
+from pycon.settings import MATRIX_AUTH_API_CACHE_TIMEOUT as CACHE_TIMEOUT
 from pycon.settings import SECRET_KEY
 
 
@@ -124,27 +128,101 @@ def check_user_password(user, password):
     return django_check_password(password, user.password)
 
 
-def get_assigned_tickets(user, conference):
+def get_assigned_tickets(user_id, conference):
     return Ticket.objects.filter(
-        Q(fare__conference=conference.code)
+        Q(fare__conference=conference)
         & Q(frozen=False)                   # i.e. the ticket was not cancelled
         & Q(orderitem__order___complete=True)       # i.e. they paid
-        & Q(user=user)                              # i.e. assigned to user
+        & Q(user=user_id)                           # i.e. assigned to user
     )
 
 
-def is_speaker(user, conference):
+def get_accepted_talks(user_id, conference):
     # A speaker is a user with at least one accepted talk in the current
     # conference.
-    try:
-        speaker = user.speaker
-    except Speaker.DoesNotExist:
-        return False
     return TalkSpeaker.objects.filter(
-        speaker=speaker,
-        talk__conference=conference.code,
+        speaker=user_id,
+        talk__conference=conference,
         talk__status='accepted'
-    ).count() > 0
+    )
+
+
+def _kind(value):
+    return Value(value, output_field=CharField())
+
+
+def matrix_entitlement(user_id, conference):
+    """
+    Return the speaker flag and the tickets (fare name and code) of the user
+    in `conference` (a conference code), as used by `isauth`.
+
+    Both are fetched with a single UNION query: a "speaker" row for every
+    accepted talk of the user and a "ticket" row for every assigned ticket.
+    """
+    tickets = get_assigned_tickets(user_id, conference)\
+        .order_by()\
+        .annotate(
+            kind=_kind('ticket'),
+            fare_name=F('fare__name'),
+            fare_code=F('fare__code'))\
+        .values_list('kind', 'fare_name', 'fare_code')
+    talks = get_accepted_talks(user_id, conference)\
+        .order_by()\
+        .annotate(
+            kind=_kind('speaker'),
+            fare_name=_kind(''),
+            fare_code=_kind(''))\
+        .values_list('kind', 'fare_name', 'fare_code')
+
+    entitlement = {'is_speaker': False, 'tickets': []}
+    for kind, fare_name, fare_code in tickets.union(talks, all=True):
+        if kind == 'speaker':
+            entitlement['is_speaker'] = True
+        else:
+            entitlement['tickets'].append(
+                {'fare_name': fare_name, 'fare_code': fare_code})
+    entitlement['tickets'].sort(key=lambda t: t['fare_code'])
+    return entitlement
+
+
+def _i_matrix_entitlement(sender, **kw):
+    o = kw['instance']
+    if sender is Ticket:
+        params = [(o.user_id, o.fare.conference)]
+        # set by ticket_reassigned, or by conference.listeners on save
+        previous_user_id = kw.get(
+            'previous_user_id', getattr(o, '_previous_user_id', None))
+        if previous_user_id not in (None, o.user_id):
+            params.append((previous_user_id, o.fare.conference))
+    elif sender is OrderItem:
+        if o.ticket_id is None:
+            return []
+        params = [(o.ticket.user_id, o.ticket.fare.conference)]
+    elif sender is Order:
+        params = o.orderitem_set\
+            .exclude(ticket=None)\
+            .values_list('ticket__user', 'ticket__fare__conference')\
+            .distinct()
+    elif sender is TalkSpeaker:
+        params = [(o.speaker_id, o.talk.conference)]
+    else:
+        params = [
+            (speaker_id, o.conference)
+            for speaker_id in o.talkspeaker_set.values_list('speaker', flat=True)
+        ]
+    return [
+        'matrix_entitlement:%s:%s' % (uid, conference)
+        for uid, conference in params
+    ]
+
+
+matrix_entitlement = cache_me(
+    signals=(ticket_reassigned,),
+    models=(Ticket, OrderItem, Order, TalkSpeaker, Talk),
+    key='matrix_entitlement:%(user_id)s:%(conference)s',
+    timeout=CACHE_TIMEOUT,
+    # An authorization decision: a revoked entitlement is never served
+    stale=False)(matrix_entitlement, _i_matrix_entitlement)
 
 
 def generate_matrix_password(user):
@@ -233,7 +311,9 @@ def isauth(request):
     # appropriate.
     if 'email' in data:
         try:
-            profile = AttendeeProfile.objects.get(user__email=data['email'])
+            profile = AttendeeProfile.objects\
+                .select_related('user')\
+                .get(user__email=data['email'])
         except AttendeeProfile.DoesNotExist:
             return _error(ApiError.AUTH_ERROR, 'unknown user')
     elif 'username' in data:
@@ -247,7 +327,7 @@ def isauth(request):
             data['username'] = data['username'][1:]
 
         try:
-            profile = AttendeeProfile.objects.get(
+            profile = AttendeeProfile.objects.select_related('user').get(
                 user__username=data['username']
             )
         except AttendeeProfile.DoesNotExist:
@@ -260,19 +340,17 @@ def isauth(request):
         return _error(ApiError.AUTH_ERROR, 'authentication error')
 
     conference = Conference.objects.current()
+    entitlement = matrix_entitlement(profile.user_id, conference.code)
     payload = {
         "username": profile.user.username,
         "first_name": profile.user.first_name,
         "last_name": profile.user.last_name,
         "email": profile.user.email,
         "is_staff": profile.user.is_staff,
-        "is_speaker": is_speaker(profile.user, conference),
+        "is_speaker": entitlement['is_speaker'],
         "is_active": profile.user.is_active,
         "is_minor": profile.is_minor,
-        "tickets": [
-            {"fare_name": t.fare.name, "fare_code": t.fare.code}
-            for t in get_assigned_tickets(profile.user, conference)
-        ]
+        "tickets": entitlement['tickets'],
     }
 
     # Just a little nice to have thing when debugging: we can send in the POST
@@ -1,123 +1,131 @@
 import functools
 import hashlib
+import inspect
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
 
 from django.core.cache import cache
 from django.db.models.signals import pre_delete, post_save
 from django.dispatch import Signal
 
-try:
-    from inspect import getcallargs
-except ImportError:
-    import sys
-    from inspect import getargspec, ismethod
-
-    def getcallargs(func, *positional, **named):
-        """Get the mapping of arguments to values.
-
-        A dict is returned, with keys the function argument names (including the
-        names of the * and ** arguments, if any), and values the respective bound
-        values from 'positional' and 'named'."""
-        args, varargs, varkw, defaults = getargspec(func)
-        f_name = func.__name__
-        arg2value = {}
-
-        # The following closures are basically because of tuple parameter unpacking.
-        assigned_tuple_params = []
-        def assign(arg, value):
-            if isinstance(arg, str):
-                arg2value[arg] = value
-            else:
-                assigned_tuple_params.append(arg)
-                value = iter(value)
-                for i, subarg in enumerate(arg):
-                    try:
-                        subvalue = next(value)
-                    except StopIteration:
-                        raise ValueError('need more than %d %s to unpack' %
-                                        (i, 'values' if i > 1 else 'value'))
-                    assign(subarg,subvalue)
-                try:
-                    next(value)
-                except StopIteration:
-                    pass
-                else:
-                    raise ValueError('too many values to unpack')
-
-        def is_assigned(arg):
-            if isinstance(arg,str):
-                return arg in arg2value
-            return arg in assigned_tuple_params
-        if ismethod(func) and func.__self__ is not None:
-            # implicit 'self' (or 'cls' for classmethods) argument
-            positional = (func.__self__,) + positional
-        num_pos = len(positional)
-        num_total = num_pos + len(named)
-        num_args = len(args)
-        num_defaults = len(defaults) if defaults else 0
-        for arg, value in zip(args, positional):
-            assign(arg, value)
-        if varargs:
-            if num_pos > num_args:
-                assign(varargs, positional[-(num_pos-num_args):])
-            else:
-                assign(varargs, ())
-        elif 0 < num_args < num_pos:
-            raise TypeError('%s() takes %s %d %s (%d given)' % (
-                f_name, 'at most' if defaults else 'exactly', num_args,
-                'arguments' if num_args > 1 else 'argument', num_total))
-        elif num_args == 0 and num_total:
-            if varkw:
-                if num_pos:
-                    # XXX: We should use num_pos, but Python also uses num_total:
-                    raise TypeError('%s() takes exactly 0 arguments '
-                                    '(%d given)' % (f_name, num_total))
-            else:
-                raise TypeError('%s() takes no arguments (%d given)' %
-                                (f_name, num_total))
-        for arg in args:
-            if isinstance(arg, str) and arg in named:
-                if is_assigned(arg):
-                    raise TypeError("%s() got multiple values for keyword "
-                                    "argument '%s'" % (f_name, arg))
-                else:
-                    assign(arg, named.pop(arg))
-        if defaults:    # fill in any missing values with the defaults
-            for arg, value in zip(args[-num_defaults:], defaults):
-                if not is_assigned(arg):
-                    assign(arg, value)
-        if varkw:
-            assign(varkw, named)
-        elif named:
-            unexpected = next(iter(named))
-            if isinstance(unexpected, str):
-                unexpected = unexpected.encode(sys.getdefaultencoding(), 'replace')
-            raise TypeError("%s() got an unexpected keyword argument '%s'" %
-                            (f_name, unexpected))
-        unassigned = num_args - len([arg for arg in args if is_assigned(arg)])
-        if unassigned:
-            num_required = num_args - num_defaults
-            raise TypeError('%s() takes %s %d %s (%d given)' % (
-                f_name, 'at least' if defaults else 'exactly', num_required,
-                'arguments' if num_required > 1 else 'argument', num_total))
-        return arg2value
 
 WEEK = 7 * 24 * 60 * 60
 
+# matches the named placeholders, e.g. "%(tid)s", in a key template
+KEY_PLACEHOLDER = re.compile(r'%\((\w+)\)')
+
+# How long a worker can hold the lease to recompute a key before another one
+# is allowed to take over.
+LEASE_TIMEOUT = 30
+
 cache_invalidated = Signal(providing_args=['keys'])
 
+
+class LocalCache(object):
+    """
+    In-process LRU cache used as the first tier in front of the shared
+    django cache.
+
+    Entries are evicted when the cache grows past `maxsize` (least recently
+    used first) or when their timeout expires.
+
+    Values are stored pickled, like in the shared cache, so every `get`
+    returns a new copy that the caller is free to modify.
+    """
+    def __init__(self, maxsize=1024, timeout=60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires < now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        expires = time.monotonic() + timeout
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for k in keys:
+                self._data.pop(k, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
 class CacheFunction(object):
     CACHE_MISS = object()
 
-    def __init__(self, prefix='', timeout=WEEK, fhash=None, fkey=None):
+    def __init__(self, prefix='', timeout=WEEK, fhash=None, fkey=None,
+                 local_size=0, local_timeout=60, local_check=1,
+                 lease_timeout=0, soft_timeout=None):
         self.prefix = prefix
         self.timeout = timeout
+        # With a lease_timeout, only the worker holding the lease on a
+        # missing key recomputes it, while the others are served the previous
+        # value (kept under a separate "stale" key that survives the
+        # invalidation) or wait for the new one.
+        self.lease_timeout = lease_timeout
+        # With a soft_timeout, values older than soft_timeout seconds are
+        # still served while a single worker refreshes them.
+        self.soft_timeout = soft_timeout
         if fhash is None:
             fhash = self.hash_key
         self.fhash = fhash
+        # keys are built by a function compiled once per decorated function,
+        # unless a custom fkey is given
+        self.compiled_keys = fkey is None
         if fkey is None:
             fkey = self.generate_key
         self.fkey = fkey
 
+        # The local tier lives in the memory of every worker process; to
+        # keep the workers consistent an invalidation bumps a generation
+        # counter stored in the shared cache, every worker checks it (at
+        # most once every `local_check` seconds) and drops its local copies
+        # when it changes.
+        if local_size:
+            self.local = LocalCache(maxsize=local_size, timeout=local_timeout)
+        else:
+            self.local = None
+        self.local_check = local_check
+        self.generation_key = 'cachef:generation:' + prefix
+        self._generation = None
+        self._generation_checked = 0
+        self.hits = 0
+        self.misses = 0
+        cache_invalidated.connect(self._drop_local, sender=self, weak=False)
+
     def __call__(self, *args, **kwargs):
         if args:
             if kwargs or not callable(args[0]):
@@ -126,22 +134,190 @@ class CacheFunction(object):
         else:
             return functools.partial(self._decorator, **kwargs)
 
-    def _decorator(self, func, invalidate=None, key=None, signals=(), models=(), timeout=None):
+    def _drop_local(self, sender, keys, **kwargs):
+        if self.local is None:
+            return
+        self.local.delete_many(keys)
+        try:
+            self._generation = cache.incr(self.generation_key)
+        except ValueError:
+            self._generation = 1
+            cache.set(self.generation_key, self._generation, None)
+
+    def _sync_local(self):
+        now = time.monotonic()
+        if now - self._generation_checked < self.local_check:
+            return
+        self._generation_checked = now
+        generation = cache.get(self.generation_key)
+        if generation != self._generation:
+            self._generation = generation
+            self.local.clear()
+
+    def _get(self, k):
+        if self.local is not None:
+            self._sync_local()
+            data = self.local.get(k, self.CACHE_MISS)
+            if data is not self.CACHE_MISS:
+                return data
+        data = cache.get(k, self.CACHE_MISS)
+        if data is self.CACHE_MISS:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.local is not None:
+                self.local.set(k, data)
+        return data
+
+    def _set(self, k, data, timeout):
+        if self.lease_timeout:
+            cache.set_many({k: data, k + ':stale': data}, timeout)
+        else:
+            cache.set(k, data, timeout)
+        if self.local is not None:
+            self.local.set(k, data, timeout)
+
+    def _set_many(self, data, timeout):
+        if self.lease_timeout:
+            stale = { k + ':stale': v for k, v in data.items() }
+            cache.set_many(dict(data, **stale), timeout)
+        else:
+            cache.set_many(data, timeout)
+        if self.local is not None:
+            for k, v in data.items():
+                self.local.set(k, v, timeout)
+
+    def _get_many(self, keys):
+        results = {}
+        if self.local is not None:
+            self._sync_local()
+            for k in keys:
+                data = self.local.get(k, self.CACHE_MISS)
+                if data is not self.CACHE_MISS:
+                    results[k] = data
+            keys = [ k for k in keys if k not in results ]
+        if keys:
+            shared = cache.get_many(keys)
+            self.hits += len(shared)
+            self.misses += len(keys) - len(shared)
+            if self.local is not None:
+                for k, data in shared.items():
+                    self.local.set(k, data)
+            results.update(shared)
+        return results
+
+    def _acquire(self, k):
+        return cache.add(k + ':lease', 1, self.lease_timeout or LEASE_TIMEOUT)
+
+    def _release(self, k):
+        cache.delete(k + ':lease')
+
+    def _compute(self, k, compute, pack, timeout, stale=True):
+        """
+        Compute the value of a missing key, making sure (in lease mode) that
+        only one worker at a time runs `compute`.
+        """
+        if not self.lease_timeout:
+            data = pack(compute())
+            self._set(k, data, timeout)
+            return data
+
+        if self._acquire(k):
+            try:
+                data = pack(compute())
+                self._set(k, data, timeout)
+            finally:
+                self._release(k)
+            return data
+
+        if stale:
+            data = cache.get(k + ':stale', self.CACHE_MISS)
+            if data is not self.CACHE_MISS:
+                return data
+
+        # there is no previous value to serve, wait for the worker holding the
+        # lease and fall back to computing the value here if it takes too long.
+        deadline = time.monotonic() + self.lease_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            data = cache.get(k, self.CACHE_MISS)
+            if data is not self.CACHE_MISS:
+                return data
+        return pack(compute())
+
+    def stats(self):
+        """
+        Return the hit/miss counters of both the local and the shared tier.
+        """
+        output = {
+            'shared': {
+                'hits': self.hits,
+                'misses': self.misses,
+            },
+        }
+        if self.local is not None:
+            output['local'] = {
+                'hits': self.local.hits,
+                'misses': self.local.misses,
+                'size': len(self.local),
+                'maxsize': self.local.maxsize,
+            }
+        return output
+
+    def _decorator(self, func, invalidate=None, key=None, signals=(), models=(), timeout=None, soft_timeout=None, stale=True):
         if key is None:
             key = func.__name__
             if invalidate is None:
                 invalidate = (func.__name__,)
         if timeout is None:
             timeout = self.timeout
+        # stale=False never serves a value older than the last invalidation,
+        # neither from the lease nor past the soft timeout.
+        if not stale:
+            soft_timeout = None
+        elif soft_timeout is None:
+            soft_timeout = self.soft_timeout
+
+        if self.compiled_keys:
+            make_key = self.compile_key(key, func)
+        else:
+            def make_key(args, kwargs):
+                return self.fhash(self.fkey(key, func, args, kwargs))
+
+        # with a soft timeout the values are stored together with the time
+        # after which they should be refreshed.
+        if soft_timeout is None:
+            def pack(value):
+                return value
+
+            def unpack(data):
+                return data, False
+        else:
+            def pack(value):
+                return (time.time() + soft_timeout, value)
+
+            def unpack(data):
+                refresh_at, value = data
+                return value, refresh_at < time.time()
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            k = self.fhash(self.fkey(key, func, args, kwargs))
-            data = cache.get(k, self.CACHE_MISS)
+            k = make_key(args, kwargs)
+            data = self._get(k)
             if data is self.CACHE_MISS:
-                data = func(*args, **kwargs)
-                cache.set(k, data, timeout)
-            return data
+                data = self._compute(k, lambda: func(*args, **kwargs), pack, timeout, stale)
+                return unpack(data)[0]
+
+            value, expired = unpack(data)
+            if expired and self._acquire(k):
+                # the other workers keep serving the stale value until the
+                # refresh is completed.
+                try:
+                    value = func(*args, **kwargs)
+                    self._set(k, pack(value), timeout)
+                finally:
+                    self._release(k)
+            return value
 
         if invalidate:
             def iwrapper(sender, **kwargs):
@@ -156,7 +332,9 @@ class CacheFunction(object):
                     if isinstance(keys, str):
                         keys = (keys,)
                     prefixed = [ self.prefix + k for k in keys ]
-                    cache.delete_many(list(map(self.fhash, prefixed)))
+                    hashed = list(map(self.fhash, prefixed))
+                    cache.delete_many(hashed)
+                    cache_invalidated.send(self, keys=hashed)
                     wrapper.invalidated.send(wrapper, cache_keys=keys)
 
             for s in signals:
@@ -180,19 +358,76 @@ class CacheFunction(object):
                 else:
                     args = farg
                     kwargs = {}
-                k = self.fhash(self.fkey(key, func, args, kwargs))
+                k = make_key(args, kwargs)
                 cache_keys[k] = (ix, farg)
 
-            results = cache.get_many(list(cache_keys.keys()))
+            results = self._get_many(list(cache_keys.keys()))
             output = [ self.CACHE_MISS ] * len(fargs)
             for k, v in cache_keys.items():
                 ix = v[0]
                 try:
-                    output[ix] = results[k]
+                    output[ix] = unpack(results[k])[0]
                 except KeyError:
                     pass
             return output
+
+        def bulk_loader(loader):
+            """
+            Register the bulk loader used by `many`.
+
+            The loader receives the list of the missing arguments and must
+            return a dict mapping each of them to the `preload` dict passed
+            to the decorated function.
+            """
+            wrapper.loader = loader
+            return loader
+
+        def many(fargs):
+            """
+            Batched version of the decorated function; `fargs` is a list of
+            values for its first argument.
+
+            The cache is queried with a single `get_many`, the misses are
+            loaded together through the registered bulk loader and written
+            back with a single `set_many`.
+            """
+            fargs = list(fargs)
+            keys = [ make_key((farg,), {}) for farg in fargs ]
+            results = {}
+            leased = []
+            for k, data in self._get_many(list(set(keys))).items():
+                value, expired = unpack(data)
+                if expired and self._acquire(k):
+                    leased.append(k)
+                else:
+                    results[k] = value
+
+            missing = {}
+            for farg, k in zip(fargs, keys):
+                if k not in results:
+                    missing.setdefault(k, farg)
+            try:
+                if missing:
+                    if wrapper.loader is not None:
+                        preload = wrapper.loader(list(missing.values()))
+                        computed = {
+                            k: func(farg, preload=preload.get(farg))
+                            for k, farg in missing.items()
+                        }
+                    else:
+                        computed = { k: func(farg) for k, farg in missing.items() }
+                    self._set_many({ k: pack(v) for k, v in computed.items() }, timeout)
+                    results.update(computed)
+            finally:
+                for k in leased:
+                    self._release(k)
+
+            return [ results[k] for k in keys ]
+
         wrapper.get_from_cache = get_from_cache
+        wrapper.loader = None
+        wrapper.bulk_loader = bulk_loader
+        wrapper.many = many
         wrapper.invalidated = Signal(providing_args=['cache_keys'])
         return wrapper
 
@@ -204,9 +439,70 @@ class CacheFunction(object):
     def generate_key(self, key, func, args, kwargs):
         if callable(key):
             return key(func, *args, **kwargs)
-        cargs = getcallargs(func, *args, **kwargs)
+        cargs = inspect.getcallargs(func, *args, **kwargs)
         try:
             k = key % args
         except TypeError:
             k = key % cargs
         return self.prefix + k
+
+    def compile_key(self, key, func):
+        """
+        Return a function that, given the args and kwargs of a call to
+        `func`, returns the hashed cache key; it is equivalent to
+        `fhash(generate_key(...))` but the key template is resolved only once.
+
+        When a call passes, as positional arguments, all the values used by
+        the template the key is built with a single string formatting,
+        otherwise it falls back to `generate_key`.
+        """
+        fhash = self.fhash
+
+        def generic(args, kwargs):
+            return fhash(self.generate_key(key, func, args, kwargs))
+
+        if callable(key):
+            return generic
+
+        names = KEY_PLACEHOLDER.findall(key)
+        if not names:
+            fmt = self.prefix.replace('%', '%%') + key
+            if '%' not in key:
+                def make_key(args, kwargs):
+                    if args or kwargs:
+                        return generic(args, kwargs)
+                    return fhash(fmt)
+                return make_key
+
+            def make_key(args, kwargs):
+                try:
+                    return fhash(fmt % args)
+                except TypeError:
+                    return generic(args, kwargs)
+            return make_key
+
+        positional = [
+            p.name for p in inspect.signature(func).parameters.values()
+            if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+        ]
+        try:
+            indexes = [ positional.index(name) for name in names ]
+        except ValueError:
+            return generic
+
+        fmt = self.prefix.replace('%', '%%') + KEY_PLACEHOLDER.sub('%', key)
+        required = max(indexes) + 1
+
+        if len(indexes) == 1:
+            ix = indexes[0]
+
+            def make_key(args, kwargs):
+                if kwargs or len(args) < required:
+                    return generic(args, kwargs)
+                return fhash(fmt % (args[ix],))
+        else:
+            def make_key(args, kwargs):
+                if kwargs or len(args) < required:
+                    return generic(args, kwargs)
+                return fhash(fmt % tuple(args[ix] for ix in indexes))
+        return make_key
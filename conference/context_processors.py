@@ -1,4 +1,7 @@
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from conference.models import Conference
 
 
 def epcon_ctx(request):
@@ -7,3 +10,16 @@ def epcon_ctx(request):
         'DEFAULT_URL_PREFIX': settings.DEFAULT_URL_PREFIX,
         'CONFERENCE': settings.CONFERENCE_CONFERENCE,
     }
+
+
+def current_conference(request):
+    """
+    Exposes the current conference to the templates, sharing the lookup made
+    for the request by `current_conference_middleware`.
+    """
+    conference = getattr(request, 'conference', None)
+    if conference is None:
+        conference = SimpleLazyObject(Conference.objects.current)
+    return {
+        'CURRENT_CONFERENCE': conference,
+    }
@@ -22,16 +22,32 @@ historical values we can get full XML since 1999 here:
     or as CSV
     https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.zip
 
+and import a downloaded copy with `import_ecb_historical_exrates`).
+
+The rates are read from an in-memory table (see `exrates_table`), loaded from
+the DB once and kept by every process for CONFERENCE_EXRATES_MEMO_TIMEOUT
+seconds; every read checks the number, last id and sum of the stored rates
+with a single aggregate query, so the rates stored by any process are seen
+straight away.
+
 ------------------------------------------------------------------------------
 THIS WHOLE MODULE ASSUMES WE'RE BASING EVERYTHING IN EUROS,
 AND CONVERT EITHER TO OR FROM EUROS. KEEP THAT IN MIND.
 ------------------------------------------------------------------------------
 """
 
+import bisect
+import csv
+import io
+import threading
+import time
+import zipfile
 from datetime import datetime, date
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 
 import requests
+from django.conf import settings
+from django.db.models import Count, Max, Sum
 from lxml import etree as ET
 
 from conference.models import ExchangeRate
@@ -67,6 +83,11 @@ EXAMPLE_ECB_DAILY_XML = """
 
 SUPPORTED_CURRENCIES = ["GBP", "CHF"]
 
+# Namespace of the Cube elements in the ECB XML files
+ECB_XML_NAMESPACE = "http://www.ecb.int/vocabulary/2002-08-01/eurofxref"
+
+IMPORT_BATCH_SIZE = 1000
+
 
 class CurrencyNotSupported(Exception):
     pass
@@ -101,6 +122,91 @@ def fetch_and_store_latest_ecb_exrates():
     return exrates
 
 
+class ExchangeRateTable:
+    """
+    All the stored exchange rates, indexed by currency and date.
+    """
+    def __init__(self, rows):
+        # rows: (currency, datestamp, rate), sorted by currency and datestamp
+        self.dates = {}
+        self.rates = {}
+        for currency, datestamp, rate in rows:
+            self.dates.setdefault(currency, []).append(datestamp)
+            self.rates.setdefault(currency, []).append(rate)
+
+    @classmethod
+    def load(cls):
+        rows = ExchangeRate.objects\
+            .order_by('currency', 'datestamp', 'id')\
+            .values_list('currency', 'datestamp', 'rate')
+        return cls(rows)
+
+    def lookup(self, currency, day=None):
+        """
+        Returns (datestamp, rate) of the latest rate of `currency` published
+        on or before `day` (or at all, if `day` is None).
+
+        Raises ExchangeRate.DoesNotExist if there is no such rate.
+        """
+        dates = self.dates.get(currency, [])
+        if isinstance(day, datetime):
+            day = day.date()
+        if day is None:
+            ix = len(dates)
+        else:
+            ix = bisect.bisect_right(dates, day)
+        if ix == 0:
+            raise ExchangeRate.DoesNotExist(
+                "No %s exchange rate%s" % (
+                    currency, " on %s" % day if day is not None else ""
+                )
+            )
+        return dates[ix - 1], self.rates[currency][ix - 1]
+
+
+_table = None
+_table_loaded = 0
+_table_generation = None
+_table_lock = threading.Lock()
+
+
+def _exrates_generation():
+    # Changes whenever a rate is added, deleted or updated, by any process
+    stats = ExchangeRate.objects.aggregate(
+        count=Count('id'), last=Max('id'), total=Sum('rate'))
+    return stats['count'], stats['last'], stats['total']
+
+
+def exrates_table():
+    """
+    Returns the ExchangeRateTable, loading it if it's missing, older than
+    CONFERENCE_EXRATES_MEMO_TIMEOUT seconds or if the stored rates changed
+    since.
+    """
+    global _table, _table_loaded, _table_generation
+    timeout = settings.CONFERENCE_EXRATES_MEMO_TIMEOUT
+    if timeout <= 0:
+        return ExchangeRateTable.load()
+
+    generation = _exrates_generation()
+    with _table_lock:
+        if (_table is not None
+                and _table_generation == generation
+                and time.monotonic() - _table_loaded < timeout):
+            return _table
+    table = ExchangeRateTable.load()
+    with _table_lock:
+        _table, _table_loaded, _table_generation = \
+            table, time.monotonic(), generation
+    return table
+
+
+def clear_exrates_table(sender=None, **kwargs):
+    global _table
+    with _table_lock:
+        _table = None
+
+
 def get_latest_ecb_rates_from_db(currency):
     # if there are no ExchangeRates cached, this is going to raise
     # DoesNotExist; and we're going to assume there is at least one
@@ -116,11 +222,19 @@ def get_ecb_rates_for_currency(currency):
     """
     Returns tuple with the datestamp and Decimal value of conversion rate.
     """
-    # UPDATE 2018-06-05 -- read directly from the database, and skip caching
     if currency not in SUPPORTED_CURRENCIES:
         raise CurrencyNotSupported("Currently we don't support %s" % currency)
-    exrates = get_latest_ecb_rates_from_db(currency)
-    return (exrates['datestamp'], exrates[currency])
+    return exrates_table().lookup(currency)
+
+
+def get_ecb_rates_for_date(currency, day):
+    """
+    Like get_ecb_rates_for_currency, but returns the rate that was the latest
+    one on `day`.
+    """
+    if currency not in SUPPORTED_CURRENCIES:
+        raise CurrencyNotSupported("Currently we don't support %s" % currency)
+    return exrates_table().lookup(currency, day)
 
 
 def convert_from_EUR_using_latest_exrates(amount_in_eur, to_currency):
@@ -134,3 +248,86 @@ def convert_from_EUR_using_latest_exrates(amount_in_eur, to_currency):
         'using_exrate_date': datestamp,
         'exrate': exrate
     }
+
+
+def parse_ecb_historical_exrates(content):
+    """
+    Parses the ECB historical rates, either the XML (eurofxref-hist.xml), the
+    CSV (eurofxref-hist.csv) or the zip file with the CSV; yields (datestamp,
+    currency, rate) for the supported currencies.
+    """
+    if content.startswith(b'PK'):
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            content = archive.read(archive.namelist()[0])
+
+    if content.lstrip().startswith(b'<'):
+        tree = ET.fromstring(content.strip())
+        for day in tree.iter('{%s}Cube' % ECB_XML_NAMESPACE):
+            if 'time' not in day.attrib:
+                continue
+            datestamp = datetime.strptime(day.attrib['time'], "%Y-%m-%d").date()
+            for item in day:
+                if item.attrib['currency'] in SUPPORTED_CURRENCIES:
+                    yield (
+                        datestamp,
+                        item.attrib['currency'],
+                        Decimal(item.attrib['rate']),
+                    )
+        return
+
+    rows = csv.reader(io.StringIO(content.decode('utf-8-sig')))
+    header = [column.strip() for column in next(rows)]
+    for row in rows:
+        if not row:
+            continue
+        datestamp = datetime.strptime(row[0].strip(), "%Y-%m-%d").date()
+        for currency, value in zip(header[1:], row[1:]):
+            if currency not in SUPPORTED_CURRENCIES:
+                continue
+            try:
+                rate = Decimal(value.strip())
+            except InvalidOperation:
+                # "N/A" before the currency was quoted
+                continue
+            yield datestamp, currency, rate
+
+
+def import_ecb_historical_exrates(path):
+    """
+    Stores the ECB historical rates from the file at `path` (see
+    parse_ecb_historical_exrates), with a few bulk queries.
+
+    Returns the number of created and updated rates.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    existing = {
+        (datestamp, currency): (pk, rate)
+        for pk, datestamp, currency, rate in ExchangeRate.objects.values_list(
+            'pk', 'datestamp', 'currency', 'rate'
+        )
+    }
+    new = []
+    changed = []
+    for datestamp, currency, rate in parse_ecb_historical_exrates(content):
+        rate = rate.quantize(Decimal('0.00001'))
+        if (datestamp, currency) not in existing:
+            existing[datestamp, currency] = (None, rate)
+            new.append(ExchangeRate(
+                datestamp=datestamp, currency=currency, rate=rate
+            ))
+        else:
+            pk, stored = existing[datestamp, currency]
+            if pk is not None and stored != rate:
+                changed.append(ExchangeRate(
+                    pk=pk, datestamp=datestamp, currency=currency, rate=rate
+                ))
+
+    ExchangeRate.objects.bulk_create(new, batch_size=IMPORT_BATCH_SIZE)
+    ExchangeRate.objects.bulk_update(
+        changed, ['rate'], batch_size=IMPORT_BATCH_SIZE
+    )
+    # Bulk queries don't send the signals
+    clear_exrates_table()
+    return len(new), len(changed)
@@ -9,7 +9,12 @@ from conference import cachef
 from conference import models
 
 
-cache_me = cachef.CacheFunction(prefix='conf:')
+cache_me = cachef.CacheFunction(
+    prefix='conf:',
+    local_size=settings.CONFERENCE_CACHEF_LOCAL_SIZE,
+    local_timeout=settings.CONFERENCE_CACHEF_LOCAL_TIMEOUT,
+    lease_timeout=settings.CONFERENCE_CACHEF_LEASE_TIMEOUT,
+)
 
 
 def _dump_fields(o):
@@ -61,13 +66,11 @@ schedule_data = cache_me(
     models=(models.Schedule, models.Track),
     key='schedule:%(sid)s')(schedule_data, _i_schedule_data)
 
-def schedules_data(sids):
-    cached = list(zip(sids, schedule_data.get_from_cache([ (x,) for x in sids ])))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+@schedule_data.bulk_loader
+def _preload_schedules(sids):
     preload = {}
     schedules = models.Schedule.objects\
-        .filter(id__in=missing)
+        .filter(id__in=sids)
     tracks = models.Track.objects\
         .filter(schedule__in=schedules)\
         .order_by('order')
@@ -80,14 +83,10 @@ def schedules_data(sids):
     for t in tracks:
         preload[t.schedule_id]['tracks'].append(t)
 
-    output = []
-    for ix, e in enumerate(cached):
-        sid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = schedule_data(sid, preload=preload[sid])
-        output.append(val)
+    return preload
 
-    return output
+def schedules_data(sids):
+    return schedule_data.many(sids)
 
 def talk_data(tid, preload=None):
     if preload is None:
@@ -154,13 +153,11 @@ talk_data = cache_me(
     models=(models.Talk, models.Speaker, models.TalkSpeaker),
     key='talk_data:%(tid)s')(talk_data, _i_talk_data)
 
-def talks_data(tids):
-    cached = list(zip(tids, talk_data.get_from_cache([ (x,) for x in tids ])))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+@talk_data.bulk_loader
+def _preload_talks(tids):
     preload = {}
     talks = models.Talk.objects\
-        .filter(id__in=missing)
+        .filter(id__in=tids)
     speakers_data = models.TalkSpeaker.objects\
         .filter(talk__in=talks.values('id'))\
         .values('talk', 'speaker', 'helper',)
@@ -177,7 +174,7 @@ def talks_data(tids):
         )
     comment_list = []
     events = models.Event.objects\
-        .filter(talk__in=missing)\
+        .filter(talk__in=tids)\
         .values('talk', 'id')
 
     for t in talks:
@@ -213,14 +210,10 @@ def talks_data(tids):
     # because we need to optimize the number of needed queries.
     profiles_data(pids)
 
-    output = []
-    for ix, e in enumerate(cached):
-        tid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = talk_data(tid, preload=preload[tid])
-        output.append(val)
+    return preload
 
-    return output
+def talks_data(tids):
+    return talk_data.many(tids)
 
 def speaker_data(sid, preload=None):
     if preload is None:
@@ -272,13 +265,11 @@ speaker_data = cache_me(
     models=(models.Speaker, models.Talk, models.TalkSpeaker, models.AttendeeProfile, User),
     key='speaker_data:%(sid)s')(speaker_data, _i_speaker_data)
 
-def speakers_data(sids):
-    cached = list(zip(sids, speaker_data.get_from_cache([ (x,) for x in sids ])))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+@speaker_data.bulk_loader
+def _preload_speakers(sids):
     preload = {}
     speakers = models.Speaker.objects\
-        .filter(user__in=missing)
+        .filter(user__in=sids)
     talks = models.TalkSpeaker.objects\
         .filter(speaker__in=speakers.values('user'))\
         .values('speaker', 'talk__id', 'talk__title', 'talk__slug', 'talk__conference', 'talk__type')
@@ -297,14 +288,10 @@ def speakers_data(sids):
             'talk__type': t['talk__type'],
         })
 
-    output = []
-    for ix, e in enumerate(cached):
-        sid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = speaker_data(sid, preload=preload[sid])
-        output.append(val)
+    return preload
 
-    return output
+def speakers_data(sids):
+    return speaker_data.many(sids)
 
 def event_data(eid, preload=None):
     if preload is None:
@@ -391,19 +378,11 @@ tags = cache_me(
     models=(models.ConferenceTaggedItem,))(tags)
 
 
-def events(eids=None, conf=None):
-    if eids is None:
-        eids = models.Event.objects\
-            .filter(schedule__conference=conf)\
-            .values_list('id', flat=True)\
-            .order_by('start_time')
-
-    cached = list(zip(eids, event_data.get_from_cache([ (x,) for x in eids ])))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+@event_data.bulk_loader
+def _preload_events(eids):
     preload = {}
     events = models.Event.objects\
-        .filter(id__in=missing)\
+        .filter(id__in=eids)\
         .select_related('sponsor')
     tracks = models.EventTrack.objects\
         .filter(event__in=events)\
@@ -429,14 +408,16 @@ def events(eids=None, conf=None):
             .values_list('id', flat=True)
     )
 
-    output = []
-    for ix, e in enumerate(cached):
-        eid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = event_data(eid, preload=preload[eid])
-        output.append(val)
+    return preload
 
-    return output
+def events(eids=None, conf=None):
+    if eids is None:
+        eids = models.Event.objects\
+            .filter(schedule__conference=conf)\
+            .values_list('id', flat=True)\
+            .order_by('start_time')
+
+    return event_data.many(eids)
 
 def _i_profile_data(sender, **kw):
     if sender is models.AttendeeProfile:
@@ -520,21 +501,19 @@ profile_data = cache_me(
     models=(models.AttendeeProfile, models.Speaker, models.TalkSpeaker, User),
     key='profile:%(uid)s')(profile_data, _i_profile_data)
 
-def profiles_data(pids):
-    cached = list(zip(pids, profile_data.get_from_cache([ (x,) for x in pids ])))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+@profile_data.bulk_loader
+def _preload_profiles(pids):
     preload = {}
     profiles = models.AttendeeProfile.objects\
-        .filter(user__in=missing)\
+        .filter(user__in=pids)\
         .select_related('user')
     talks = models.TalkSpeaker.objects\
-        .filter(speaker__in=missing)\
+        .filter(speaker__in=pids)\
         .values('speaker', 'talk', 'talk__status', 'talk__conference')
     bios = models.MultilingualContent.objects\
         .filter(
             content_type=ContentType.objects.get_for_model(models.AttendeeProfile),
-            object_id__in=missing,
+            object_id__in=pids,
         )
     for p in profiles:
         preload[p.user_id] = {'profile': p, 'talks': [], 'bio': None}
@@ -545,11 +524,7 @@ def profiles_data(pids):
     for b in bios:
         preload[b.object_id]['bio'] = b
 
-    output = []
-    for ix, e in enumerate(cached):
-        pid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = profile_data(pid, preload=preload[pid])
-        output.append(val)
+    return preload
 
-    return output
+def profiles_data(pids):
+    return profile_data.many(pids)
@@ -3,6 +3,7 @@ Things in this file are related to a special debug panel that helps us debug
 things in production.
 """
 import datetime
+import json
 import platform
 import subprocess
 
@@ -11,7 +12,8 @@ from django.conf.urls import url as re_path
 from django import forms
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import HttpResponse, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 from django.template.response import TemplateResponse
 from django.template.loader import render_to_string
 from django.shortcuts import redirect
@@ -28,11 +30,12 @@ from conference.invoicing import (
     next_invoice_code_for_year,
     render_invoice_as_html,
     export_invoices_to_tax_report,
-    export_invoices_to_tax_report_csv,
+    iter_invoices_to_tax_report_csv,
     export_invoices_for_payment_reconciliation,
     extract_customer_info,
 )
 from conference.models import Fare, Conference
+from conference import dataaccess
 from conference.fares import (
     set_early_bird_fare_dates,
     set_regular_fare_dates,
@@ -91,6 +94,7 @@ def debug_panel_index(request):
          sold_training_tickets_including_combined_tickets(
              conference_code=settings.CONFERENCE_CONFERENCE,
          ).count()),
+        ('CACHEF_conf_stats',   dataaccess.cache_me.stats()),
     ]
 
     allowed_settings = [
@@ -202,29 +206,36 @@ def debug_panel_invoice_export_for_tax_report(request):
 
 @staff_member_required
 def debug_panel_invoice_export_for_tax_report_csv(request):
-    response = HttpResponse(content_type='text/csv')
+    start_date, end_date = get_start_end_dates(request)
+    response = StreamingHttpResponse(
+        iter_invoices_to_tax_report_csv(start_date, end_date),
+        content_type='text/csv',
+    )
     response['Content-Disposition'] =\
         'attachment; filename="export-invoices.csv"'
 
-    start_date, end_date = get_start_end_dates(request)
-    export_invoices_to_tax_report_csv(response, start_date, end_date)
-
     return response
 
 
 @staff_member_required
 def debug_panel_invoice_export_for_payment_reconciliation_json(request):
     start_date, end_date = get_start_end_dates(request)
-    response = JsonResponse({
-        # list() to flatten the generator – otherwise it's not serilizable
-        'invoices': list(export_invoices_for_payment_reconciliation(
+
+    def stream():
+        # Same document JsonResponse would build ({"invoices": [...]}), but
+        # written out one invoice at a time.
+        yield '{"invoices": ['
+        invoices = export_invoices_for_payment_reconciliation(
             start_date, end_date
-        ))
-    })
+        )
+        for i, invoice in enumerate(invoices):
+            yield (', ' if i else '') + json.dumps(invoice, cls=DjangoJSONEncoder)
+        yield ']}'
+
+    response = StreamingHttpResponse(stream(), content_type='application/json')
     response['Content-Disposition'] =\
         'attachment; filename="export-invoices.json"'
 
-    # TODO: this json maybe big, maybe we could use StreamingHttpResponse?
     return response
 
 
@@ -12,7 +12,7 @@ from django.utils.translation import ugettext as _
 from taggit.forms import TagField
 
 from p3 import utils as p3utils
-from conference import models
+from conference import mailqueue, models
 
 
 REL_AGR_URL = 'https://epstage.europython.eu/events/speaker-release-agreement/'
@@ -24,36 +24,6 @@ RELEASE_AGREEMENT_CHECKBOX = (
 
 log = logging.getLogger('conference.tags')
 
-### Helpers
-
-def mass_mail(messages, data, addresses, feedback_address):
-
-    # Mass send the emails
-    mail.send_mass_mail(messages)
-
-    # Send feedback mail
-    ctx = dict(data)
-    ctx['addresses'] = '\n'.join(addresses)
-    feedback_email = ("""
-message sent
--------------------------------
-FROM: %(from_)s
-SUBJECT: %(subject)s
-BODY:
-%(body)s
--------------------------------
-sent to:
-%(addresses)s
-""" % ctx)
-    mail.send_mail(
-        '[%s] feedback mass mailing (admin stats)' % settings.CONFERENCE_CONFERENCE,
-        feedback_email,
-        settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[feedback_address],
-     )
-
-###
-
 def validate_tags(tags):
     """
     Returns only tags that are already present in the database
@@ -292,25 +262,23 @@ class AdminSendMailForm(forms.Form):
         return output
 
     def send_emails(self, uids, feedback_address):
-        messages = []
-        addresses = []
+        """
+        Queues the emails for the users in `uids` (see conference.mailqueue);
+        the report is sent to `feedback_address` once they are all processed.
+        """
         data = self.cleaned_data
 
         # Make sure we don't send duplicate emails to the same uid
         uids = list(set(uids))
 
-        # Prepare emails
-        for sbj, body, user in self.preview(*uids):
-            messages.append((sbj, body, data['from_'], [user.email]))
-            addresses.append('"%s %s" - %s' % (user.first_name, user.last_name, user.email))
-
-        # Mass send the emails (in a separate process)
-        import multiprocessing
-        process = multiprocessing.Process(
-            target=mass_mail,
-            args=(messages, data, addresses, feedback_address))
-        process.daemon=True
-        process.start()
-        # Let it run until completion without joining it again
-        process = None
-        return len(messages)
+        batch = models.MailBatch.objects.create(
+            description=(
+                'mass mailing (admin stats): %s' % data['subject']
+            )[:255],
+            feedback_address=feedback_address,
+        )
+        messages = [
+            mail.EmailMessage(sbj, body, data['from_'], [user.email])
+            for sbj, body, user in self.preview(*uids)
+        ]
+        return mailqueue.enqueue(messages, batch=batch)
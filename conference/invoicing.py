@@ -8,20 +8,26 @@ This module handles all things related to creating a new invoice, including
 * rendering PDFs of the invoice.
 """
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from decimal import Decimal
+from functools import partial
 
 import unicodecsv as csv
 
 from django.template.loader import render_to_string
-from django.db.models import Max
+from django.db.models import F, Max, prefetch_related_objects
 from django.db import transaction
 from django.utils import timezone
 
-from assopy.models import Invoice, Order
+from assopy.models import Invoice, InvoiceLog, Order
+from common import pdfcache
 
-from conference.models import Conference
+from conference import sequences
+from conference.models import Conference, ExchangeRate
 from conference.currencies import (
-    convert_from_EUR_using_latest_exrates,
+    get_ecb_rates_for_currency,
+    get_ecb_rates_for_date,
     normalize_price
 )
 
@@ -118,6 +124,9 @@ invoice_code_templates = {
     FAKE_INVOICE_PREFIX: "F/%(year_two_digits)s.%(sequential_id)s",
 }
 
+# Threads rendering the HTML of the invoices created in bulk
+RENDER_WORKERS = 4
+
 VAT_NOT_AVAILABLE_PLACEHOLDER = """
 VAT invoices will be generated as soon as we have been issued a VAT ID.
 Please stay tuned.
@@ -151,17 +160,26 @@ def latest_invoice_code_for_year(prefix, year):
     return invoices.aggregate(max=Max('code'))['max']
 
 
-def next_invoice_code_for_year(prefix, year):
+def reserve_invoice_codes(prefix, year, count):
+    """
+    Returns `count` consecutive new invoice codes; they are released if the
+    current transaction is rolled back.
+    """
     assert prefix in [REAL_INVOICE_PREFIX, FAKE_INVOICE_PREFIX]
 
-    current_code = latest_invoice_code_for_year(prefix, year)
-    if current_code:
-        next_code = increment_invoice_code(current_code)
-        return next_code
+    def last_used_number():
+        # Only used once a year, to start the sequence after the invoices
+        # created before it existed
+        current_code = latest_invoice_code_for_year(prefix, year)
+        return sequences.code_number(current_code) if current_code else 0
 
-    # if there are no current codes, return the first one
+    numbers = sequences.reserve(prefix, year, count, initial=last_used_number)
     template = invoice_code_templates[prefix]
-    return template % {'year_two_digits': year % 1000, 'sequential_id': '0001'}
+    return [sequences.format_code(template, year, n) for n in numbers]
+
+
+def next_invoice_code_for_year(prefix, year):
+    return reserve_invoice_codes(prefix, year, 1)[0]
 
 
 def extract_customer_info(order):
@@ -184,86 +202,212 @@ def extract_customer_info(order):
 
 def create_invoices_for_order(order):
     assert isinstance(order, Order)
+    # Called in the request/response cycle of the payment: the thread pool
+    # is only worth it for the batches.
+    return create_invoices_for_orders([order], workers=1)
+
+
+def _exrate_on(currency, day):
+    """
+    The exchange rate in force on the emit date of an invoice (the latest
+    one published on or before `day`), so that the invoices of past orders
+    get the rate of their date; the latest one if the stored rates don't go
+    that far back.
+    """
+    try:
+        return get_ecb_rates_for_date(currency, day)
+    except ExchangeRate.DoesNotExist:
+        return get_ecb_rates_for_currency(currency)
 
-    payment_date = order.payment_date
-    emit_date = payment_date if payment_date else order.created
-    prefix = REAL_INVOICE_PREFIX if payment_date else FAKE_INVOICE_PREFIX
 
-    # First transaction takes care of "create all invoices or nothing"
-    # Making it more reliable and threadsafe
+def create_invoices_for_orders(orders, workers=RENDER_WORKERS):
+    """
+    Creates the invoices (one per VAT rate) of all the `orders` and returns
+    them.
+
+    The order items, VAT rates and countries of the orders are loaded
+    together, the exchange rate is looked up once per currency and day, the
+    codes of every (prefix, year) are reserved as a single block and the
+    invoices are inserted with one query; the HTML is rendered by `workers`
+    threads.
+    """
+    orders = list(orders)
+    prefetch_related_objects(orders, 'country', 'orderitem_set__vat')
+
+    # The transaction takes care of "create all invoices or nothing"; the
+    # codes are reserved in it, so they are released on failure as well.
     with transaction.atomic():
 
-        invoices = []
-        for vat_item in order.vat_list():
-            # Second, nested, transaction is here because otherwise getting new
-            # invoice_code wouldn't work with database fetch, we would need to
-            # increment it manually. (hence another transaction per item)
-            with transaction.atomic():
-
-                code = next_invoice_code_for_year(
-                    prefix=prefix,
-                    year=emit_date.year
+        lines = []
+        blocks = OrderedDict()
+        for order in orders:
+            payment_date = order.payment_date
+            emit_date = payment_date if payment_date else order.created
+            prefix = REAL_INVOICE_PREFIX if payment_date else FAKE_INVOICE_PREFIX
+            for vat_item in order.vat_list():
+                lines.append((order, vat_item, emit_date))
+                blocks.setdefault((prefix, emit_date.year), []).append(
+                    len(lines) - 1
                 )
 
-                gross_price = vat_item['price']
-                vat_rate    = 1 + vat_item['vat'].value / 100
-                net_price   = normalize_price(vat_item['price'] / vat_rate)
-                vat_price   = vat_item['price'] - net_price
-
-                currency = LOCAL_CURRENCY_BY_YEAR[emit_date.year]
-                if currency != 'EUR':
-                    conversion = convert_from_EUR_using_latest_exrates(
-                        vat_price, currency
-                    )
-                else:
-                    conversion = {
-                        'currency': 'EUR',
-                        'converted': vat_price,
-                        'exrate': Decimal('1.0'),
-                        'using_exrate_date': emit_date,
-                    }
-
-                customer = extract_customer_info(order)
-
-                invoice, _ = Invoice.objects.update_or_create(
-                    order=order,
-                    code=code,
-                    defaults={
-                        'issuer':         ISSUER_BY_YEAR[emit_date.year],
-                        'customer':       customer,
-                        'vat':            vat_item['vat'],
-                        'price':          gross_price,
-                        'payment_date':   payment_date,
-                        'emit_date':      emit_date,
-                        'local_currency': currency,
-                        'vat_in_local_currency': conversion['converted'],
-                        'exchange_rate':  conversion['exrate'],
-                        'exchange_rate_date': conversion['using_exrate_date'],
-                    }
-                )
+        codes = [None] * len(lines)
+        for (prefix, year), positions in blocks.items():
+            block = reserve_invoice_codes(prefix, year, len(positions))
+            for ix, code in zip(positions, block):
+                codes[ix] = code
+
+        exrates = {}
+        invoices = []
+        for (order, vat_item, emit_date), code in zip(lines, codes):
+            gross_price = vat_item['price']
+            vat_rate    = 1 + vat_item['vat'].value / 100
+            net_price   = normalize_price(vat_item['price'] / vat_rate)
+            vat_price   = vat_item['price'] - net_price
+
+            currency = LOCAL_CURRENCY_BY_YEAR[emit_date.year]
+            if currency != 'EUR':
+                day = emit_date.date() if isinstance(emit_date, datetime) else emit_date
+                if (currency, day) not in exrates:
+                    exrates[currency, day] = _exrate_on(currency, day)
+                exrate_date, exrate = exrates[currency, day]
+                conversion = {
+                    'converted': normalize_price(vat_price * exrate),
+                    'exrate': exrate,
+                    'using_exrate_date': exrate_date,
+                }
+            else:
+                conversion = {
+                    'currency': 'EUR',
+                    'converted': vat_price,
+                    'exrate': Decimal('1.0'),
+                    'using_exrate_date': emit_date,
+                }
+
+            invoice = Invoice(
+                order=order,
+                code=code,
+                issuer=ISSUER_BY_YEAR[emit_date.year],
+                customer=extract_customer_info(order),
+                vat=vat_item['vat'],
+                price=gross_price,
+                payment_date=order.payment_date,
+                emit_date=emit_date,
+                local_currency=currency,
+                vat_in_local_currency=conversion['converted'],
+                exchange_rate=conversion['exrate'],
+                exchange_rate_date=conversion['using_exrate_date'],
+            )
+
+            assert invoice.net_price() == net_price
+            assert invoice.vat_value() == vat_price
+
+            invoices.append((invoice, vat_item['orderItems']))
+
+        conference = Conference.objects.current()
+        htmls = _render_invoices(
+            [
+                _invoice_context(invoice, _invoice_items(order_items), conference)
+                for invoice, order_items in invoices
+            ],
+            workers,
+        )
+        invoices = [invoice for invoice, _ in invoices]
+        for invoice, html in zip(invoices, htmls):
+            invoice.html = html
+
+        Invoice.objects.bulk_create(invoices)
+        _after_invoices_saved(invoices, created=True)
+
+    return invoices
 
-                invoice.html = render_invoice_as_html(invoice)
-                invoice.save()
 
-                assert invoice.net_price() == net_price
-                assert invoice.vat_value() == vat_price
+def upgrade_invoice_placeholders(invoices, workers=RENDER_WORKERS):
+    """
+    Renders again the HTML of the (placeholder) `invoices` and saves it in
+    place, with one query; returns the invoices.
+    """
+    invoices = list(invoices)
+    prefetch_related_objects(
+        invoices, 'vat', 'order__country', 'order__orderitem_set'
+    )
+    conference = Conference.objects.current()
+    contexts = []
+    for invoice in invoices:
+        order_items = [
+            item for item in invoice.order.orderitem_set.all()
+            if item.vat_id == invoice.vat_id
+        ]
+        contexts.append(
+            _invoice_context(invoice, _invoice_items(order_items), conference)
+        )
 
-                invoices.append(invoice)
+    with transaction.atomic():
+        for invoice, html in zip(invoices, _render_invoices(contexts, workers)):
+            invoice.html = html
+        Invoice.objects.bulk_update(invoices, ['html'])
+        _after_invoices_saved(invoices, created=False)
 
     return invoices
 
 
-def render_invoice_as_html(invoice):
-    assert isinstance(invoice, Invoice)
+def _after_invoices_saved(invoices, created):
+    # What Invoice.save and its post_save handler would do for every invoice
+    if created:
+        ids = dict(
+            Invoice.objects
+            .filter(code__in=[invoice.code for invoice in invoices])
+            .values_list('code', 'id')
+        )
+        for invoice in invoices:
+            invoice.id = ids[invoice.code]
+        InvoiceLog.objects.bulk_create(
+            InvoiceLog(order=invoice.order, code=invoice.code, invoice=invoice)
+            for invoice in invoices
+        )
+
+        completed = OrderedDict(
+            (invoice.order.id, invoice.order)
+            for invoice in invoices
+            if is_real_invoice_code(invoice.code)
+        )
+        for order in completed.values():
+            getattr(order, '_prefetched_objects_cache', {}).pop('invoices', None)
+        prefetch_related_objects(list(completed.values()), 'invoices')
+        for order in completed.values():
+            order.complete(ignore_cache=True)
+
+    for invoice in invoices:
+        transaction.on_commit(
+            partial(pdfcache.render_in_background, invoice.html)
+        )
+
 
-    items = invoice.invoice_items()
+def _invoice_items(order_items):
+    """
+    Same as Invoice.invoice_items, computed from the order items of the
+    invoice.
+    """
+    items = OrderedDict()
+    for order_item in order_items:
+        key = (order_item.code, order_item.description)
+        if key not in items:
+            items[key] = {
+                'code': order_item.code,
+                'description': order_item.description,
+                'count': 0,
+                'price': 0,
+            }
+        items[key]['count'] += 1
+        items[key]['price'] += order_item.price
+    return sorted(items.values(), key=lambda item: item['price'], reverse=True)
+
+
+def _invoice_context(invoice, items, conference):
     for item in items:
         item['net_price'] = normalize_price(
             item['price'] / (1 + invoice.vat.value / 100)
         )
 
-    conference = Conference.objects.current()
-
     # TODO this is copied as-is from assopy/views.py, but can be simplified
     # TODO: also if there are any images included in the invoice make sure to
     # base64 them.
@@ -272,8 +416,8 @@ def render_invoice_as_html(invoice):
     address = '%s, %s' % (order.address, str(order.country))
     # TODO: why, instead of passing invoice objects, it explicitly passes
     # every attribute?
-    ctx = {
-        'conference_name': Conference.objects.current().name,
+    return {
+        'conference_name': conference.name,
         "conference_location": EP_CITY_FOR_YEAR[invoice.emit_date.year],
         "bank_info": "",
         "currency": invoice.local_currency,
@@ -307,6 +451,26 @@ def render_invoice_as_html(invoice):
 
     }
 
+
+def _render_invoices(contexts, workers):
+    # The contexts are built from objects already loaded, so that the
+    # templates can be rendered outside of the current thread (and of its
+    # database transaction).
+    def render(ctx):
+        return render_to_string('assopy/invoice.html', ctx)
+
+    if workers <= 1 or len(contexts) <= 1:
+        return [render(ctx) for ctx in contexts]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(render, contexts))
+
+
+def render_invoice_as_html(invoice):
+    assert isinstance(invoice, Invoice)
+
+    ctx = _invoice_context(
+        invoice, list(invoice.invoice_items()), Conference.objects.current()
+    )
     return render_to_string('assopy/invoice.html', ctx)
 
 
@@ -328,68 +492,125 @@ CSV_REPORT_COLUMNS = [
 CSV_2018_REPORT_COLUMNS = CSV_REPORT_COLUMNS
 
 
-def export_invoices_to_tax_report(start_date, end_date=None):
+class _LineBuffer:
+    """
+    File-like object collecting what a csv writer writes, so that the output
+    can be handed out row by row (eg. to a StreamingHttpResponse).
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def pop(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _invoices_for_export(start_date, end_date=None):
+    """
+    Returns all the invoices emitted in the given period as plain dicts,
+    including the order/buyer fields needed by the exports. This is a single
+    joined query, iterated without caching the rows.
+    """
     if end_date is None:
         end_date = timezone.now().date()
 
-    invoices = Invoice.objects.filter(
-        emit_date__range=(start_date, end_date),
+    return (
+        Invoice.objects
+        .filter(emit_date__range=(start_date, end_date))
+        .order_by('emit_date', 'id')
+        .values(
+            'id',
+            'code',
+            'emit_date',
+            'price',
+            'local_currency',
+            'vat_in_local_currency',
+            'exchange_rate',
+            vat_rate=F('vat__value'),
+            order_code=F('order__code'),
+            order_card_name=F('order__card_name'),
+            order_address=F('order__address'),
+            order_vat_number=F('order__vat_number'),
+            order_stripe_charge_id=F('order__stripe_charge_id'),
+            country_name=F('order__country__name'),
+            buyer_first_name=F('order__user__user__first_name'),
+            buyer_last_name=F('order__user__user__last_name'),
+        )
+        .iterator()
     )
-    for invoice in invoices:
+
+
+def export_invoices_to_tax_report(start_date, end_date=None):
+    for invoice in _invoices_for_export(start_date, end_date):
+        # Same as Invoice.price_in_local_currency and
+        # Invoice.net_price_in_local_currency, computed from the row.
+        price_in_local_currency = normalize_price(
+            invoice['price'] * invoice['exchange_rate']
+        )
+
         # Building it that way because of possible holes in the data (like in
         # the case of the country)
         output = OrderedDict()
-        output["ID"] = invoice.code
-        output['Emit Date']     = invoice.emit_date.strftime("%Y-%m-%d")
+        output["ID"] = invoice['code']
+        output['Emit Date']     = invoice['emit_date'].strftime("%Y-%m-%d")
         # This may be wrong if we assign ticket to another attendee
-        output['Buyer Name'] = invoice.order.user.user.get_full_name()
-        output['Business Name'] = invoice.order.card_name
-        output['Address']       = invoice.order.address
-        try:
-            output['Country']   = invoice.order.country.name
-        except AttributeError:
-            # If country is None, then .name would cause AttributeError
-            output['Country']   = ""
-
-        output['VAT ID']        = invoice.order.vat_number
-        output['Currency']      = invoice.local_currency
+        output['Buyer Name'] = ('%s %s' % (
+            invoice['buyer_first_name'], invoice['buyer_last_name']
+        )).strip()
+        output['Business Name'] = invoice['order_card_name']
+        output['Address']       = invoice['order_address']
+        # If the order has no country the joined name is None
+        output['Country']       = invoice['country_name'] or ""
+        output['VAT ID']        = invoice['order_vat_number']
+        output['Currency']      = invoice['local_currency']
         output['Net Price'] =\
-            invoice.net_price_in_local_currency
+            price_in_local_currency - invoice['vat_in_local_currency']
         output['VAT'] =\
-            invoice.vat_in_local_currency
+            invoice['vat_in_local_currency']
         output['Gross Price'] =\
-            invoice.price_in_local_currency
+            price_in_local_currency
 
         yield invoice, output
 
 
-def export_invoices_to_tax_report_csv(fp, start_date, end_date=None):
-    writer = csv.DictWriter(fp, CSV_REPORT_COLUMNS, quoting=csv.QUOTE_ALL)
+def iter_invoices_to_tax_report_csv(start_date, end_date=None):
+    """
+    Yields the tax report as encoded CSV lines, header first.
+    """
+    buffer = _LineBuffer()
+    writer = csv.DictWriter(buffer, CSV_REPORT_COLUMNS, quoting=csv.QUOTE_ALL)
     writer.writeheader()
+    yield buffer.pop()
 
     for invoice, to_export in export_invoices_to_tax_report(
         start_date, end_date
     ):
         writer.writerow(to_export)
+        yield buffer.pop()
 
 
-def export_invoices_for_payment_reconciliation(start_date, end_date=None):
-    if end_date is None:
-        end_date = timezone.now().date()
+def export_invoices_to_tax_report_csv(fp, start_date, end_date=None):
+    for line in iter_invoices_to_tax_report_csv(start_date, end_date):
+        fp.write(line)
 
-    invoices = Invoice.objects.filter(
-        emit_date__range=(start_date, end_date),
-    )
-    for invoice in invoices:
-        # Building it that way because of possible holes in the data (like in
-        # the case of the country)
+
+def export_invoices_for_payment_reconciliation(start_date, end_date=None):
+    for invoice in _invoices_for_export(start_date, end_date):
+        # Same as Invoice.net_price and Invoice.vat_value, computed from the
+        # row.
+        net_price = normalize_price(
+            invoice['price'] / (1 + invoice['vat_rate'] / 100)
+        )
         output = {
-            'ID': invoice.code,
-            'net': str(invoice.net_price()),
-            'vat': str(invoice.vat_value()),
-            'gross': str(invoice.price),
-            'order': invoice.order.code,
-            'stripe': invoice.order.stripe_charge_id,
+            'ID': invoice['code'],
+            'net': str(net_price),
+            'vat': str(invoice['price'] - net_price),
+            'gross': str(invoice['price']),
+            'order': invoice['order_code'],
+            'stripe': invoice['order_stripe_charge_id'],
         }
 
         yield output
@@ -1,7 +1,13 @@
-from conference.models import Talk, Event, TalkSpeaker, AttendeeProfile, ConferenceManager, Conference
+from conference.currencies import clear_exrates_table
+from conference.models import Talk, Event, TalkSpeaker, AttendeeProfile, ConferenceManager, Conference, VotoTalk, ExchangeRate, Ticket
+from conference.social_card import render_social_card_in_background
+from conference.tickets import update_ticket_sales
+from conference.utils import add_talk_to_pairwise_tally, update_pairwise_tally
+from assopy.models import Order
 
 from django.dispatch import Signal
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 
 import logging
 
@@ -48,3 +54,104 @@ post_save.connect(on_talk_saved, sender=TalkSpeaker)
 post_save.connect(on_talk_saved, sender=Event)
 
 post_save.connect(ConferenceManager.clear_cache, sender=Conference)
+
+post_save.connect(clear_exrates_table, sender=ExchangeRate)
+post_delete.connect(clear_exrates_table, sender=ExchangeRate)
+
+
+def on_vote_changing(sender, instance, **kw):
+    """
+    Remember the previous value of the vote, used by `on_vote_saved`.
+    """
+    if instance.pk:
+        instance._previous_vote = VotoTalk.objects\
+            .filter(pk=instance.pk)\
+            .values_list('vote', flat=True)\
+            .first()
+    else:
+        instance._previous_vote = None
+
+
+def on_vote_saved(sender, instance, **kw):
+    update_pairwise_tally(
+        instance.user_id, instance.talk_id,
+        getattr(instance, '_previous_vote', None), instance.vote,
+    )
+
+
+def on_vote_deleting(sender, instance, **kw):
+    """
+    The votes deleted by a queryset (or a cascade) don't go through
+    VotoTalk.delete: take the voter lock before they're gone.
+    """
+    VotoTalk.lock_voter(instance.user_id)
+
+
+def on_vote_deleted(sender, instance, **kw):
+    update_pairwise_tally(instance.user_id, instance.talk_id, instance.vote, None)
+
+
+def on_talk_created(sender, instance, created, raw=False, **kw):
+    """
+    A new talk counts as not voted (TALLY_MISSING_VOTE) by everybody.
+    """
+    if created and not raw:
+        add_talk_to_pairwise_tally(instance)
+
+
+pre_save.connect(on_vote_changing, sender=VotoTalk)
+post_save.connect(on_vote_saved, sender=VotoTalk)
+pre_delete.connect(on_vote_deleting, sender=VotoTalk)
+post_delete.connect(on_vote_deleted, sender=VotoTalk)
+post_save.connect(on_talk_created, sender=Talk)
+
+
+def on_ticket_changing(sender, instance, raw=False, **kw):
+    """
+    Remember the previous owner of the ticket, so that the caches of the
+    user losing it (see conference.api.matrix_entitlement) are invalidated
+    too, whoever changes it.
+    """
+    if instance.pk and not raw:
+        instance._previous_user_id = Ticket.objects\
+            .filter(pk=instance.pk)\
+            .values_list('user', flat=True)\
+            .first()
+    else:
+        instance._previous_user_id = None
+
+
+pre_save.connect(on_ticket_changing, sender=Ticket)
+
+
+def on_order_saved(sender, instance, **kw):
+    """
+    Keep the TicketSalesDay rollup up to date: the tickets of an order are
+    counted once the order completes, or straight away for bank/admin orders.
+    """
+    if instance._complete or instance.method in ('bank', 'admin'):
+        update_ticket_sales(instance)
+
+
+post_save.connect(on_order_saved, sender=Order)
+
+
+def on_talk_card_changed(sender, instance, **kw):
+    """
+    Render the social card again if the title or the speakers of the talk
+    changed (the new card has a different name, see conference.social_card).
+    """
+    talk_id = instance.id if sender is Talk else instance.talk_id
+
+    def render():
+        # The talk may be gone by now (eg. the speakers are deleted with it)
+        talk = Talk.objects.filter(id=talk_id).first()
+        if talk is not None:
+            render_social_card_in_background(talk)
+
+    transaction.on_commit(render)
+
+
+post_save.connect(on_talk_card_changed, sender=Talk)
+post_save.connect(on_talk_card_changed, sender=TalkSpeaker)
+post_delete.connect(on_talk_card_changed, sender=TalkSpeaker)
@@ -0,0 +1,214 @@
+"""
+Outbound mail queue.
+
+Emails are stored as QueuedEmail rows (optionally grouped in a MailBatch) by
+`enqueue`, and delivered by `send_queued` (see the send_queued_emails
+command): the messages are sent over a single connection of the
+EMAIL_BACKEND, at most CONFERENCE_MAIL_QUEUE_RATE per second, and the outcome
+is recorded on every row. A message that couldn't be sent is retried by the
+next runs, up to CONFERENCE_MAIL_QUEUE_MAX_ATTEMPTS times.
+
+Every email is claimed (moved to SENDING) by a worker before it is sent, so
+that it is sent once even when more workers run at the same time; the emails
+left in SENDING by a worker that died have to be queued again from the admin.
+
+Only plain text messages are supported.
+"""
+import logging
+import smtplib
+import time
+
+from django.conf import settings
+from django.core import mail
+from django.db.models import F
+from django.utils import timezone
+
+from conference.models import MailBatch, QueuedEmail
+
+log = logging.getLogger('conference.mailqueue')
+
+# Number of queued emails loaded at once by the worker
+SEND_CHUNK = 100
+
+
+def _join(addresses):
+    return '\n'.join(addresses)
+
+
+def _split(addresses):
+    return [a for a in addresses.split('\n') if a]
+
+
+def enqueue(messages, batch=None):
+    """
+    Stores `messages` (EmailMessage instances) in the queue with a single
+    query; returns the number of queued emails.
+    """
+    emails = [
+        QueuedEmail(
+            batch=batch,
+            from_email=message.from_email,
+            to=_join(message.to),
+            cc=_join(message.cc),
+            bcc=_join(message.bcc),
+            subject=message.subject,
+            body=message.body,
+        )
+        for message in messages
+    ]
+    QueuedEmail.objects.bulk_create(emails)
+    return len(emails)
+
+
+def _send(email, connection):
+    message = mail.EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=_split(email.to),
+        cc=_split(email.cc),
+        bcc=_split(email.bcc),
+        connection=connection,
+    )
+    try:
+        message.send()
+    except smtplib.SMTPServerDisconnected:
+        # The server dropped the connection (eg. after too many messages),
+        # try again once on a new one.
+        connection.close()
+        connection.open()
+        message.send()
+
+
+def send_queued(batch=None, limit=None, rate=None, connection=None):
+    """
+    Sends the queued emails (only the ones of `batch`, if given), oldest
+    first, and returns the number of sent and failed ones.
+
+    At most `limit` emails are processed, and at most `rate` (by default
+    CONFERENCE_MAIL_QUEUE_RATE, 0 for no limit) are sent per second.
+    """
+    if rate is None:
+        rate = settings.CONFERENCE_MAIL_QUEUE_RATE
+    interval = 1 / rate if rate > 0 else 0
+    max_attempts = settings.CONFERENCE_MAIL_QUEUE_MAX_ATTEMPTS
+    if connection is None:
+        connection = mail.get_connection()
+
+    queue = QueuedEmail.objects\
+        .filter(status=QueuedEmail.STATUS.QUEUED)\
+        .order_by('id')
+    if batch is not None:
+        queue = queue.filter(batch=batch)
+
+    sent = failed = 0
+    # Emails failed in this run are retried by the next one
+    last_id = 0
+    batches = set()
+    next_send = 0
+    with connection:
+        while limit is None or sent + failed < limit:
+            size = SEND_CHUNK
+            if limit is not None:
+                size = min(size, limit - sent - failed)
+            chunk = list(queue.filter(id__gt=last_id)[:size])
+            if not chunk:
+                break
+
+            for email in chunk:
+                last_id = email.id
+                # Another worker may have taken it since the chunk was loaded
+                claimed = QueuedEmail.objects\
+                    .filter(id=email.id, status=QueuedEmail.STATUS.QUEUED)\
+                    .update(status=QueuedEmail.STATUS.SENDING)
+                if not claimed:
+                    continue
+                if email.batch_id:
+                    batches.add(email.batch_id)
+
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = time.monotonic() + interval
+
+                try:
+                    _send(email, connection)
+                except Exception as e:
+                    log.warning('cannot send the email %s to %r: %s',
+                                email.id, email.to, e)
+                    attempts = email.attempts + 1
+                    QueuedEmail.objects.filter(id=email.id).update(
+                        status=(
+                            QueuedEmail.STATUS.FAILED
+                            if attempts >= max_attempts
+                            else QueuedEmail.STATUS.QUEUED
+                        ),
+                        attempts=attempts,
+                        last_error='%s: %s' % (type(e).__name__, e),
+                    )
+                    failed += 1
+                else:
+                    QueuedEmail.objects.filter(id=email.id).update(
+                        status=QueuedEmail.STATUS.SENT,
+                        attempts=F('attempts') + 1,
+                        last_error='',
+                        sent=timezone.now(),
+                    )
+                    sent += 1
+
+        for mail_batch in MailBatch.objects.filter(id__in=batches):
+            complete_batch(mail_batch, connection)
+
+    return sent, failed
+
+
+def complete_batch(batch, connection=None):
+    """
+    Marks `batch` as completed, and sends its report to the feedback
+    address, once none of its emails is queued or being sent anymore.
+    """
+    if batch.completed:
+        return
+    progress = batch.progress()
+    if progress[QueuedEmail.STATUS.QUEUED] or progress[QueuedEmail.STATUS.SENDING]:
+        return
+
+    batch.completed = timezone.now()
+    batch.save()
+    if not batch.feedback_address:
+        return
+
+    lines = [
+        batch.description,
+        '-------------------------------',
+        'sent: %s, failed: %s' % (
+            progress[QueuedEmail.STATUS.SENT],
+            progress[QueuedEmail.STATUS.FAILED],
+        ),
+    ]
+    failures = batch.emails\
+        .filter(status=QueuedEmail.STATUS.FAILED)\
+        .order_by('id')\
+        .values_list('to', 'last_error')
+    if failures:
+        lines.append('')
+        lines.append('failed:')
+        for to, error in failures:
+            lines.append('%s - %s' % (', '.join(_split(to)), error))
+    lines.append('')
+    lines.append('sent to:')
+    lines.extend(
+        ', '.join(_split(to))
+        for to in batch.emails
+        .filter(status=QueuedEmail.STATUS.SENT)
+        .order_by('id')
+        .values_list('to', flat=True)
+    )
+
+    mail.send_mail(
+        '[%s] feedback: %s' % (settings.CONFERENCE_CONFERENCE, batch.description),
+        '\n'.join(lines),
+        settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[batch.feedback_address],
+        connection=connection,
+    )
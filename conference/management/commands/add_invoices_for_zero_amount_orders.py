@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from assopy import models as amodels
+from conference.invoicing import create_invoices_for_orders
 
 
 def generate_invoices_for_zero_amount_orders_for_year(year):
@@ -8,13 +9,20 @@ def generate_invoices_for_zero_amount_orders_for_year(year):
         method='bank',
     )
 
+    confirmed = []
     for o in orders:
         if not o.complete():
             continue
         if o.total() > 0:
             continue
         print('Creating invoice for order %r' % o)
-        o.confirm_order(o.created)
+        o.payment_date = o.created
+        o.save()
+        confirmed.append(o)
+
+    # All the invoices are created in one go
+    create_invoices_for_orders(confirmed)
+    for o in confirmed:
         o.complete()
 
 
@@ -0,0 +1,64 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from conference.cachef import CacheFunction
+
+
+def talk_data(tid, preload=None):
+    pass
+
+
+def all_user_tickets(uid, conference):
+    pass
+
+
+def tags():
+    pass
+
+
+BENCHMARKS = (
+    ('talk_data', talk_data, 'talk_data:%(tid)s', (42,)),
+    ('all_user_tickets', all_user_tickets,
+     'all_user_tickets:%(uid)s:%(conference)s', (42, 'ep2021')),
+    ('tags', tags, 'tags', ()),
+)
+
+
+class Command(BaseCommand):
+    """
+    Measures the cost per call of building the cache keys used by
+    conference.cachef, comparing the generic path (getcallargs plus string
+    formatting) with the key builders compiled at decoration time.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--number',
+            action='store',
+            dest='number',
+            default=100000,
+            type=int,
+            help='Number of calls to time for each key',
+        )
+
+    def handle(self, *args, **options):
+        number = options['number']
+        cache_me = CacheFunction(prefix='bench:')
+
+        print('Key,Generic (us/call),Compiled (us/call),Speedup')
+        for name, func, key, fargs in BENCHMARKS:
+            compiled = cache_me.compile_key(key, func)
+            assert compiled(fargs, {}) == cache_me.fhash(
+                cache_me.generate_key(key, func, fargs, {}))
+
+            generic = timeit.timeit(
+                lambda: cache_me.fhash(cache_me.generate_key(key, func, fargs, {})),
+                number=number,
+            )
+            fast = timeit.timeit(lambda: compiled(fargs, {}), number=number)
+            print('%s,%.3f,%.3f,%.1fx' % (
+                name,
+                generic / number * 1e6,
+                fast / number * 1e6,
+                generic / fast,
+            ))
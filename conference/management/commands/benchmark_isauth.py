@@ -0,0 +1,121 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import is_password_usable
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+
+from conference.api import generate_matrix_password, isauth
+from conference.models import AttendeeProfile
+from pycon.settings import MATRIX_AUTH_API_ALLOWED_IPS as ALLOWED_IPS
+
+
+def percentile(timings, p):
+    return timings[min(len(timings) - 1, int(len(timings) * p / 100))]
+
+
+class Command(BaseCommand):
+    """
+    Fires many isauth calls (like the Matrix server does at peak login) and
+    prints the latency distribution.
+
+    Without --password only the users without a usable password (the social
+    auth ones) are used, logging in with their generated Matrix password.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--number',
+            action='store',
+            dest='number',
+            default=5000,
+            type=int,
+            help='Number of isauth calls',
+        )
+        parser.add_argument(
+            '--users',
+            action='store',
+            dest='users',
+            default=500,
+            type=int,
+            help='Number of distinct users to log in',
+        )
+        parser.add_argument(
+            '--threads',
+            action='store',
+            dest='threads',
+            default=1,
+            type=int,
+            help='Number of concurrent callers',
+        )
+        parser.add_argument(
+            '--password',
+            action='store',
+            dest='password',
+            default=None,
+            help='Password shared by all the users to log in',
+        )
+
+    def handle(self, *args, **options):
+        password = options['password']
+        credentials = []
+        profiles = AttendeeProfile.objects\
+            .select_related('user')\
+            .filter(user__is_active=True)\
+            .order_by('user')
+        for profile in profiles.iterator():
+            user = profile.user
+            if password is not None:
+                credentials.append((user.email, password))
+            elif not is_password_usable(user.password):
+                credentials.append((user.email, generate_matrix_password(user)))
+            if len(credentials) >= options['users']:
+                break
+        if not credentials:
+            raise CommandError('No users to log in')
+
+        factory = RequestFactory()
+        remote_addr = ALLOWED_IPS[0] if ALLOWED_IPS else '127.0.0.1'
+
+        def call(ix):
+            email, secret = credentials[ix % len(credentials)]
+            request = factory.post(
+                '/api/v1/isauth/',
+                json.dumps({'email': email, 'password': secret}),
+                content_type='application/json',
+                secure=True,
+                REMOTE_ADDR=remote_addr,
+            )
+            start = time.perf_counter()
+            response = isauth(request)
+            elapsed = time.perf_counter() - start
+            return elapsed, 'error' in json.loads(response.content)
+
+        def worker(indexes):
+            try:
+                return [call(ix) for ix in indexes]
+            finally:
+                connection.close()
+
+        threads = options['threads']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = []
+            chunks = [range(t, options['number'], threads) for t in range(threads)]
+            for chunk in executor.map(worker, chunks):
+                results.extend(chunk)
+        total = time.perf_counter() - started
+
+        timings = sorted(elapsed * 1000 for elapsed, _ in results)
+        errors = sum(1 for _, error in results if error)
+        print('Calls: %d (%d users, %d threads), errors: %d' % (
+            len(results), len(credentials), threads, errors))
+        print('Throughput: %.1f calls/s' % (len(results) / total))
+        print('Latency (ms): mean %.2f, p50 %.2f, p95 %.2f, p99 %.2f, max %.2f' % (
+            sum(timings) / len(timings),
+            percentile(timings, 50),
+            percentile(timings, 95),
+            percentile(timings, 99),
+            timings[-1],
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from conference.currencies import import_ecb_historical_exrates
+
+
+class Command(BaseCommand):
+    """
+    Stores the ECB historical exrates from a downloaded copy of
+    eurofxref-hist.zip (or of the CSV or XML versions), so that invoices of
+    past years can be converted without going to the network.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='ECB historical rates file')
+
+    def handle(self, *args, **options):
+        created, updated = import_ecb_historical_exrates(options['path'])
+        print("Created %d and updated %d exrates" % (created, updated))
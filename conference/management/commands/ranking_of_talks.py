@@ -17,16 +17,23 @@ class Command(BaseCommand):
             '--missing-vote',
             action='store',
             dest='missing_vote',
-            default=0,
+            default=None,
             type=float,
-            help='Used when a user didn\'t vote a talk'
+            help='Used when a user didn\'t vote a talk (default 0)'
             )
         parser.add_argument(
             '--show-input',
             action='store_true',
             dest='show_input',
             default=False,
-            help='Show the input data piped to votengine',
+            help='Show the ballots in the voteengine input format',
+            )
+        parser.add_argument(
+            '--use-tally',
+            action='store_true',
+            dest='use_tally',
+            default=False,
+            help='Use the persisted pairwise tally (missing votes count as %s)' % utils.TALLY_MISSING_VOTE,
             )
 
     def handle(self, *args, **options):
@@ -35,10 +42,19 @@ class Command(BaseCommand):
         except IndexError:
             raise CommandError('conference not specified')
 
+        missing_vote = options['missing_vote']
+        if options['use_tally'] and missing_vote not in (None, utils.TALLY_MISSING_VOTE):
+            raise CommandError(
+                '--missing-vote can\'t be used with --use-tally, the tally '
+                'counts the missing votes as %s' % utils.TALLY_MISSING_VOTE
+            )
+        if missing_vote is None:
+            missing_vote = 0
+
         talks = models.Talk.objects\
             .filter(conference=conference, status='proposed')
         if options['show_input']:
-            print(utils._input_for_ranking_of_talks(talks, missing_vote=options['missing_vote']))
+            print(utils._input_for_ranking_of_talks(talks, missing_vote=missing_vote))
         else:
             qs = models.VotoTalk.objects\
                 .filter(talk__in=talks)\
@@ -48,7 +64,11 @@ class Command(BaseCommand):
             print(f'Talk voting results for {conference}: {talks.count()} talks / {users} users / {votes} votes')
             print('')
             print(f'Rank,TalkID,TalkType,TalkLanguage,TalkTitle,FirstSpeaker,AllSpeakers')
-            for ix, t in enumerate(utils.ranking_of_talks(talks, missing_vote=options['missing_vote'])):
+            if options['use_tally']:
+                ranking = utils.current_ranking_of_talks(talks)
+            else:
+                ranking = utils.ranking_of_talks(talks, missing_vote=missing_vote)
+            for ix, t in enumerate(ranking):
                 speakers = [str(speaker) for speaker in list(t.get_all_speakers())]
                 first_speaker = speakers[0]
                 all_speakers = ', '.join(speakers)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from conference.models import Conference
+from conference.tickets import rebuild_ticket_sales
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the daily ticket sales rollup (TicketSalesDay) used by the
+    ticket stats in the admin, normally it's updated every time an order
+    completes.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'conference',
+            nargs='*',
+            help='Conference codes, defaults to all the conferences',
+        )
+
+    def handle(self, *args, **options):
+        conferences = Conference.objects.exclude(conference_start=None)
+        if options['conference']:
+            conferences = conferences.filter(code__in=options['conference'])
+
+        for conference in conferences:
+            counts = rebuild_ticket_sales(conference)
+            print('%s: %d tickets in %d days' % (
+                conference.code,
+                sum(counts.values()),
+                len(set(offset_day for _, offset_day in counts)),
+            ))
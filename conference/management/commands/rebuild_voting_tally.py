@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from conference import utils
+
+
+class Command(BaseCommand):
+    """
+    Recomputes from scratch the pairwise tally of the talk votes of a
+    conference, normally it's updated every time a vote is saved.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('conference')
+
+    def handle(self, *args, **options):
+        utils.rebuild_pairwise_tally(options['conference'])
@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from conference.models import Talk
+from conference.social_card import (
+    social_card_content,
+    social_card_path,
+    render_social_card,
+)
+
+
+class Command(BaseCommand):
+    """
+    Renders the social cards of the talks of a conference, normally they are
+    rendered when a talk is saved (or on the first request).
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('conference')
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Render again the cards already stored',
+        )
+
+    def handle(self, *args, **options):
+        talks = Talk.objects\
+            .filter(conference=options['conference'])\
+            .order_by('id')
+        rendered = 0
+        for talk in talks:
+            content = social_card_content(talk)
+            if options['force'] or not os.path.exists(social_card_path(content)):
+                render_social_card(content)
+                rendered += 1
+        print('%d social cards rendered, %d talks' % (rendered, len(talks)))
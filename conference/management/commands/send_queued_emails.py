@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from conference import mailqueue
+from conference.models import MailBatch
+
+
+class Command(BaseCommand):
+    """
+    Sends the emails of the outbound mail queue (see conference.mailqueue)
+    and prints the progress of the batches still in progress.
+
+    With --loop the queue is polled until the command is stopped.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            action='store',
+            dest='limit',
+            default=None,
+            type=int,
+            help='Maximum number of emails to process in a run',
+        )
+        parser.add_argument(
+            '--rate',
+            action='store',
+            dest='rate',
+            default=None,
+            type=float,
+            help='Maximum number of emails sent per second',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store',
+            dest='loop',
+            default=0,
+            type=int,
+            help='Poll the queue every LOOP seconds',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            sent, failed = mailqueue.send_queued(
+                limit=options['limit'],
+                rate=options['rate'],
+            )
+            if sent or failed:
+                print('Sent: %d, failed: %d' % (sent, failed))
+                for batch in MailBatch.objects.filter(completed=None):
+                    print('%s: %s' % (batch, batch.progress()))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -3,7 +3,7 @@ from django.core.management.base import BaseCommand
 from conference.invoicing import (
     Invoice,
     VAT_NOT_AVAILABLE_PLACEHOLDER,
-    upgrade_invoice_placeholder_to_real_invoice
+    upgrade_invoice_placeholders,
 )
 
 
@@ -14,8 +14,8 @@ def generate_invoices_from_placeholders_for_year(year):
     total = invoices.count()
 
     print("Found %s placeholder invoices for %s" % (total, year))
+    invoices = upgrade_invoice_placeholders(invoices)
     for i, invoice in enumerate(invoices, 1):
-        invoice = upgrade_invoice_placeholder_to_real_invoice(invoice)
         print('Replaced %d out of %d - %s' % (i, total, invoice.code))
 
 
@@ -0,0 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+
+from conference.models import Conference
+
+
+def current_conference_middleware(get_response):
+    """
+    Adds `request.conference`, the current conference looked up (lazily) at
+    most once per request.
+    """
+    def middleware(request):
+        request.conference = SimpleLazyObject(Conference.objects.current)
+        return get_response(request)
+
+    return middleware
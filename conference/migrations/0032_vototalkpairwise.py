@@ -0,0 +1,26 @@
+# Generated by Django 2.2.24 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conference', '0031_update_streamset_help_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VotoTalkPairwise',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conference', models.CharField(db_index=True, max_length=20)),
+                ('talk_id', models.IntegerField()),
+                ('other_id', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('talk_id', 'other_id')},
+            },
+        ),
+    ]
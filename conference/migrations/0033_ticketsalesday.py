@@ -0,0 +1,26 @@
+# Generated by Django 2.2.24 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conference', '0032_vototalkpairwise'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketSalesDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conference', models.CharField(max_length=20)),
+                ('ticket_type', models.CharField(choices=[('conference', 'Conference ticket'), ('partner', 'Partner Program'), ('event', 'Event'), ('other', 'Other')], max_length=10)),
+                ('offset_day', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('conference', 'ticket_type', 'offset_day')},
+            },
+        ),
+    ]
@@ -6,6 +6,7 @@ import pytz
 from collections import defaultdict
 from urllib.parse import urlencode
 
+from django import dispatch
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core import exceptions
@@ -29,6 +30,8 @@ from model_utils.models import TimeStampedModel
 from taggit.managers import TaggableManager
 from taggit.models import GenericTaggedItemBase, ItemBase, TagBase
 
+from conference.cachef import LocalCache
+
 
 CURRENT_CONFERENCE_CACHE_KEY = 'CONFERENCE_CURRENT'
 
@@ -78,7 +81,16 @@ class ConferenceTaggedItem(GenericTaggedItemBase, ItemBase):
 
 
 class ConferenceManager(models.Manager):
+    # Per-process copy of the current conference, in front of the shared
+    # cache; cleared by `clear_cache` in this process and expired after
+    # CONFERENCE_CURRENT_MEMO_TIMEOUT seconds in the others.
+    memo = LocalCache(maxsize=1, timeout=settings.CONFERENCE_CURRENT_MEMO_TIMEOUT)
+
     def current(self):
+        data = self.memo.get(CURRENT_CONFERENCE_CACHE_KEY)
+        if data is not None:
+            return data
+
         data = cache.get(CURRENT_CONFERENCE_CACHE_KEY)
         a_week = 60 * 60 * 24 * 7
 
@@ -86,10 +98,13 @@ class ConferenceManager(models.Manager):
             data = self.get(code=settings.CONFERENCE_CONFERENCE)
             cache.set(CURRENT_CONFERENCE_CACHE_KEY, data, a_week)
 
+        if self.memo.timeout > 0:
+            self.memo.set(CURRENT_CONFERENCE_CACHE_KEY, data)
         return data
 
     @classmethod
     def clear_cache(cls, sender, **kwargs):
+        cls.memo.clear()
         cache.delete(CURRENT_CONFERENCE_CACHE_KEY)
 
 
@@ -113,7 +128,7 @@ class Conference(models.Model):
         Every time we make a change to any Conference, we should clear the
         CONFERENCE_CURRENT cache.
         """
-        cache.delete(CURRENT_CONFERENCE_CACHE_KEY)
+        ConferenceManager.clear_cache(Conference)
         super(Conference, self).save(*args, **kwargs)
 
     def days(self):
@@ -963,6 +978,11 @@ TICKET_TYPE = (
 )
 
 
+# Sent when a ticket is moved to another user, so that the cached data of
+# the previous owner can be invalidated.
+ticket_reassigned = dispatch.Signal(providing_args=['instance', 'previous_user_id'])
+
+
 class Ticket(models.Model):
     user = models.ForeignKey(
         get_user_model(),
@@ -1005,6 +1025,42 @@ class Ticket(models.Model):
         return self.fare.ticket_type == FARE_TICKET_TYPES.conference
 
 
+class TicketSalesDay(models.Model):
+    """
+    Daily rollup of the sold tickets: `count` tickets of `ticket_type` (the
+    fare ticket type) were bought `offset_day` days from the start of the
+    conference (negative before it).
+
+    The rows are recounted by conference.listeners every time an order
+    completes (or a bank/admin order is created), see
+    conference.tickets.update_ticket_sales; `manage.py rebuild_ticket_sales`
+    rebuilds them from scratch.
+    """
+    conference = models.CharField(max_length=20)
+    ticket_type = models.CharField(max_length=10, choices=FARE_TICKET_TYPES)
+    offset_day = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('conference', 'ticket_type', 'offset_day'),)
+
+
+class CodeSequence(models.Model):
+    """
+    Last number used for the order and invoice codes with `prefix` (eg.
+    "I/") in `year`; see conference.sequences.
+    """
+    prefix = models.CharField(max_length=10)
+    year = models.PositiveIntegerField()
+    last_number = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('prefix', 'year'),)
+
+    def __str__(self):
+        return '%s%s: %s' % (self.prefix, self.year, self.last_number)
+
+
 class Sponsor(models.Model):
     """
     Through the list of SponsorIncome instance of Sponsor it is connected
@@ -1303,6 +1359,53 @@ class VotoTalk(models.Model):
         verbose_name = 'Talk voting'
         verbose_name_plural = 'Talk votings'
 
+    @staticmethod
+    def lock_voter(user_id):
+        """
+        Locks the row of the user until the end of the transaction, so that
+        the votes of a user are changed (and tallied) one at a time.
+        """
+        list(
+            get_user_model().objects
+            .select_for_update()
+            .filter(pk=user_id)
+            .values_list('pk', flat=True)
+        )
+
+    # The pairwise tally (see VotoTalkPairwise) is updated by the signal
+    # handlers from the other votes of the user: the vote and its tally are
+    # written in the same transaction, under the voter lock.
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.lock_voter(self.user_id)
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self.lock_voter(self.user_id)
+            return super().delete(*args, **kwargs)
+
+
+class VotoTalkPairwise(models.Model):
+    """
+    Pairwise tally of the talk votes: `count` is the number of users that
+    preferred `talk` over `other`.
+
+    It is kept up to date by conference.listeners every time a VotoTalk is
+    saved or deleted (see conference.utils.update_pairwise_tally); missing
+    pairs have a zero count.
+
+    The talks are referenced by id, without a foreign key, so that the tally
+    can be updated while the votes of a talk being deleted are removed.
+    """
+    conference = models.CharField(max_length=20, db_index=True)
+    talk_id = models.IntegerField()
+    other_id = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('talk_id', 'other_id'),)
+
 
 # ========================================
 # ExchangeRates
@@ -1452,3 +1555,74 @@ class StreamSet(models.Model):
     #   - url: YouTube/Vimeo Stream URL
     streams = JSONField(blank=True, help_text=STREAMS_HELP_TEXT)
 
+
+### Mail queue
+
+class MailBatch(models.Model):
+    """
+    A group of queued emails, like a mass mailing from the admin (see
+    conference.mailqueue).
+    """
+    created = models.DateTimeField(auto_now_add=True)
+    description = models.CharField(max_length=255)
+    # Gets a report once all the emails of the batch have been processed
+    feedback_address = models.EmailField(blank=True)
+    completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'Mail batches'
+
+    def __str__(self):
+        return self.description
+
+    def progress(self):
+        """
+        Returns the number of emails of the batch for every status.
+        """
+        counts = {status: 0 for status, _ in QueuedEmail.STATUS}
+        counts.update(
+            self.emails
+            .order_by()
+            .values_list('status')
+            .annotate(count=models.Count('id'))
+        )
+        return counts
+
+
+class QueuedEmail(models.Model):
+    """
+    An email waiting to be sent (or already sent) by the mail queue worker.
+    """
+    STATUS = Choices(
+        ('QUEUED', 'Queued'),
+        # Claimed by a worker, which is sending it
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('FAILED', 'Failed'),
+    )
+
+    batch = models.ForeignKey(
+        MailBatch,
+        null=True,
+        blank=True,
+        related_name='emails',
+        on_delete=models.CASCADE,
+    )
+    created = models.DateTimeField(auto_now_add=True)
+    from_email = models.CharField(max_length=255)
+    # Lists of addresses, one per line (see conference.mailqueue)
+    to = models.TextField()
+    cc = models.TextField(blank=True)
+    bcc = models.TextField(blank=True)
+    subject = models.TextField()
+    body = models.TextField()
+
+    status = models.CharField(
+        max_length=10, choices=STATUS, default=STATUS.QUEUED, db_index=True
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s: %s' % (self.to, self.subject)
@@ -9,6 +9,7 @@ from django.utils import timezone
 from assopy.models import Order, OrderItem, Coupon, ORDER_TYPE
 from conference.models import Ticket, Conference
 
+from . import sequences
 from .fares import get_available_fares_as_dict, FareIsNotAvailable
 from p3.utils import assign_ticket_to_user
 
@@ -41,14 +42,16 @@ def latest_order_code_for_year(year):
 def next_order_code_for_year(year):
     assert 2016 <= year <= 2022, year
 
-    current_code = latest_order_code_for_year(year)
-    if current_code:
-        next_code = increment_order_code(current_code)
-        return next_code
+    def last_used_number():
+        # Only used once a year, to start the sequence after the orders
+        # created before it existed
+        current_code = latest_order_code_for_year(year)
+        return sequences.code_number(current_code) if current_code else 0
 
-    # if there are no current codes, return the first one
-    template = ORDER_CODE_TEMPLATE
-    return template % {"year_two_digits": year % 1000, "sequential_id": "0001"}
+    number, = sequences.reserve(
+        ORDER_CODE_PREFIX, year, initial=last_used_number
+    )
+    return sequences.format_code(ORDER_CODE_TEMPLATE, year, number)
 
 
 def create_order(
@@ -1,14 +1,16 @@
 import typing
+from bisect import bisect_left, bisect_right
 from datetime import timedelta, date
 
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 
 from django import http
 from django.conf import settings
 from django.conf.urls import url as re_path
 from django.shortcuts import render
 
-from conference.models import Schedule
+from conference.dataaccess import cache_me
+from conference import models
 from conference.utils import TimeTable2
 
 ### Globals
@@ -18,109 +20,38 @@ _debug = settings.DEBUG
 ###
 
 def _get_time_indexes(start_time, end_time, times):
-    for index, time in enumerate(times):
-        end_time_index = index
-
-        if time > end_time:
-            break
-
-    start = times.index(start_time) + 1
-    end = end_time_index
+    # `times` is the sorted 5 minutes grid of the schedule; the end row is the
+    # first one after end_time (or the last one).
+    start = bisect_left(times, start_time) + 1
+    end = min(bisect_right(times, end_time), len(times) - 1)
 
     return start, end
 
 
-def schedule(request, day=None, month=None):
-    from conference.dataaccess import schedules_data
-
-    selected_slug = request.GET.get('selected', None)
+def compile_schedule_grid(sid):
+    """
+    Build the ScheduleGrid of the schedule `sid`, returned in the serialised
+    form (nested dicts and lists) stored in the cache by `schedule_grid`.
+    """
+    from conference.dataaccess import schedule_data
 
-    months = [
-        "january",
-        "february",
-        "march",
-        "april",
-        "may",
-        "june",
-        "july",
-        "august",
-        "september",
-        "october",
-        "november",
-        "december",
-    ]
-
-    # TODO: filter by day
-    schedules = Schedule.objects.filter(conference=settings.CONFERENCE_CONFERENCE).values(
-        "id", "date"
-    )
-
-    days = [schedule["date"] for schedule in schedules]
-    if not days:
-        raise http.Http404()
-
-    # Handle the case of day or month being not provided - use the
-    # first day of the conference
-    if not month or not day:
-        first_day = min(days)
-        month_index = first_day.month
-        day = first_day.day
-    else:
-        try:
-            month_index = months.index(month) + 1
-        except:
-            raise http.Http404()
-
-    if _debug:
-        print ('schedule:', day, month, month_index)
-
-    selected_date = date(days[0].year, month_index, int(day))
-    current_schedule = next(
-        (
-            schedule
-            for schedule in schedules
-            if schedule["date"] == selected_date
-        ),
-        None,
-    )
-
-    if current_schedule is None:
-        raise http.Http404()
-
-    if _debug:
-        print ('selected_date = %r, current_schedule = %r' % (
-            selected_date, current_schedule))
-
-    schedule_data = schedules_data([current_schedule["id"]])[0]
-    if _debug:
-        print ('schedule_data = %s' % schedule_data)
-
-    timetable = TimeTable2.fromSchedule(schedule_data["id"])
+    data = schedule_data(sid)
+    timetable = TimeTable2.fromSchedule(sid)
     if _debug:
         print ('timetable = %s' % timetable)
 
-    # Not implemented
-    starred_talks_ids = []
-    #
-    # if request.user.is_authenticated():
-    #     starred_talks_ids = (
-    #         Event.objects.filter(
-    #             eventinterest__user=request.user, eventinterest__interest__gt=0
-    #         )
-    #         .filter(schedule__conference=conference)
-    #         .values_list("id", flat=True)
-    #     )
-
     times = []
     # Internal track names
     tracks = timetable._tracks
+    track_columns = {track: ix for ix, track in enumerate(tracks)}
     # Display names of tracks
     titles = timetable._titles
     talks = []
 
     all_times = set()
+    events = list(timetable.iterOnTimes())
 
-    for time, talks_for_time in timetable.iterOnTimes():
+    for time, talks_for_time in events:
         if _debug:
             print ('time = %r: talks_for_time = %r' % (
                 time, talks_for_time))
@@ -148,7 +79,7 @@ def schedule(request, day=None, month=None):
 
     seen = set()
 
-    for time, talks_for_time in timetable.iterOnTimes():
+    for time, talks_for_time in events:
         for talk in talks_for_time:
             if talk["id"] in seen:
                 continue
@@ -164,13 +95,13 @@ def schedule(request, day=None, month=None):
             t = Talk(
                 title=talk.get("custom", "") or talk.get("name", ""),
                 id=talk["id"],
-                starred=talk["id"] in starred_talks_ids,
-                selected=selected_slug and selected_slug == talk_meta.get("slug", None),
+                starred=False,
+                selected=False,
                 tracks=talk["tracks"],
                 start=time,
                 end=talk["end_time"],
-                start_column=tracks.index(talk["tracks"][0]) + 1,
-                end_column=tracks.index(talk["tracks"][-1]) + 2,
+                start_column=track_columns[talk["tracks"][0]] + 1,
+                end_column=track_columns[talk["tracks"][-1]] + 2,
                 start_row=start_row,
                 end_row=end_row,
                 slug=talk_meta.get("slug", None),
@@ -202,12 +133,136 @@ def schedule(request, day=None, month=None):
         )
 
     schedule = ScheduleGrid(
-        day=schedule_data["date"],
+        day=data["date"],
         tracks=tracks,
         titles=titles,
         talks=talks,
         grid=Grid(times=grid_times, rows=len(all_times), cols=len(tracks)),
     )
+    return asdict(schedule)
+
+
+def _i_schedule_grid(sender, **kw):
+    instance = kw['instance']
+    if sender is models.Schedule:
+        sids = [instance.id]
+    elif sender in (models.Track, models.Event):
+        sids = [instance.schedule_id]
+    elif sender is models.EventTrack:
+        sids = [instance.event.schedule_id]
+    elif sender is models.Talk:
+        sids = models.Event.objects\
+            .filter(talk=instance)\
+            .values_list('schedule', flat=True)
+    else:
+        sids = models.Event.objects\
+            .filter(talk=instance.talk_id)\
+            .values_list('schedule', flat=True)
+
+    return ['schedule_grid:%s' % sid for sid in set(sids)]
+
+schedule_grid = cache_me(
+    models=(
+        models.Schedule, models.Track, models.Event, models.EventTrack,
+        models.Talk, models.TalkSpeaker,
+    ),
+    key='schedule_grid:%(sid)s')(compile_schedule_grid, _i_schedule_grid)
+
+
+def schedule_days(conference):
+    """
+    Return the (id, date) of the schedules of the conference.
+    """
+    return list(
+        models.Schedule.objects\
+            .filter(conference=conference)\
+            .values_list("id", "date")
+    )
+
+def _i_schedule_days(sender, **kw):
+    return 'schedule_days:%s' % kw['instance'].conference
+
+schedule_days = cache_me(
+    models=(models.Schedule,),
+    key='schedule_days:%(conference)s')(schedule_days, _i_schedule_days)
+
+
+def schedule(request, day=None, month=None):
+    selected_slug = request.GET.get('selected', None)
+
+    months = [
+        "january",
+        "february",
+        "march",
+        "april",
+        "may",
+        "june",
+        "july",
+        "august",
+        "september",
+        "october",
+        "november",
+        "december",
+    ]
+
+    # TODO: filter by day
+    schedules = schedule_days(settings.CONFERENCE_CONFERENCE)
+
+    days = [schedule_date for sid, schedule_date in schedules]
+    if not days:
+        raise http.Http404()
+
+    # Handle the case of day or month being not provided - use the
+    # first day of the conference
+    if not month or not day:
+        first_day = min(days)
+        month_index = first_day.month
+        day = first_day.day
+    else:
+        try:
+            month_index = months.index(month) + 1
+        except:
+            raise http.Http404()
+
+    if _debug:
+        print ('schedule:', day, month, month_index)
+
+    selected_date = date(days[0].year, month_index, int(day))
+    current_schedule = next(
+        (
+            sid
+            for sid, schedule_date in schedules
+            if schedule_date == selected_date
+        ),
+        None,
+    )
+
+    if current_schedule is None:
+        raise http.Http404()
+
+    if _debug:
+        print ('selected_date = %r, current_schedule = %r' % (
+            selected_date, current_schedule))
+
+    # Not implemented
+    #
+    # if request.user.is_authenticated():
+    #     starred_talks_ids = (
+    #         Event.objects.filter(
+    #             eventinterest__user=request.user, eventinterest__interest__gt=0
+    #         )
+    #         .filter(schedule__conference=conference)
+    #         .values_list("id", flat=True)
+    #     )
+
+    schedule = schedule_grid(current_schedule)
+    if selected_slug:
+        # the snapshot can be shared with other requests, it must not be
+        # modified in place.
+        schedule = dict(schedule, talks=[
+            dict(talk, selected=True) if talk["slug"] == selected_slug else talk
+            for talk in schedule["talks"]
+        ])
 
     ctx = {
         "conference": settings.CONFERENCE_CONFERENCE, 
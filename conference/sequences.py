@@ -0,0 +1,75 @@
+"""
+Sequential numbers of the order and invoice codes.
+
+The last number used for every (prefix, year) is kept in a CodeSequence row,
+which is incremented with a single UPDATE. The row stays locked until the
+end of the transaction: concurrent callers wait for each other, and if the
+transaction is rolled back the numbers are released as well, so that there
+are no gaps in the invoice codes as long as they are reserved in the same
+transaction that creates the invoices.
+"""
+import time
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+
+from conference.models import CodeSequence
+
+# SQLite (used in development and by the tests) reports a write conflict
+# between two connections as an error instead of waiting for the lock.
+LOCK_RETRIES = 100
+LOCK_RETRY_DELAY = 0.01
+
+SEQUENTIAL_ID_DIGITS = 4
+
+
+def reserve(prefix, year, count=1, initial=None):
+    """
+    Reserve `count` consecutive numbers of the (prefix, year) sequence and
+    return them as a range.
+
+    `initial` is only called when the sequence doesn't exist yet, and must
+    return the last number already used (eg. by the codes created before
+    the sequence).
+    """
+    assert count > 0, count
+    for attempt in range(LOCK_RETRIES):
+        try:
+            with transaction.atomic():
+                return _reserve(prefix, year, count, initial)
+        except OperationalError as e:
+            if 'locked' not in str(e) or attempt == LOCK_RETRIES - 1:
+                raise
+        time.sleep(LOCK_RETRY_DELAY)
+
+
+def _reserve(prefix, year, count, initial):
+    sequence = CodeSequence.objects.filter(prefix=prefix, year=year)
+    if not sequence.update(last_number=F('last_number') + count):
+        last_number = initial() if initial is not None else 0
+        try:
+            with transaction.atomic():
+                CodeSequence.objects.create(
+                    prefix=prefix,
+                    year=year,
+                    last_number=last_number + count,
+                )
+        except IntegrityError:
+            # Created in the meantime by another transaction
+            sequence.update(last_number=F('last_number') + count)
+    last_number = sequence.values_list('last_number', flat=True).get()
+    return range(last_number - count + 1, last_number + 1)
+
+
+def format_code(template, year, number):
+    return template % {
+        'year_two_digits': year % 1000,
+        'sequential_id': str(number).zfill(SEQUENTIAL_ID_DIGITS),
+    }
+
+
+def code_number(code):
+    """
+    Return the sequential number of an order or invoice code.
+    """
+    return int(code.split('.')[1])
@@ -1,16 +1,18 @@
+import os
+
 from django import http
+from django.conf import settings
 from django.conf.urls import url as re_path
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 
-from weasyprint import HTML
-
+from common import files, pdfcache
 from conference.models import Talk
 
 
-def talk_social_card_png(request, slug):
-    talk = get_object_or_404(Talk, slug=slug)
-
+def social_card_content(talk):
     subtitle = ", ".join(
         [
             speaker.user.assopy_user.name()
@@ -20,16 +22,66 @@ def talk_social_card_png(request, slug):
         ]
     )
 
-    content = render_to_string(
+    return render_to_string(
         "conference/conference/talk_social_card.html",
         {"title": talk.title, "subtitle": subtitle},
     )
 
+
+def social_card_path(content):
+    """
+    Cards are stored by the hash of their HTML, so a new one is rendered as
+    soon as the title or the speakers of the talk change.
+    """
+    h = pdfcache.content_hash(content)
+    return os.path.join(settings.CONFERENCE_SOCIAL_CARDS_DIR, h[:2], h + ".png")
+
+
+def render_social_card(content):
+    # Imported here, like in common.pdfcache: conference.listeners loads
+    # this module in every process.
+    from weasyprint import HTML
+
+    path = social_card_path(content)
     data = HTML(
-        string=content, base_url=request.build_absolute_uri("/")
+        string=content, base_url=settings.DEFAULT_URL_PREFIX + "/"
     ).write_png()
+    files.write_file(path, data)
+    return path
 
-    return http.HttpResponse(data, content_type="image/png")
+
+def render_social_card_in_background(talk):
+    content = social_card_content(talk)
+    if not os.path.exists(social_card_path(content)):
+        pdfcache.run_in_background(
+            "social-card:%s" % pdfcache.content_hash(content),
+            render_social_card,
+            content,
+        )
+
+
+def talk_social_card_png(request, slug):
+    talk = get_object_or_404(Talk, slug=slug)
+
+    content = social_card_content(talk)
+    path = social_card_path(content)
+    etag = '"%s"' % pdfcache.content_hash(content)
+    try:
+        last_modified = int(os.path.getmtime(path))
+    except OSError:
+        # Not rendered yet (normally done by `manage.py render_social_cards`
+        # or when the talk is saved)
+        render_social_card(content)
+        last_modified = int(os.path.getmtime(path))
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = http.FileResponse(open(path, "rb"), content_type="image/png")
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
 
 
 urlpatterns = [
@@ -2,17 +2,49 @@ import random
 
 from django.conf.urls import url as re_path
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
 from django.http import HttpResponseForbidden
-from django.db.models import Q, Prefetch, Case, When, Value, BooleanField
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
-
-from conference.models import Conference, Talk, VotoTalk, TALK_STATUS, TALK_TYPE_CHOICES
+from django.utils.safestring import mark_safe
+
+from conference.dataaccess import cache_me
+from conference.models import (
+    Conference,
+    ConferenceTaggedItem,
+    MultilingualContent,
+    Talk,
+    TalkSpeaker,
+    VotoTalk,
+    TALK_STATUS,
+    TALK_TYPE_CHOICES,
+)
 from conference import fares
 
+TALKS_PER_PAGE = 50
+
+TALK_TYPE_FILTERS = {
+    "talk": [
+        TALK_TYPE_CHOICES.t_30,
+        TALK_TYPE_CHOICES.t_45,
+        TALK_TYPE_CHOICES.t_60,
+    ],
+    "training": [TALK_TYPE_CHOICES.r_180],
+    "poster": [
+        TALK_TYPE_CHOICES.i_60,
+        TALK_TYPE_CHOICES.p_180,
+        TALK_TYPE_CHOICES.n_60,
+        TALK_TYPE_CHOICES.n_90,
+    ],
+    "helpdesk": [TALK_TYPE_CHOICES.h_180],
+}
+
+
 @login_required
 def talk_voting(request):
-    current_conference = Conference.objects.current()
+    current_conference = request.conference
 
     if not current_conference.voting():
         return TemplateResponse(request, "conference/talk_voting/voting_is_closed.html")
@@ -25,59 +57,17 @@ def talk_voting(request):
         )
 
     filter = request.GET.get("filter", "all")
-    if filter == "voted":
-        extra_filters = [
-            ~Q(created_by=request.user),
-            ~Q(speakers__user__in=[request.user]),
-            Q(id__in=VotoTalk.objects.filter(user=request.user).values("talk_id")),
-        ]
-    elif filter == "not-voted":
-        extra_filters = [
-            ~Q(created_by=request.user),
-            ~Q(speakers__user__in=[request.user]),
-            ~Q(id__in=VotoTalk.objects.filter(user=request.user).values("talk_id")),
-        ]
-    elif filter == "mine":
-        extra_filters = [
-            Q(created_by=request.user) | Q(speakers__user__in=[request.user])
-        ]
-    else:
-        extra_filters = []
-
     talk_type = request.GET.get("talk_type", "all")
-    if talk_type == "talk":
-        extra_filters += [
-            Q(
-                type__in=[
-                    TALK_TYPE_CHOICES.t_30,
-                    TALK_TYPE_CHOICES.t_45,
-                    TALK_TYPE_CHOICES.t_60,
-                ]
-            )
-        ]
-    if talk_type == "training":
-        extra_filters += [Q(type__in=[TALK_TYPE_CHOICES.r_180])]
-    if talk_type == "poster":
-        extra_filters += [
-            Q(
-                type__in=[
-                    TALK_TYPE_CHOICES.i_60,
-                    TALK_TYPE_CHOICES.p_180,
-                    TALK_TYPE_CHOICES.n_60,
-                    TALK_TYPE_CHOICES.n_90,
-                ]
-            )
-        ]
-    if talk_type == "helpdesk":
-        extra_filters += [Q(type__in=[TALK_TYPE_CHOICES.h_180])]
 
-    talks = find_talks(request.user, current_conference, extra_filters)
+    talks = find_talks(request.user, current_conference, filter, talk_type)
+    page = Paginator(talks, TALKS_PER_PAGE).get_page(request.GET.get("page"))
 
     return TemplateResponse(
         request,
         "conference/talk_voting/voting.html",
         {
-            "talks": talks,
+            "talks": page,
+            "page": page,
             "VotingOptions": VotingOptions,
             "filter": filter,
             "talk_type": talk_type,
@@ -85,41 +75,100 @@ def talk_voting(request):
     )
 
 
-def find_talks(user, conference, extra_filters):
+def voting_candidates(conference, talk_type):
     """
-    This prepares a queryset of Talks with custom data, with an option to pass
-    additional filters related to which talks we want to show.
+    Return the talks open for voting in `conference` (a conference code),
+    only those of `talk_type` if it's one of TALK_TYPE_FILTERS.
+
+    Every talk is a dict with the data needed to apply the per-user filters
+    and its card already rendered; the votes are added by `find_talks`.
     """
     talks = (
         Talk.objects.filter(
-            Q(conference=conference.code)
+            Q(conference=conference)
             & Q(admin_type="")
             & Q(status=TALK_STATUS.proposed)
             & ~Q(speakers=None)
         )
-        .filter(*extra_filters)
-        .prefetch_related(
-            Prefetch(
-                "vototalk_set",
-                queryset=VotoTalk.objects.filter(user=user),
-                to_attr="votes",
-            )
-        )
-        .annotate(
-            can_vote=Case(
-                When(created_by=user, then=Value(False)),
-                When(speakers__user__username__exact=[user.username], then=Value(False)),
-                default=Value(True),
-                output_field=BooleanField(),
-            )
-        )
         .distinct()
+        .order_by("id")
+        .prefetch_related("speakers__user__assopy_user", "tags")
     )
-    # Ordering by random conflicts with the `distinct` statement in
-    # sqlite as it adds a random number to every row that's used for ordering
-    talks_list = list(talks.all())
-    random.shuffle(talks_list)
-    return talks_list
+    if talk_type in TALK_TYPE_FILTERS:
+        talks = talks.filter(type__in=TALK_TYPE_FILTERS[talk_type])
+
+    return [
+        {
+            "id": talk.id,
+            "uuid": talk.uuid,
+            "created_by": talk.created_by_id,
+            "speakers": [speaker.user_id for speaker in talk.speakers.all()],
+            "card": render_to_string(
+                "conference/talk_voting/_talk_card.html", {"talk": talk}
+            ),
+        }
+        for talk in talks
+    ]
+
+
+def _i_voting_candidates(sender, **kw):
+    o = kw["instance"]
+    if sender is Talk:
+        conference = o.conference
+    elif sender is TalkSpeaker:
+        conference = o.talk.conference
+    else:
+        # Tags and abstracts
+        if o.content_type.model_class() is not Talk:
+            return []
+        try:
+            conference = Talk.objects.get(id=o.object_id).conference
+        except Talk.DoesNotExist:
+            return []
+    return [
+        "voting_candidates:%s:%s" % (conference, talk_type)
+        for talk_type in ["all"] + list(TALK_TYPE_FILTERS)
+    ]
+
+
+voting_candidates = cache_me(
+    models=(Talk, TalkSpeaker, ConferenceTaggedItem, MultilingualContent),
+    key="voting_candidates:%(conference)s:%(talk_type)s",
+    # The names of the speakers are not tracked
+    timeout=60 * 60,
+)(voting_candidates, _i_voting_candidates)
+
+
+def find_talks(user, conference, filter="all", talk_type="all"):
+    """
+    Return the talks `user` can see on the voting page, with their own votes
+    and whether they can vote on each one.
+
+    The order is random but stable for each user, so that the pages of the
+    list don't overlap.
+    """
+    candidates = voting_candidates(conference.code, talk_type)
+    random.Random("%s:%s" % (conference.code, user.id)).shuffle(candidates)
+
+    votes = {
+        vote.talk_id: vote
+        for vote in VotoTalk.objects.filter(user=user, talk__conference=conference.code)
+    }
+    talks = []
+    for talk in candidates:
+        mine = talk["created_by"] == user.id or user.id in talk["speakers"]
+        voted = talk["id"] in votes
+        if filter == "voted" and (mine or not voted):
+            continue
+        if filter == "not-voted" and (mine or voted):
+            continue
+        if filter == "mine" and not mine:
+            continue
+        talk["card"] = mark_safe(talk["card"])
+        talk["can_vote"] = not mine
+        talk["votes"] = [votes[talk["id"]]] if voted else []
+        talks.append(talk)
+    return talks
 
 
 def is_user_allowed_to_vote(user):
@@ -144,7 +193,7 @@ def is_user_allowed_to_vote(user):
 def vote_on_a_talk(request, talk_uuid):
     talk = get_object_or_404(Talk, uuid=talk_uuid)
 
-    current_conference = Conference.objects.current()
+    current_conference = request.conference
     if not current_conference.voting():
         return HttpResponseForbidden('Voting closed.')
 
@@ -30,8 +30,11 @@ def _request_cache(request, key):
     return request._conf_cache[key]
 
 # Current conference object
-@register.simple_tag()
-def current_conference():
+@register.simple_tag(takes_context=True)
+def current_conference(context):
+    request = context.get('request')
+    if request is not None and hasattr(request, 'conference'):
+        return request.conference
     return models.Conference.objects.current()
 
 @register.filter
@@ -1,7 +1,12 @@
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 
 from p3.models import TicketConference
-from conference.models import Ticket
+from conference.models import Conference, Ticket, TicketSalesDay
 from conference.fares import FARE_CODE_REGEXES, FARE_CODE_VARIANTS
 
 
@@ -58,3 +63,98 @@ def sold_conference_tickets_including_combined_tickets(conference_code):
         )
     )
     return qs
+
+
+def _sold_tickets(conference_code):
+    """
+    Tickets counted in the sales statistics: the ones from complete orders
+    or from bank/admin orders (which are paid later).
+    """
+    return Ticket.objects.filter(
+        fare__conference=conference_code,
+    ).filter(
+        Q(orderitem__order___complete=True)
+        | Q(orderitem__order__method__in=('bank', 'admin'))
+    )
+
+
+def _sales_day(created):
+    # Days are counted in UTC, as the order timestamps are stored
+    return created.astimezone(timezone.utc).date()
+
+
+def count_ticket_sales(conference):
+    """
+    Returns {(ticket_type, offset_day): count} for the tickets sold for
+    `conference`, computed from the tickets themselves.
+    """
+    counts = defaultdict(lambda: 0)
+    tickets = _sold_tickets(conference.code)\
+        .values_list('fare__ticket_type', 'orderitem__order__created')
+    for ticket_type, created in tickets.iterator():
+        offset = _sales_day(created) - conference.conference_start
+        counts[ticket_type, offset.days] += 1
+    return dict(counts)
+
+
+def rebuild_ticket_sales(conference):
+    """
+    Replaces the TicketSalesDay rows of `conference` with a fresh count.
+    """
+    counts = count_ticket_sales(conference)
+    with transaction.atomic():
+        TicketSalesDay.objects.filter(conference=conference.code).delete()
+        TicketSalesDay.objects.bulk_create([
+            TicketSalesDay(
+                conference=conference.code,
+                ticket_type=ticket_type,
+                offset_day=offset_day,
+                count=count,
+            )
+            for (ticket_type, offset_day), count in counts.items()
+        ])
+    return counts
+
+
+def update_ticket_sales(order):
+    """
+    Recounts the TicketSalesDay rows touched by `order`, that is the day the
+    order was created for every (conference, ticket type) of its tickets.
+
+    Recounting, instead of incrementing, keeps the rows correct no matter
+    how many times an order is saved.
+    """
+    pairs = list(
+        order.orderitem_set
+        .exclude(ticket=None)
+        .values_list('ticket__fare__conference', 'ticket__fare__ticket_type')
+        .distinct()
+    )
+    if not pairs:
+        return
+
+    day = _sales_day(order.created)
+    start = datetime.datetime.combine(day, datetime.time.min, tzinfo=timezone.utc)
+    end = start + datetime.timedelta(days=1)
+    conference_starts = dict(
+        Conference.objects
+        .filter(code__in=set(code for code, _ in pairs))
+        .values_list('code', 'conference_start')
+    )
+    for code, ticket_type in pairs:
+        conference_start = conference_starts.get(code)
+        if conference_start is None:
+            continue
+        count = _sold_tickets(code)\
+            .filter(
+                fare__ticket_type=ticket_type,
+                orderitem__order__created__gte=start,
+                orderitem__order__created__lt=end,
+            )\
+            .count()
+        TicketSalesDay.objects.update_or_create(
+            conference=code,
+            ticket_type=ticket_type,
+            offset_day=(day - conference_start).days,
+            defaults={'count': count},
+        )
@@ -1,4 +1,5 @@
 import random
+from bisect import bisect_right
 from datetime import timedelta
 
 from crispy_forms.helper import FormHelper
@@ -23,13 +24,14 @@ from django.shortcuts import get_object_or_404, redirect
 from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
 
-from assopy.models import Invoice, Order
+from assopy.models import Invoice, Order, OrderItem
 from p3.models import P3Profile, TicketConference
 from p3.utils import assign_ticket_to_user
 
 from .accounts import get_or_create_attendee_profile_for_new_user
 from .api import generate_matrix_password
 from .cfp import AddSpeakerToTalkForm
+from .dataaccess import cache_me
 from .models import (
     AttendeeProfile,
     TALK_STATUS,
@@ -40,6 +42,7 @@ from .models import (
     StreamSet,
     ATTENDEEPROFILE_VISIBILITY,
     ATTENDEEPROFILE_GENDER,
+    ticket_reassigned,
 )
 from .tickets import reset_ticket_settings
 from .decorators import full_profile_required
@@ -616,6 +619,123 @@ def matrix_token_access(request):
 
     return True
 
+def stream_fare_codes(user_id, conference):
+    """ Return the fare codes of the valid tickets bought by or assigned to
+        the user in `conference` (same tickets as
+        get_tickets_for_current_conference).
+    """
+    return sorted(set(Ticket.objects.filter(
+        Q(fare__conference=conference)
+        & Q(frozen=False)
+        & Q(orderitem__order___complete=True)
+        & (Q(user=user_id) | Q(orderitem__order__user__user=user_id))
+    ).values_list('fare__code', flat=True)))
+
+def _i_stream_fare_codes(sender, **kw):
+    o = kw['instance']
+    if sender is Order:
+        items = o.orderitem_set.exclude(ticket=None)
+        users = set(items.values_list('ticket__user', flat=True))
+        users.add(o.user.user_id)
+        conferences = set(items.values_list('ticket__fare__conference', flat=True))
+    else:
+        if sender is OrderItem:
+            if o.ticket_id is None:
+                return []
+            o = o.ticket
+        users = {
+            o.user_id,
+            kw.get('previous_user_id', getattr(o, '_previous_user_id', None)),
+        }
+        users.update(OrderItem.objects
+            .filter(ticket=o)
+            .values_list('order__user__user', flat=True))
+        conferences = {o.fare.conference}
+    return [
+        'stream_fare_codes:%s:%s' % (uid, conference)
+        for uid in users if uid is not None
+        for conference in conferences
+    ]
+
+stream_fare_codes = cache_me(
+    signals=(ticket_reassigned,),
+    models=(Ticket, OrderItem, Order),
+    key='stream_fare_codes:%(user_id)s:%(conference)s',
+    timeout=settings.MATRIX_STREAM_FARE_CODES_CACHE_TIMEOUT,
+    stale=False)(stream_fare_codes, _i_stream_fare_codes)
+
+def stream_index(conference):
+    """ Compile the enabled stream sets of `conference` into an index of
+        the visible streams by fare code.
+
+        The timeline is split into segments by the start and end dates of
+        the stream sets (`boundaries`); within a segment the same sets are
+        active, so each segment maps every fare code to the positions in
+        `streams` it may see, plus the data needed to compute the reload
+        date.
+    """
+    stream_sets = list(StreamSet.objects
+        .filter(conference=conference, enabled=True)
+        .order_by('id'))
+
+    streams = []
+    entries = []
+    boundaries = set()
+    for stream_set in stream_sets:
+        assert isinstance(stream_set.streams, list)
+        positions = []
+        for stream in stream_set.streams:
+            positions.append((len(streams), set(stream.get('fare_codes', ()))))
+            streams.append({
+                'title': stream['title'],
+                'id': stream.get('id', ''),
+                'url': stream['url'],
+            })
+        # `end_date` is inclusive, the segment ends right after it
+        start = stream_set.start_date
+        end = stream_set.end_date
+        if end is not None:
+            end += timedelta(microseconds=1)
+        entries.append((start, end, stream_set.end_date, positions))
+        boundaries.update(d for d in (start, end) if d is not None)
+
+    boundaries = sorted(boundaries)
+    segments = []
+    for ix in range(len(boundaries) + 1):
+        segment_start = boundaries[ix - 1] if ix > 0 else None
+        segment_end = boundaries[ix] if ix < len(boundaries) else None
+        fares = {}
+        active = False
+        end_date = None
+        for start, end, set_end_date, positions in entries:
+            if start is not None and (segment_start is None or start > segment_start):
+                continue
+            if end is not None and (segment_end is None or end < segment_end):
+                continue
+            active = True
+            if set_end_date is not None and (end_date is None or set_end_date < end_date):
+                end_date = set_end_date
+            for position, fare_codes in positions:
+                for fare_code in fare_codes:
+                    fares.setdefault(fare_code, []).append(position)
+        segments.append({
+            'fares': fares,
+            'active': active,
+            'end_date': end_date,
+        })
+    return {
+        'boundaries': boundaries,
+        'streams': streams,
+        'segments': segments,
+    }
+
+def _i_stream_index(sender, **kw):
+    return 'stream_index:%s' % kw['instance'].conference_id
+
+stream_index = cache_me(
+    models=(StreamSet,),
+    key='stream_index:%(conference)s')(stream_index, _i_stream_index)
+
 def get_streams_for_current_conference(user, request=None):
 
     """ Return the list of currently active streams as dictionaries:
@@ -623,10 +743,10 @@ def get_streams_for_current_conference(user, request=None):
         - id
         - url
     """
+    conference = Conference.objects.current()
     if user.is_authenticated:
         # Authenticated user: use tickets
-        fare_codes = set(
-            get_tickets_for_current_conference(user).values_list("fare__code", flat=True))
+        fare_codes = stream_fare_codes(user.id, conference.code)
     elif matrix_token_access(request):
         # Use token fares
         #print ('Allow Matrix embedding')
@@ -648,44 +768,29 @@ def get_streams_for_current_conference(user, request=None):
         id_filter = None
 
     #print ('User has these fares: %r' % fare_codes)
-    conference = Conference.objects.current()
     now = timezone.now()
-    stream_sets = list(StreamSet.objects.filter(
-        Q(conference=conference) &
-        Q(enabled = True) &
-        (Q(start_date = None) | Q(start_date__lte = now)) &
-        (Q(end_date = None) | Q(end_date__gte = now))
-    ))
-    #print ('Found these stream_sets: %r' % stream_sets)
+    index = stream_index(conference.code)
+    segment = index['segments'][bisect_right(index['boundaries'], now)]
+    positions = set()
+    for fare_code in fare_codes:
+        positions.update(segment['fares'].get(fare_code, ()))
     streams = []
-    if stream_sets:
+    for position in sorted(positions):
+        stream = index['streams'][position]
+        if title_filter:
+            if stream['title'] != title_filter:
+                continue
+        if id_filter:
+            if stream['id'] != id_filter:
+                continue
+        streams.append(stream)
+    if segment['active']:
         reload_date = now + timedelta(hours=12)
     else:
         reload_date = now + timedelta(minutes=0)
-    for stream_set in stream_sets:
-        #print ('Found this stream_set: %r' % stream_set)
-        assert isinstance(stream_set.streams, list)
-        for stream in stream_set.streams:
-            stream_fare_codes = set(stream.get('fare_codes', ()))
-            #print ('Stream requires these fare codes: %r' % stream_fare_codes)
-            if stream_fare_codes & fare_codes:
-                title = stream['title']
-                id = stream.get('id', '')
-                url = stream['url']
-                if title_filter:
-                    if title != title_filter:
-                        continue
-                if id_filter:
-                    if id != id_filter:
-                        continue
-                streams.append({
-                    'title': title,
-                    'id': id,
-                    'url': url,
-                })
-        end_date = stream_set.end_date
-        if end_date is not None and end_date < reload_date:
-            reload_date = end_date
+    end_date = segment['end_date']
+    if end_date is not None and end_date < reload_date:
+        reload_date = end_date
     #print ('Found these streams: %r' % l)
     data = dict(
         streams=streams,
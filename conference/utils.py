@@ -1,14 +1,13 @@
 import logging
-import os
-import os.path
-import re
-import subprocess
+from bisect import bisect_left, bisect_right
 from datetime import datetime, date, timedelta, time
 from collections import defaultdict
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
 
-from conference.models import VotoTalk, EventTrack, Event, Track
+from conference.models import Talk, VotoTalk, VotoTalkPairwise, EventTrack, Event, Track
 
 
 log = logging.getLogger('conference')
@@ -80,30 +79,244 @@ def _input_for_ranking_of_talks(talks, missing_vote=5):
     return '\n'.join(vinput)
 
 
+def pairwise_preferences(talks, missing_vote=5):
+    """
+    Given a list of talks returns the pairwise preference matrix of the
+    votes: the element [i, j] is the number of users that preferred the talk
+    talks[i] over talks[j]. If a user has not expressed a preference for a
+    talk he was awarded the `missing_vote` value.
+    """
+    import numpy
+
+    index = dict((t.id, ix) for ix, t in enumerate(talks))
+    n = len(index)
+
+    votes = VotoTalk.objects\
+        .filter(talk__in=list(index))\
+        .values_list('user', 'talk', 'vote')
+    users = {}
+    rows = []
+    for user, talk, vote in votes:
+        rows.append((users.setdefault(user, len(users)), index[talk], vote))
+
+    scores = numpy.full((len(users), n), float(missing_vote))
+    for user, talk, vote in rows:
+        scores[user, talk] = float(vote)
+
+    pairwise = numpy.zeros((n, n), dtype=numpy.int64)
+    # Compare the ballots a chunk of users at a time to limit the size of the
+    # (users, n, n) intermediate array.
+    chunk = 64
+    for start in range(0, len(users), chunk):
+        ballots = scores[start:start + chunk]
+        pairwise += (ballots[:, :, None] > ballots[:, None, :]).sum(axis=0)
+    return pairwise
+
+
+def schulze_ranking(pairwise, tiebreaker):
+    """
+    Ranks the candidates with the Schulze method, given their pairwise
+    preference matrix; candidates are identified by their index in the matrix
+    and the ties are resolved following the `tiebreaker` list of indexes.
+
+    This follows what voteengine (Blake Cretney) does: the strongest paths
+    are computed on the margins and the candidates are picked, in tiebreaker
+    order, when no other remaining candidate beats them.
+    """
+    import numpy
+
+    paths = pairwise - pairwise.T
+    for k in range(paths.shape[0]):
+        numpy.maximum(paths, numpy.minimum(paths[:, k, None], paths[None, k, :]), out=paths)
+    wins = paths > paths.T
+
+    # number of remaining candidates that beat each candidate
+    defeats = wins.sum(axis=0)
+    done = set()
+    ranking = []
+    while len(ranking) < len(tiebreaker):
+        for i in tiebreaker:
+            if i not in done and defeats[i] == 0:
+                break
+        else:
+            # Can't happen, the beatpath relation has no cycles
+            raise RuntimeError("Unable to rank the candidates")
+        done.add(i)
+        ranking.append(i)
+        defeats -= wins[i]
+    return ranking
+
+
 def ranking_of_talks(talks, missing_vote=5):
-    import conference
-    vengine = os.path.join(os.path.dirname(conference.__file__),
-                           'tools',
-                           'voteengine-0.99',
-                           'voteengine.py')
-
-    talks_map = dict((t.id, t) for t in talks)
-    in_ = _input_for_ranking_of_talks(list(talks_map.values()), missing_vote=missing_vote).encode('utf-8')
-
-    pipe = subprocess.Popen(
-        [vengine],
-        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        close_fds=True,
-        env=os.environ
-    )
-    out, err = pipe.communicate(in_)
-    if pipe.returncode != 0:
-        raise RuntimeError("voteengine.py exits with code: %s; %s" % (pipe.returncode, err))
-    out = out.decode('utf-8')
+    talks = list(dict((t.id, t) for t in talks).values())
+    pairwise = pairwise_preferences(talks, missing_vote=missing_vote)
+    # Ties are resolved in favour of the talks submitted first
+    tiebreaker = sorted(range(len(talks)), key=lambda ix: talks[ix].created)
+    return [
+        talks[ix]
+        for ix in schulze_ranking(pairwise, tiebreaker)
+    ]
+
+
+# The `missing_vote` used by the persisted pairwise tally
+TALLY_MISSING_VOTE = 0
+
+
+def update_pairwise_tally(user_id, talk_id, old_vote, new_vote):
+    """
+    Updates the pairwise tally after the vote of a user on a talk changed
+    from `old_vote` to `new_vote` (None if there is no vote).
+
+    Only the comparisons between this talk and the others of the same
+    conference can change, the tally is updated with a few UPDATE queries.
+    """
+    if old_vote is None:
+        old_vote = TALLY_MISSING_VOTE
+    if new_vote is None:
+        new_vote = TALLY_MISSING_VOTE
+    if old_vote == new_vote:
+        return
+
+    conference = Talk.objects\
+        .filter(id=talk_id)\
+        .values_list('conference', flat=True)\
+        .first()
+    if conference is None:
+        return
+    # The other votes of the user are read, and the tally updated, under the
+    # voter lock: the votes saved concurrently by the same user are tallied
+    # one after the other, each one seeing the previous ones.
+    with transaction.atomic():
+        VotoTalk.lock_voter(user_id)
+        scores = dict(
+            (tid, TALLY_MISSING_VOTE)
+            for tid in Talk.objects
+                .filter(conference=conference)
+                .exclude(id=talk_id)
+                .values_list('id', flat=True)
+        )
+        scores.update(
+            VotoTalk.objects
+                .filter(user=user_id, talk__in=list(scores))
+                .values_list('talk', 'vote')
+        )
+
+        # (talk, other) -> +1/-1, where `talk` is the preferred one
+        changes = {}
+        for tid, score in scores.items():
+            for vote, delta in ((old_vote, -1), (new_vote, 1)):
+                if vote > score:
+                    pair = (talk_id, tid)
+                elif vote < score:
+                    pair = (tid, talk_id)
+                else:
+                    continue
+                changes[pair] = changes.get(pair, 0) + delta
+
+        VotoTalkPairwise.objects.bulk_create([
+            VotoTalkPairwise(conference=conference, talk_id=a, other_id=b)
+            for (a, b), delta in changes.items()
+            if delta > 0
+        ], ignore_conflicts=True)
+        for delta in (1, -1):
+            for preferred in (True, False):
+                others = [
+                    b if preferred else a
+                    for (a, b), d in changes.items()
+                    if d == delta and (a == talk_id) == preferred
+                ]
+                if not others:
+                    continue
+                if preferred:
+                    qs = VotoTalkPairwise.objects.filter(talk_id=talk_id, other_id__in=others)
+                else:
+                    qs = VotoTalkPairwise.objects.filter(talk_id__in=others, other_id=talk_id)
+                qs.update(count=F('count') + delta)
+
+
+def add_talk_to_pairwise_tally(talk):
+    """
+    Adds a new talk (with no votes yet) to the pairwise tally: every user
+    who voted another talk of the conference above (or below)
+    TALLY_MISSING_VOTE now prefers it over (or the new talk over it).
+
+    The counts are computed with a single grouped query on the votes.
+    """
+    counts = VotoTalk.objects\
+        .filter(talk__conference=talk.conference)\
+        .exclude(talk=talk.id)\
+        .order_by()\
+        .values('talk')\
+        .annotate(
+            above=Count('id', filter=Q(vote__gt=TALLY_MISSING_VOTE)),
+            below=Count('id', filter=Q(vote__lt=TALLY_MISSING_VOTE)),
+        )
+    rows = []
+    for row in counts:
+        if row['above']:
+            rows.append(VotoTalkPairwise(
+                conference=talk.conference,
+                talk_id=row['talk'],
+                other_id=talk.id,
+                count=row['above'],
+            ))
+        if row['below']:
+            rows.append(VotoTalkPairwise(
+                conference=talk.conference,
+                talk_id=talk.id,
+                other_id=row['talk'],
+                count=row['below'],
+            ))
+    VotoTalkPairwise.objects.bulk_create(rows, batch_size=1000)
+
+
+def rebuild_pairwise_tally(conference):
+    """
+    Recomputes from scratch the pairwise tally of the talks of a conference.
+    """
+    talks = list(Talk.objects.filter(conference=conference).order_by('id'))
+    pairwise = pairwise_preferences(talks, missing_vote=TALLY_MISSING_VOTE)
+    with transaction.atomic():
+        VotoTalkPairwise.objects.filter(conference=conference).delete()
+        VotoTalkPairwise.objects.bulk_create([
+            VotoTalkPairwise(
+                conference=conference,
+                talk_id=talks[i].id,
+                other_id=talks[j].id,
+                count=pairwise[i, j],
+            )
+            for i, j in zip(*pairwise.nonzero())
+        ], batch_size=1000)
+
+
+def pairwise_tally(talks):
+    """
+    Same as `pairwise_preferences` (with TALLY_MISSING_VOTE as missing vote)
+    but read from the persisted tally.
+    """
+    import numpy
 
+    index = dict((t.id, ix) for ix, t in enumerate(talks))
+    pairwise = numpy.zeros((len(index), len(index)), dtype=numpy.int64)
+    rows = VotoTalkPairwise.objects\
+        .filter(talk_id__in=list(index), other_id__in=list(index))\
+        .values_list('talk_id', 'other_id', 'count')
+    for talk, other, count in rows:
+        pairwise[index[talk], index[other]] = count
+    return pairwise
+
+
+def current_ranking_of_talks(talks):
+    """
+    Same as `ranking_of_talks` (with TALLY_MISSING_VOTE as missing vote), but
+    using the persisted tally; it is meant for the interim rankings during
+    the voting window.
+    """
+    talks = list(dict((t.id, t) for t in talks).values())
+    tiebreaker = sorted(range(len(talks)), key=lambda ix: talks[ix].created)
     return [
-        talks_map[int(tid)]
-        for tid in re.findall(r'\d+', out.split('\n')[-2])
+        talks[ix]
+        for ix in schulze_ranking(pairwise_tally(talks), tiebreaker)
     ]
 
 
@@ -131,6 +344,78 @@ def voting_results():
     return None
 
 
+def _minutes(t):
+    """
+    Offset, in minutes from midnight, of a time or datetime.
+    """
+    return t.hour * 60 + t.minute
+
+
+class IntervalIndex(object):
+    """
+    Index of the events of a track, built with a single sort on their start
+    and end expressed as integer minute offsets from midnight (all the events
+    of a timetable are on the same day).
+    """
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda e: e['time'])
+        self.starts = []
+        self.ends = []
+        # running maximum of the ends, used by `running` to know when it can
+        # stop looking back
+        self._max_ends = []
+        max_end = None
+        for e in self.events:
+            start = _minutes(e['time'])
+            end = start + int(round(e['duration'] or 0))
+            self.starts.append(start)
+            self.ends.append(end)
+            max_end = end if max_end is None else max(max_end, end)
+            self._max_ends.append(max_end)
+        # events without a duration can't overlap with anything
+        self._sorted_starts = sorted(
+            start for start, end in zip(self.starts, self.ends) if end > start)
+        self._sorted_ends = sorted(
+            end for start, end in zip(self.starts, self.ends) if end > start)
+
+    def overlaps(self):
+        """
+        Yields (event, count) where count is the number of the other events
+        overlapping with it; an event overlaps another one if they share at
+        least a minute.
+        """
+        for e, start, end in zip(self.events, self.starts, self.ends):
+            if end <= start:
+                continue
+            # events started before this one ends, minus the ones already
+            # finished when it starts, minus itself.
+            count = bisect_left(self._sorted_starts, end)\
+                - bisect_right(self._sorted_ends, start)\
+                - 1
+            if count:
+                yield e, count
+
+    def running(self, t):
+        """
+        Returns the events running at the time `t`.
+        """
+        t = _minutes(t)
+        output = []
+        ix = bisect_right(self.starts, t) - 1
+        while ix >= 0 and self._max_ends[ix] > t:
+            if self.ends[ix] > t:
+                output.append(self.events[ix])
+            ix -= 1
+        output.reverse()
+        return output
+
+    def search(self, t):
+        """
+        Returns the index of the first event starting at or after `t`.
+        """
+        return bisect_left(self.starts, _minutes(t))
+
+
 class TimeTable2(object):
     def __init__(self, sid, events):
         """
@@ -169,6 +454,7 @@ class TimeTable2(object):
             for ix, e in reversed(list(enumerate(events))):
                 if e['tags'] & tags:
                     del events[ix]
+        self._analyzed = False
 
     @classmethod
     def fromEvents(cls, sid, eids):
@@ -217,28 +503,27 @@ class TimeTable2(object):
         if self._analyzed:
             return
         # step 1 - I try "stacked" events
+        self._index = {}
         for t in self._tracks:
-            events = {}
-            timeline = []
-            for e in self.events.get(t, []):
-                row = (e['time'], e['time'] + timedelta(seconds=e['duration'] * 60), e['id'])
-                events[e['id']] = e
-                timeline.append(row)
-            for ix, e1 in enumerate(timeline):
-                for e2 in timeline[ix + 1:]:
-                    # http://stackoverflow.com/questions/9044084/efficient-data-range-overlap-calculation-in-python
-                    latest_start = max(e1[0], e2[0])
-                    earliest_end = min(e1[1], e2[1])
-                    overlap = (earliest_end - latest_start)
-                    if overlap.seconds > 0 and overlap.days >= 0:
-                        for eid in (e1[2], e2[2]):
-                            e = events[eid]
-                            try:
-                                e['intersection'] += 1
-                            except KeyError:
-                                e['intersection'] = 1
+            index = IntervalIndex(self.events.get(t, []))
+            for e, count in index.overlaps():
+                try:
+                    e['intersection'] += count
+                except KeyError:
+                    e['intersection'] = count
+            self._index[t] = index
         self._analyzed = True
 
+    def running(self, t):
+        """
+        Returns an iterator ((track, [events])) with the events running at the
+        time `t` on each track.
+        """
+        self._analyze()
+        for track in self._tracks:
+            if track in self.events:
+                yield track, self._index[track].running(t)
+
     def iterOnTracks(self, start=None):
         """
         Iterates through the events of the timetable a track at a time, returns an iterator ((track, [events]))
@@ -249,29 +534,25 @@ class TimeTable2(object):
                 events = self.events[track]
             except KeyError:
                 continue
-            if start is not None:
+            if start is not None and events:
                 if isinstance(start, time):
                     mode = 'next'
                     t0 = start
                 else:
                     mode, t0 = start
-                for ix, e in enumerate(events):
-                    t = e['time'].time()
-                    if t >= t0:
-                        if t == t0:
-                            break
-                        if mode == 'current':
-                            if ix > 0:
-                                ix -= 1
-                            break
-                        elif mode == 'next':
-                            ix += 1
-                            break
+                index = self._index[track]
+                events = index.events
+                ix = index.search(t0)
+                if ix == len(events):
+                    ix -= 1
+                elif index.starts[ix] != _minutes(t0):
+                    if mode == 'current':
+                        if ix > 0:
+                            ix -= 1
+                    elif mode == 'next':
+                        ix += 1
                 events = events[ix:]
-            try:
-                yield track, events
-            except KeyError:
-                continue
+            yield track, events
 
     def iterOnTimes(self, step=None):
         """
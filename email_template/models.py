@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from django.db import models
 from django.template import Template, Context
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 
 
@@ -28,4 +29,12 @@ class Email(models.Model):
                 if isinstance(value, str):
                     ctx[key] = mark_safe(value)
         ctx = Context(ctx)
-        return Template(self.subject).render(ctx), Template(self.text).render(ctx)
+        subject, text = self.templates
+        return subject.render(ctx), text.render(ctx)
+
+    @cached_property
+    def templates(self):
+        """
+        Subject and text templates, compiled once per instance.
+        """
+        return Template(self.subject), Template(self.text)
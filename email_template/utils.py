@@ -5,6 +5,17 @@ from email_template import models
 
 def email(code, ctx, mark_safestring=True, **kw):
     e = get_object_or_404(models.Email, code = code)
+    return _message(e, ctx, mark_safestring, kw)
+
+def emails(code, items, mark_safestring=True):
+    """
+    Returns the messages for every (ctx, kw) pair of `items`, like `email`;
+    the template is looked up and compiled only once.
+    """
+    e = get_object_or_404(models.Email, code = code)
+    return [ _message(e, ctx, mark_safestring, dict(kw)) for ctx, kw in items ]
+
+def _message(e, ctx, mark_safestring, kw):
     subject, body = e.render(ctx, mark_safestring=mark_safestring)
     email = EmailMessage()
     email.subject = subject
@@ -0,0 +1,156 @@
+"""
+Local copies of the external avatars (P3Profile.image_url) served by
+p3.views.p3_profile_avatar.
+
+Every image is fetched once, resized to fit P3_AVATAR_SIZE and stored under
+P3_AVATAR_CACHE_DIR, in a file named after the profile and the hash of the
+source url (so a new url is fetched straight away). Copies older than
+P3_AVATAR_CACHE_TTL seconds are still served while they are refreshed in
+the background.
+
+A failed fetch is remembered for the same TTL (with an empty `.failed` file
+or by keeping the previous copy), so that a broken url is not fetched again
+on every request.
+"""
+import hashlib
+import io
+import logging
+import os
+import time
+
+import requests
+from django.conf import settings
+from PIL import Image
+
+from common import files
+
+log = logging.getLogger('p3.avatars')
+
+FETCH_TIMEOUT = 10
+# Larger downloads and images are refused before they are decoded
+MAX_AVATAR_BYTES = 5 * 1024 * 1024
+MAX_AVATAR_PIXELS = 25 * 1000 * 1000
+
+CONTENT_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.png': 'image/png',
+}
+
+
+def _base_path(profile_id, url):
+    h = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(settings.P3_AVATAR_CACHE_DIR, str(profile_id), h)
+
+
+def _age(path):
+    try:
+        return time.time() - os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def cached_avatar(profile_id, url):
+    """
+    Returns (path, content_type, is_stale) of the stored copy of `url`,
+    or None.
+    """
+    base = _base_path(profile_id, url)
+    for ext, content_type in CONTENT_TYPES.items():
+        age = _age(base + ext)
+        if age is not None:
+            return base + ext, content_type, age > settings.P3_AVATAR_CACHE_TTL
+    return None
+
+
+def _download(url):
+    """
+    Returns the body of `url`; raises ValueError if it is larger than
+    MAX_AVATAR_BYTES.
+    """
+    with requests.get(url, timeout=FETCH_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > MAX_AVATAR_BYTES:
+            raise ValueError('image too large (%s bytes)' % length)
+        data = io.BytesIO()
+        for chunk in response.iter_content(64 * 1024):
+            data.write(chunk)
+            if data.tell() > MAX_AVATAR_BYTES:
+                raise ValueError('image too large (over %s bytes)' % MAX_AVATAR_BYTES)
+    data.seek(0)
+    return data
+
+
+def fetch_avatar(profile_id, url):
+    """
+    Downloads `url`, resizes and stores it; returns the path of the new
+    copy, or None if the image could not be fetched.
+    """
+    base = _base_path(profile_id, url)
+    try:
+        # Image.open only reads the header, the pixels are decoded by
+        # thumbnail()
+        image = Image.open(_download(url))
+        width, height = image.size
+        if width * height > MAX_AVATAR_PIXELS:
+            raise ValueError('image too large (%sx%s)' % (width, height))
+        size = (settings.P3_AVATAR_SIZE, settings.P3_AVATAR_SIZE)
+        # JPEG images can be decoded straight at a reduced scale
+        image.draft('RGB', size)
+        image.thumbnail(size)
+    except Exception as e:
+        log.warning('cannot fetch the avatar %s: %s', url, e)
+        cached = cached_avatar(profile_id, url)
+        if cached is not None:
+            # Keep serving the previous copy for another TTL
+            os.utime(cached[0])
+        else:
+            files.write_file(base + '.failed', b'')
+        return None
+
+    buff = io.BytesIO()
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        ext = '.png'
+        image.save(buff, 'PNG')
+    else:
+        ext = '.jpg'
+        image.convert('RGB').save(buff, 'JPEG', quality=90)
+    files.write_file(base + ext, buff.getvalue())
+
+    # Only one copy per url
+    for other in list(CONTENT_TYPES) + ['.failed']:
+        if other != ext and os.path.exists(base + other):
+            os.unlink(base + other)
+    return base + ext
+
+
+def get_avatar(profile_id, url):
+    """
+    Returns (path, content_type) of the local copy of `url`, fetching it if
+    needed, or None if the image is not available.
+    """
+    if not url.startswith(('http://', 'https://')):
+        # Local images (eg. the default avatar) are not cached
+        return None
+
+    cached = cached_avatar(profile_id, url)
+    if cached is not None:
+        path, content_type, is_stale = cached
+        if is_stale:
+            scheduled = files.run_in_background(
+                'avatar:%s' % path, fetch_avatar, profile_id, url)
+            if not scheduled:
+                return _fetch_now(profile_id, url) or (path, content_type)
+        return path, content_type
+
+    failed = _age(_base_path(profile_id, url) + '.failed')
+    if failed is not None and failed <= settings.P3_AVATAR_CACHE_TTL:
+        return None
+    return _fetch_now(profile_id, url)
+
+
+def _fetch_now(profile_id, url):
+    path = fetch_avatar(profile_id, url)
+    if path is None:
+        return None
+    return path, CONTENT_TYPES[os.path.splitext(path)[1]]
@@ -5,11 +5,17 @@ from conference import models as cmodels
 from assopy import models as amodels
 from assopy import utils as autils
 from p3 import models
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 
 
-cache_me = cachef.CacheFunction(prefix='p3:')
+cache_me = cachef.CacheFunction(
+    prefix='p3:',
+    local_size=settings.CONFERENCE_CACHEF_LOCAL_SIZE,
+    local_timeout=settings.CONFERENCE_CACHEF_LOCAL_TIMEOUT,
+    lease_timeout=settings.CONFERENCE_CACHEF_LEASE_TIMEOUT,
+)
 
 
 def profile_data(uid, preload=None):
@@ -67,22 +73,20 @@ profile_data = cache_me(
     key='profile:%(uid)s')(profile_data, _i_profile_data)
 
 
-def profiles_data(uids):
-    cached = list(zip(uids, profile_data.get_from_cache([ (x,) for x in uids ])))
-    missing = [ x[0] for x in cached if x[1] is cache_me.CACHE_MISS ]
-
+@profile_data.bulk_loader
+def _preload_profiles(uids):
     preload = {}
     profiles = models.P3Profile.objects\
-        .filter(profile__in=missing)\
+        .filter(profile__in=uids)\
         .select_related('profile__user')
     tags = cmodels.ConferenceTaggedItem.objects\
         .filter(
             content_type=ContentType.objects.get_for_model(models.P3Profile),
-            object_id__in=missing
+            object_id__in=uids
         )\
         .values('object_id', 'tag__name')
     speakers = models.SpeakerConference.objects\
-        .filter(speaker__in=missing)
+        .filter(speaker__in=uids)
 
     for p in profiles:
         preload[p.profile_id] = {
@@ -94,16 +98,12 @@ def profiles_data(uids):
     for spk in speakers:
         preload[spk.speaker_id]['speaker'] = spk
 
-    cdata.profiles_data(missing)
+    cdata.profiles_data(uids)
 
-    output = []
-    for ix, e in enumerate(cached):
-        pid, val = e
-        if val is cache_me.CACHE_MISS:
-            val = profile_data(pid, preload=preload[pid])
-        output.append(val)
+    return preload
 
-    return output
+def profiles_data(uids):
+    return profile_data.many(uids)
 
 def _user_ticket(user, conference):
     q1 = user.ticket_set.all()\
@@ -26,7 +26,7 @@
 
 """
 from django.core.management.base import BaseCommand
-from conference import models as cmodels
+from p3 import ticket_search
 
 ### Globals
 
@@ -86,68 +86,13 @@ var ticketList = new List('ticket-list', {
 
 ### Helpers
 
-def attendee_name(ticket, profile=None):
-
-    # XXX For EP2019, we have to use the ticket.name, since the profile
-    #     will be referring to the buyer's profile in many cases due
-    #     to a bug in the system.
-    #     See https://github.com/EuroPython/epcon/issues/1055
-
-    # Use ticket name if not set in profile
-    name = ticket.name.strip()
-        
-    # Determine user name from profile, if available
-    if not name and profile is not None:
-        name = '%s %s' % (
-            profile.user.first_name,
-            profile.user.last_name)
-        name = name.strip()
-
-    # Convert to title case, if not an email address
-    if '@' not in name:
-        name = name.title()
-
-    # Use email address if no ticket name set
-    if not name:
-        name = ticket.p3_conference.assigned_to.strip()
-
-    return name
-
-def attendee_list_key(entry):
-
-    # Sort by name
-    return entry[1][2]
-
-def create_app_file(conference, output_file):
-
-    output = open(output_file, 'wb')
-
-    # Get all valid conference tickets (frozen ones are not valid)
-    tickets = cmodels.Ticket.objects.filter(
-        fare__conference=conference,
-        fare__ticket_type='event',
-        orderitem__order___complete=True,
-        frozen=False,
-        )
-
-    # Find all attendees
-    attendee_dict = {}
-    missing_profiles = []
-    for ticket in tickets:
-        #sys.stderr.write('ticket %r: conference=%s\n' %
-        #                 (ticket, ticket.fare.conference))
-        profile = None
-        email = ticket.user.email
-        name = attendee_name(ticket, profile)
-        attendee_dict[ticket.id] = (
-            ticket,
-            profile,
-            name,
-            email)
-
-    # Prepare list
-    attendee_list = list(attendee_dict.items())
-    attendee_list.sort(key=attendee_list_key)
+def create_app_file(conference, output_file, incremental=False):
+
+    # Load all attendees with a single query (see p3.ticket_search)
+    state_file = ticket_search.state_path(output_file)
+    state = ticket_search.load_state(state_file) if incremental else None
+    attendee_list, state = ticket_search.build_rows(
+        conference, ticket_type='event', social=True, state=state)
 
     # Print list of attendees
     l = ['<table class="striped">',
@@ -161,25 +106,28 @@ def create_app_file(conference, output_file):
          '</thead>',
          '<tbody class="list">',
          ]
-    for id, (ticket, profile, name, email) in attendee_list:
+    for row in attendee_list:
         l.append(('<tr>'
                   '<td class="name">%s</td>'
                   '<td class="email hide-on-small-only">%s</td>'
                   '<td class="tid">%s</td>'
                   '<td class="tcode hide-on-small-only">%s</td>'
                   '</tr>' %
-                  (name,
-                   email,
-                   id,
-                   ticket.fare.code)))
+                  (row['name'],
+                   row['email'],
+                   row['tid'],
+                   row['fare_code'])))
     l.extend(['</tbody>',
               '</table>',
               '<p>%i attendees in total.</p>' % len(attendee_list),
               ])
-    output.write((TEMPLATE % {
-                      'listing': '\n'.join(l),
-                      'year': conference[2:],
-                  }).encode('utf-8'))
+    with open(output_file, 'wb') as output:
+        output.write((TEMPLATE % {
+                          'listing': '\n'.join(l),
+                          'year': conference[2:],
+                      }).encode('utf-8'))
+
+    ticket_search.save_state(state_file, state)
 
 ###
 
@@ -193,9 +141,13 @@ class Command(BaseCommand):
         parser.add_argument('conference')
         parser.add_argument('output_file', nargs='?',
                             default='ep-social-ticket-search-app/index.html')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only rebuild the rows of the tickets '
+                                 'changed since the last build')
 
     def handle(self, *args, **options):
         conference = options['conference']
         output_file = options['output_file']
 
-        create_app_file(conference, output_file)
+        create_app_file(conference, output_file,
+                        incremental=options['incremental'])
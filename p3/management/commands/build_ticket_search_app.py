@@ -4,7 +4,8 @@
 
     Creates a single-page fuzzy full text search list with all tickets
     and their ticket IDs.  Writes the single page to
-    ep-ticket-search-app/index.html
+    ep-ticket-search-app/index.html and the prebuilt search index it
+    loads to ep-ticket-search-app/search-index.js
 
     This can be used during registration to do quick search in the
     list of all tickets in order to find badges or find that no badge
@@ -21,15 +22,17 @@
     on port 8000. Pointing a browser at http://localhost:8000/ will
     then load the app into the browser.
 
+    With --incremental, only the rows of the tickets changed since the
+    previous build are rebuilt (see p3.ticket_search).
+
     Author: Marc-Andre Lemburg, 2016-2021.
 
 """
-import sys
 import csv
+import os
 
-from django.core.management.base import BaseCommand, CommandError
-from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
-from conference import models as cmodels
+from django.core.management.base import BaseCommand
+from p3 import ticket_search
 
 ### Globals
 
@@ -64,10 +67,8 @@ TEMPLATE = """\
 <div id="ticket-list" class="container">
 
 <p>
-<label for="exact_search" class="hide-on-small-only">Exact search</label>
-<input id="exact_search" type="text" class="search" placeholder="Exact search"/>
-<label for="fuzzy_search" class="hide-on-small-only">Fuzzy search</label>
-<input id="fuzzy_search" type="text" class="fuzzy-search" placeholder="Fuzzy search"/>
+<label for="search" class="hide-on-small-only">Search (name, email or ticket ID)</label>
+<input id="search" type="text" class="search" placeholder="Search" autofocus/>
 </p>
 
 <p class="row">
@@ -75,197 +76,186 @@ TEMPLATE = """\
 <button class="sort btn col s5 offset-s2" data-sort="tid">Sort by ticket ID</button>
 </p>
 
-%(listing)s
+<table class="striped">
+<thead>
+<tr>
+<th data-field="name">Name</th>
+<th data-field="email" class="hide-on-small-only">Email</th>
+<th data-field="speaker" class="hide-on-small-only">Speaker</th>
+<th data-field="tid">TID</th>
+<th data-field="tcode" class="hide-on-small-only">Code</th>
+</tr>
+</thead>
+<tbody id="results">
+</tbody>
+</table>
+
+<p id="status"></p>
+
+<p>%(total)i tickets in total.
+Color coding:
+<span class="sprint">TID</span> = Sprint Ticket.
+<span class="training">TID</span> = Training Ticket.
+<span class="combined">TID</span> = Combined Ticket.
+<span class="conference">TID</span> = Conference Ticket.</p>
 
 </div>
 
-<script src="js/jquery.min.js"></script>
-<script src="js/jquery.map.min.js"></script>
-<script src="js/list.js"></script>
-<script src="js/list.fuzzysearch.js"></script>
-<script src="js/materialize.min.js"></script>
+<script src="search-index.js"></script>
 <script>
-var fuzzyOptions = {
-  searchClass: "fuzzy-search",
-  location: 0,
-  distance: 100,
-  threshold: 0.1,
-  multiSearch: true
-};
-var ticketList = new List('ticket-list', { 
-  valueNames: ['name', 'email', 'tid'], 
-  plugins: [ListFuzzySearch(fuzzyOptions)]
-});
-</script>
-</body>
-</html>
-"""
-
-### Helpers
-
-def attendee_name(ticket, profile=None):
-
-    # Use ticket name if not set in profile
-    name = ticket.name.strip()
-        
-    # Determine user name from profile, if available and ticket.name is not
-    # set
-    if not name and profile is not None:
-        name = '%s %s' % (
-            profile.user.first_name,
-            profile.user.last_name)
-        name = name.strip()
+// Search the prebuilt index (see p3/ticket_search.py) and only render the
+// rows which are visible.
+var MAX_ROWS = 50;
+var index = TICKET_SEARCH_INDEX;
+var F = {};
+index.fields.forEach(function (name, ix) { F[name] = ix; });
+var sortField = 'name';
+
+function normalize(text) {
+    // Must match p3.ticket_search.normalize()
+    var words = String(text).normalize('NFKD')
+        .replace(/[\\u0300-\\u036f]/g, '')
+        .toLowerCase()
+        .match(/[a-z0-9]+/g);
+    return words ? words : [];
+}
 
-    # Convert to title case, if not an email address
-    if '@' not in name:
-        name = name.title()
+function trigrams(word) {
+    var grams = [];
+    for (var i = 0; i + 3 <= word.length; i++) {
+        grams.push(word.substr(i, 3));
+    }
+    return grams;
+}
 
-    # Use email address if no ticket name set
-    if not name:
-        name = ticket.p3_conference.assigned_to.strip()
+function intersect(a, b) {
+    // Both lists are sorted
+    var out = [], i = 0, j = 0;
+    while (i < a.length && j < b.length) {
+        if (a[i] < b[j]) { i++; }
+        else if (a[i] > b[j]) { j++; }
+        else { out.push(a[i]); i++; j++; }
+    }
+    return out;
+}
 
-    return name
+function exactSearch(words) {
+    // Candidates from the trigrams of the longer words, verified against
+    // the text of the rows (which also matches the short words)
+    var candidates = null;
+    words.forEach(function (word) {
+        trigrams(word).forEach(function (gram) {
+            var posting = index.trigrams[gram] || [];
+            candidates = candidates === null ? posting : intersect(candidates, posting);
+        });
+    });
+    if (candidates === null) {
+        candidates = index.rows.map(function (row, ix) { return ix; });
+    }
+    return candidates.filter(function (ix) {
+        var text = index.text[ix];
+        return words.every(function (word) { return text.indexOf(word) >= 0; });
+    });
+}
 
-def attendee_list_key(entry):
+function fuzzySearch(words) {
+    // Rank the rows by the number of trigrams they share with the query
+    var scores = {}, total = 0;
+    words.forEach(function (word) {
+        trigrams(word).forEach(function (gram) {
+            total++;
+            (index.trigrams[gram] || []).forEach(function (ix) {
+                scores[ix] = (scores[ix] || 0) + 1;
+            });
+        });
+    });
+    var matches = Object.keys(scores)
+        .map(Number)
+        .filter(function (ix) { return scores[ix] * 2 >= total; });
+    matches.sort(function (a, b) { return scores[b] - scores[a] || a - b; });
+    return matches;
+}
 
-    # Sort by name
-    return entry[1][2]
+function escapeHtml(text) {
+    return String(text)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;');
+}
 
-def get_ticket_class(ticket):
+function render() {
+    var words = normalize(document.getElementById('search').value);
+    var matches, fuzzy = false;
+    if (words.length) {
+        matches = exactSearch(words);
+        if (!matches.length) {
+            matches = fuzzySearch(words);
+            fuzzy = true;
+        }
+    } else {
+        matches = index.rows.map(function (row, ix) { return ix; });
+    }
+    if (sortField === 'tid' && !fuzzy) {
+        matches = matches.slice().sort(function (a, b) {
+            return index.rows[a][F.tid] - index.rows[b][F.tid];
+        });
+    }
+
+    var html = [];
+    matches.slice(0, MAX_ROWS).forEach(function (ix) {
+        var row = index.rows[ix];
+        html.push('<tr>' +
+            '<td class="name">' + escapeHtml(row[F.name]) + '</td>' +
+            '<td class="email hide-on-small-only">' + escapeHtml(row[F.email]) + '</td>' +
+            '<td class="speaker hide-on-small-only">' + (row[F.is_speaker] ? 'yes' : 'no') + '</td>' +
+            '<td class="tid ' + escapeHtml(row[F.ticket_class]) + '">' + row[F.tid] + '</td>' +
+            '<td class="tcode hide-on-small-only">' + escapeHtml(row[F.fare_code]) + '</td>' +
+            '</tr>');
+    });
+    document.getElementById('results').innerHTML = html.join('');
+    document.getElementById('status').textContent =
+        (fuzzy ? 'No exact matches; similar tickets: ' : 'Matches: ') +
+        matches.length +
+        (matches.length > MAX_ROWS ? ' (showing the first ' + MAX_ROWS + ')' : '');
+}
 
-    """ Return a ticket class for ticket
+document.getElementById('search').addEventListener('input', render);
+Array.prototype.forEach.call(document.querySelectorAll('button.sort'), function (button) {
+    button.addEventListener('click', function () {
+        sortField = button.getAttribute('data-sort');
+        render();
+    });
+});
+render();
+</script>
+</body>
+</html>
+"""
 
-        Possible values are:
-        - training = training ticket
-        - combined = training + conference ticket
-        - conference = conference ticket
-        - sprint = sprint-only ticket
-        - other = other ticket class
-    
-    """
-    if ticket.fare.code.startswith('TRT'):
-        ticket_class = 'training'
-    elif ticket.fare.code.startswith('TRC'):
-        ticket_class = 'combined'
-    elif ticket.fare.code.startswith('TRP'):
-        ticket_class = 'sprint'
-    elif ticket.fare.code.startswith('TRS'):
-        ticket_class = 'conference'
-    else:
-        ticket_class = 'other'
-    return ticket_class
+### Helpers
 
 def create_app_file(conference,
                     output_file='ep-ticket-search-app/index.html',
-                    output_csv='ep-ticket-search-app/data.csv'):
-
-    # Get all valid conference tickets (frozen ones are not valid)
-    tickets = cmodels.Ticket.objects.filter(
-        fare__conference=conference,
-        fare__ticket_type='conference',
-        orderitem__order___complete=True,
-        frozen=False,
-        )
-
-    # Figure out the speakers
-    speakers = {}
-    accepted_talks = cmodels.Talk.objects.filter(
-        conference=conference,
-        status='accepted',
-    )
-    for talk in accepted_talks:
-        for speaker in talk.get_all_speakers():
-            speakers[speaker.user.email] = speaker
-
-    # Find all attendees
-    attendee_dict = {}
-    missing_profiles = []
-    for ticket in tickets:
-        #sys.stderr.write('ticket %r: conference=%s\n' %
-        #                 (ticket, ticket.fare.conference))
-        try:
-            ticket.p3_conference
-        except ObjectDoesNotExist:
-            sys.stderr.write('unassigned ticket ID %s: name=%r, '
-                             'user: %s %s\n' %
-                             (ticket.id,
-                              ticket.name,
-                              ticket.user.first_name, ticket.user.last_name))
-            continue
-        email = ticket.p3_conference.assigned_to
-        try:
-            profile = ticket.p3_conference.profile()
-        except ObjectDoesNotExist:
-            # Missing profile for assigned user
-            sys.stderr.write('could not find profile for %r\n' %
-                             ticket.p3_conference.assigned_to)
-            profile = None
-        except MultipleObjectsReturned:
-            # Profile assigned to multiple user accounts
-            sys.stderr.write('multiple users accounts for %r\n' %
-                             ticket.p3_conference.assigned_to)
-            profile = None
-        if ticket.id in attendee_dict:
-            # Duplicate ticket.id; should not happen
-            sys.stderr.write('duplicate ticket.id %r for %r\n' %
-                             (ticket.id, ticket.p3_conference.assigned_to))
-        name = attendee_name(ticket, profile)
-        is_speaker = (email in speakers)
-        attendee_dict[ticket.id] = (
-            ticket,
-            profile,
-            name,
-            email,
-            is_speaker)
-
-    # Prepare list
-    attendee_list = list(attendee_dict.items())
-    attendee_list.sort(key=attendee_list_key)
-
-    # Print list of attendees
-    l = ['<table class="striped">',
-         '<thead>',
-         '<tr>'
-         '<th data-field="name">Name</th>',
-         '<th data-field="email" class="hide-on-small-only">Email</th>',
-         '<th data-field="speaker" class="hide-on-small-only">Speaker</th>',
-         '<th data-field="tid">TID</th>',
-         '<th data-field="tcode" class="hide-on-small-only">Code</th>',
-         '</tr>'
-         '</thead>',
-         '<tbody class="list">',
-         ]
-    for id, (ticket, profile, name, email, is_speaker) in attendee_list:
-        code = ticket.fare.code
-        ticket_class = get_ticket_class(ticket)
-        l.append(('<tr>'
-                  '<td class="name">%s</td>'
-                  '<td class="email hide-on-small-only">%s</td>'
-                  '<td class="speaker hide-on-small-only">%s</td>'
-                  '<td class="tid %s">%s</td>'
-                  '<td class="tcode hide-on-small-only">%s</td>'
-                  '</tr>' %
-                  (name,
-                   email,
-                   'yes' if is_speaker else 'no',
-                   ticket_class,
-                   id,
-                   ticket.fare.code)))
-    l.extend(['</tbody>',
-              '</table>',
-              '<p>%i tickets in total. '
-              'Color coding: '
-              '<span class="sprint">TID</span> = Sprint Ticket. '
-              '<span class="training">TID</span> = Training Ticket. '
-              '<span class="combined">TID</span> = Combined Ticket. '
-              '<span class="conference">TID</span> = Conference Ticket.</p>' % 
-              len(attendee_list),
-              ])
+                    output_csv='ep-ticket-search-app/data.csv',
+                    incremental=False):
+
+    # Load all attendees with a few bulk queries; in incremental mode,
+    # only the rows of the changed tickets are rebuilt
+    state_file = ticket_search.state_path(output_file)
+    state = ticket_search.load_state(state_file) if incremental else None
+    attendee_list, state = ticket_search.build_rows(
+        conference, ticket_type='conference', state=state)
+
+    # Write the app and its search index
     with open(output_file, 'wb') as fp:
         fp.write((TEMPLATE % {
-                      'listing': '\n'.join(l),
+                      'total': len(attendee_list),
                       'year': conference[2:],
                   }).encode('utf-8'))
+    ticket_search.write_search_index(
+        os.path.join(os.path.dirname(output_file), 'search-index.js'),
+        attendee_list)
 
     # Write CSV output
     with open(output_csv, 'w') as fp:
@@ -279,18 +269,17 @@ def create_app_file(conference,
             'fare_code',
             ]
         writer.writerow(headers)
-        for id, (ticket, profile, name, email, is_speaker) in attendee_list:
-            code = ticket.fare.code
-            ticket_class = get_ticket_class(ticket)
-            row = [
-                name,
-                email,
-                'yes' if is_speaker else 'no',
-                ticket_class,
-                id,
-                code,
-                ]
-            writer.writerow(row)
+        for row in attendee_list:
+            writer.writerow([
+                row['name'],
+                row['email'],
+                'yes' if row['is_speaker'] else 'no',
+                row['ticket_class'],
+                row['tid'],
+                row['fare_code'],
+                ])
+
+    ticket_search.save_state(state_file, state)
 
 ###
 
@@ -306,10 +295,14 @@ class Command(BaseCommand):
                             default='ep-ticket-search-app/index.html')
         parser.add_argument('output_csv', nargs='?',
                             default='ep-ticket-search-app/data.csv')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only rebuild the rows of the tickets '
+                                 'changed since the last build')
 
     def handle(self, *args, **options):
         conference = options['conference']
         output_file = options['output_file']
         output_csv = options['output_csv']
 
-        create_app_file(conference, output_file, output_csv)
+        create_app_file(conference, output_file, output_csv,
+                        incremental=options['incremental'])
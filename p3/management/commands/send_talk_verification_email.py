@@ -1,6 +1,6 @@
 
 from django.core.management.base import BaseCommand, CommandError
-from conference import models
+from conference import mailqueue, models
 from datetime import datetime
 from email_template import utils
 
@@ -30,7 +30,7 @@ class Command(BaseCommand):
             qs = qs.filter(talk__created__gt=d)
         # more filters here...
 
-        data = []
+        data = {}
         for row in qs:
             email = row.speaker.user.email
             ctx = {
@@ -46,8 +46,15 @@ class Command(BaseCommand):
             else:
                 raise ValueError('unknown talk type')
             print(email, '->', row.talk.title, '(%s)' % row.talk.type, row.talk.created)
-            data.append((email, ctx, tpl))
-
-        for email, ctx, tpl in data:
-            utils.email(tpl, ctx, to=[email]).send()
+            data.setdefault(tpl, []).append((ctx, {'to': [email]}))
+
+        # Every template is rendered for all its recipients at once; the
+        # emails are sent by the send_queued_emails worker
+        batch = models.MailBatch.objects.create(
+            description='talk verification emails for %s' % conference,
+        )
+        queued = 0
+        for tpl, items in data.items():
+            queued += mailqueue.enqueue(utils.emails(tpl, items), batch=batch)
+        print('queued: %d (batch %d)' % (queued, batch.id))
 
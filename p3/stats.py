@@ -1,3 +1,4 @@
+import re
 from collections import defaultdict
 
 from django.contrib.auth.models import User
@@ -5,8 +6,11 @@ from django.urls import reverse
 from django.conf import settings
 from django.db.models import Q, Count
 
+from assopy.models import Order
 from p3 import models
+from p3.dataaccess import cache_me
 from conference import models as cmodels
+from conference.fares import FARE_CODE_REGEXES, FARE_CODE_VARIANTS
 from conference.models import Ticket, Speaker, Talk, TALK_STATUS
 from conference.tickets import (
     sold_training_tickets_including_combined_tickets,
@@ -79,17 +83,143 @@ def _conference_tickets_including_combined(conference_code):
     return sold_conference_tickets_including_combined_tickets(conference_code=conference_code)
 
 
+_TRAINING_FARE_CODE = re.compile('|'.join(
+    FARE_CODE_REGEXES["variants"][variant]
+    for variant in (FARE_CODE_VARIANTS.TRAINING, FARE_CODE_VARIANTS.COMBINED)
+))
+_CONFERENCE_FARE_CODE = re.compile('|'.join(
+    FARE_CODE_REGEXES["variants"][variant]
+    for variant in (
+        FARE_CODE_VARIANTS.STANDARD,
+        FARE_CODE_VARIANTS.COMBINED,
+        FARE_CODE_VARIANTS.DAYPASS,
+    )
+))
+
+
+def ticket_counters(conf):
+    """
+    Computes, in a single pass over a single query, the ticket counters used
+    by the stats below; every counter matches the count of the corresponding
+    queryset (`_tickets`, `_assigned_tickets`, `_unassigned_tickets`, ...).
+    """
+    rows = Ticket.objects\
+        .filter(fare__conference=conf, frozen=False)\
+        .filter(Q(orderitem__order___complete=True)|Q(orderitem__order__method='bank'))\
+        .order_by('id')\
+        .values_list(
+            'user',
+            'name',
+            'ticket_type',
+            'fare__code',
+            'fare__ticket_type',
+            'orderitem__order___complete',
+            'p3_conference',
+            'p3_conference__assigned_to',
+            'p3_conference__shirt_size',
+            'p3_conference__diet',
+            'p3_conference__days',
+        )
+
+    counters = {
+        'ticket_sold': 0,
+        'training_tickets_sold': 0,
+        'conference_tickets_sold': 0,
+        'assigned_tickets': 0,
+        'unassigned_tickets': 0,
+        'voupe03_tickets': 0,
+        'shirt_sizes': {},
+        'diets': {},
+        # per fare code
+        'partner_tickets': {},
+    }
+    emails = defaultdict(lambda: 0)
+    partner_users = set()
+    presence = {
+        key: {'c': 0, 'n': 0, 'days': defaultdict(lambda: 0)}
+        for key in ('all', 'nostaff')
+    }
+
+    for (uid, name, ticket_type, fare_code, fare_type, complete,
+            tc, assigned_to, shirt_size, diet, days) in rows.iterator():
+        assigned = tc is not None and name != '' and assigned_to != ''
+        if fare_type == 'conference':
+            if assigned:
+                # _assigned_tickets filters on complete orders only
+                if complete:
+                    counters['assigned_tickets'] += 1
+                    emails[assigned_to] += 1
+                    counters['shirt_sizes'][shirt_size] = \
+                        counters['shirt_sizes'].get(shirt_size, 0) + 1
+                    counters['diets'][diet] = \
+                        counters['diets'].get(diet, 0) + 1
+            elif complete:
+                counters['unassigned_tickets'] += 1
+
+            keys = ('all',) if ticket_type == 'staff' else ('all', 'nostaff')
+            for key in keys:
+                if assigned and complete:
+                    presence[key]['c'] += 1
+                    val = [_f for _f in [v.strip() for v in days.split(',')] if _f]
+                    if not val:
+                        presence[key]['days']['x'] += 1
+                    else:
+                        for v in val:
+                            presence[key]['days'][v] += 1
+                elif not assigned:
+                    # Unassigned tickets include incomplete bank orders
+                    presence[key]['n'] += 1
+
+        if not complete:
+            continue
+        if fare_type == 'conference':
+            counters['ticket_sold'] += 1
+        if _TRAINING_FARE_CODE.search(fare_code):
+            counters['training_tickets_sold'] += 1
+        if _CONFERENCE_FARE_CODE.search(fare_code):
+            counters['conference_tickets_sold'] += 1
+        if fare_code == 'VOUPE03':
+            counters['voupe03_tickets'] += 1
+        if fare_type == 'partner':
+            counters['partner_tickets'][fare_code] = \
+                counters['partner_tickets'].get(fare_code, 0) + 1
+            partner_users.add(uid)
+
+    counters['tickets_with_unique_email'] = len(emails)
+    counters['multiple_assignments'] = sum(1 for n in emails.values() if n > 1)
+    counters['partner_users'] = len(partner_users)
+    for key in presence:
+        presence[key]['days'] = dict(presence[key]['days'])
+    counters['presence'] = presence
+    return counters
+
+
+def _i_ticket_counters(sender, **kw):
+    o = kw['instance']
+    if sender is models.TicketConference:
+        conferences = [o.ticket.fare.conference]
+    elif sender is Ticket:
+        conferences = [o.fare.conference]
+    else:
+        conferences = o.orderitem_set\
+            .exclude(ticket=None)\
+            .values_list('ticket__fare__conference', flat=True)\
+            .distinct()
+    return ['ticket_counters:%s' % conference for conference in conferences]
+
+ticket_counters = cache_me(
+    models=(models.TicketConference, Ticket, Order),
+    key='ticket_counters:%(conf)s')(ticket_counters, _i_ticket_counters)
+
+
 def shirt_sizes(conf):
     sizes = dict(models.TICKET_CONFERENCE_SHIRT_SIZES)
-    qs = _assigned_tickets(conf)\
-        .values('p3_conference__shirt_size')\
-        .annotate(total=Count('id'))
 
     output = []
-    for x in qs:
+    for size, total in ticket_counters(conf)['shirt_sizes'].items():
         output.append({
-            'title': sizes.get(x['p3_conference__shirt_size']),
-            'total': x['total'],
+            'title': sizes.get(size),
+            'total': total,
         })
 
     return output
@@ -98,37 +228,19 @@ shirt_sizes.short_description = "Tshirts size"
 
 def diet_types(conf):
     diets = dict(models.TICKET_CONFERENCE_DIETS)
-    qs = _assigned_tickets(conf)\
-        .values('p3_conference__diet')\
-        .annotate(total=Count('id'))
 
     output = []
-    for x in qs:
+    for diet, total in ticket_counters(conf)['diets'].items():
         output.append({
-            'title': diets.get(x['p3_conference__diet']),
-            'total': x['total'],
+            'title': diets.get(diet),
+            'total': total,
         })
     return output
 diet_types.short_description = "Diet"
 
 
 def presence_days(conf, code=None):
-    qs = {
-        'all': {
-            'c': _assigned_tickets(conf),
-            'n': _unassigned_tickets(conf, only_complete=False),
-        },
-        'nostaff': {
-            'c': _assigned_tickets(conf).exclude(ticket_type='staff'),
-            'n': _unassigned_tickets(conf, only_complete=False).exclude(ticket_type='staff'),
-        }
-    }
-    totals = {}
-    for key in qs:
-        totals[key] = {
-            'c': qs[key]['c'].count(),
-            'n': qs[key]['n'].count(),
-        }
+    presence = ticket_counters(conf)['presence']
     output = {
         'columns': (
             ('total', 'Total'),
@@ -138,24 +250,12 @@ def presence_days(conf, code=None):
         'data': [],
     }
 
-    days = {
-        'all': defaultdict(lambda: 0),
-        'nostaff': defaultdict(lambda: 0),
-    }
-    for key in qs:
-        for x in qs[key]['c'].values_list('p3_conference__days', flat=True):
-            val = [_f for _f in [v.strip() for v in x.split(',')] if _f]
-            if not val:
-                days[key]['x'] += 1
-            else:
-                for v in val:
-                    days[key][v] += 1
-
-    for key in days:
-        dX = days[key].get('x', 0)
-        tC = totals[key]['c']
-        tN = totals[key]['n']
-        for day, count in sorted(days[key].items()):
+    for key in presence:
+        days = presence[key]['days']
+        dX = days.get('x', 0)
+        tC = presence[key]['c']
+        tN = presence[key]['n']
+        for day, count in sorted(days.items()):
             if day != 'x':
                 nc = float(count) / (tC - dX) * (tC + tN)
             else:
@@ -187,7 +287,7 @@ def tickets_status(conf, code=None):
     spam_recruiting = spam_recruiter_by_conf(conf)
     if code is None:
         # FIXME: remove hotel and sim (sim_tickets has been removed from the parameters of ticket_status_no_code function
-        output = ticket_status_no_code(conf, multiple_assignments, orphan_tickets, spam_recruiting, voupe03)
+        output = ticket_status_no_code(conf, orphan_tickets, spam_recruiting)
 
     else:
         if code in (
@@ -384,30 +484,25 @@ def ticket_status_for_voupe03_tickets(code, voupe03):
     return output
 
 
-def ticket_status_no_code(conf, multiple_assignments, orphan_tickets, spam_recruiting, voupe03):
+def ticket_status_no_code(conf, orphan_tickets, spam_recruiting):
+    counters = ticket_counters(conf)
+
+    def option(id, title):
+        return {'id': id, 'title': title, 'total': counters[id]}
+
     return [
-        _create_option('ticket_sold', 'Sold tickets', _tickets(conf, 'conference')),
-        {
-            'id': 'training_tickets_sold',
-            'title': 'Sold training tickets (including combined)',
-            'total': sold_training_tickets_including_combined_tickets(conference_code=conf).count(),
-        },
-        {
-            'id': 'conference_tickets_sold',
-            'title': 'Sold conference tickets (including combined)',
-            'total': sold_conference_tickets_including_combined_tickets(conference_code=conf).count(),
-        },
-        _create_option(
-            'tickets_with_unique_email',
-            'Sold tickets with unique email',
-            _tickets_with_unique_email(conf, 'conference')
-        ),
-        _create_option('assigned_tickets', 'Assigned tickets', _assigned_tickets(conf)),
-        _create_option('unassigned_tickets', 'Unassigned tickets', _unassigned_tickets(conf)),
+        option('ticket_sold', 'Sold tickets'),
+        option('training_tickets_sold', 'Sold training tickets (including combined)'),
+        option('conference_tickets_sold', 'Sold conference tickets (including combined)'),
+        option('tickets_with_unique_email', 'Sold tickets with unique email'),
+        option('assigned_tickets', 'Assigned tickets'),
+        option('unassigned_tickets', 'Unassigned tickets'),
         # _create_option('sim_tickets', 'Tickets with SIM card orders', sim_tickets),  # FIXME: remove hotels and sim
-        _create_option('voupe03_tickets', 'Social event tickets (VOUPE03)', voupe03),
+        option('voupe03_tickets', 'Social event tickets (VOUPE03)'),
+        # spam_recruiting and orphan_tickets depend on the users, so they are
+        # not part of ticket_counters
         _create_option('spam_recruiting', 'Recruiting emails (opt-in)', spam_recruiting),
-        _create_option('multiple_assignments', 'Tickets assigned to the same person', multiple_assignments),
+        option('multiple_assignments', 'Tickets assigned to the same person'),
         _create_option('orphan_tickets', 'Assigned tickets without user record (orphaned)', orphan_tickets),
     ]
 
@@ -618,9 +713,12 @@ def pp_tickets(conf, code=None):
         qs[fcode] = _tickets(conf, fare_code=fcode)
     all_attendees = User.objects.filter(id__in=_tickets(conf, ticket_type='partner').values('user'))
     if code is None:
-        output = [
-            _create_option('all', 'Tickets partner program', all_attendees)
-        ]
+        counters = ticket_counters(conf)
+        output = [{
+            'id': 'all',
+            'title': 'Tickets partner program',
+            'total': counters['partner_users'],
+        }]
         from conference.templatetags.conference import fare_blob
         titles = {}
         for f in cmodels.Fare.objects.filter(code__in=fcodes):
@@ -628,7 +726,7 @@ def pp_tickets(conf, code=None):
         for fcode in fcodes:
             output.append({
                 'id': fcode,
-                'total': qs[fcode].count(),
+                'total': counters['partner_tickets'].get(fcode, 0),
                 'title': fcode + ' - ' + titles[fcode],
             })
     else:
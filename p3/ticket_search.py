@@ -0,0 +1,336 @@
+"""
+    Ticket Search App data
+    ----------------------
+
+    Shared pipeline of the build_ticket_search_app and
+    build_social_ticket_search_app commands: all the valid tickets of a
+    conference are loaded with a few bulk queries (tickets, assigned user
+    accounts, speakers) and joined in memory into the rows of the app.
+
+    In incremental mode, the rows of the previous build are kept in a state
+    file and only the rows of the tickets which changed since then (or new
+    ones) are rebuilt; the assigned user accounts are only looked up for
+    those tickets. Changes to the user accounts alone (eg. a new name in the
+    profile) are only picked up by a full build.
+
+    The rows can also be compiled into a search index (see
+    build_search_index), which the ticket search app loads instead of
+    scanning an HTML table.
+
+"""
+import json
+import os
+import re
+import sys
+import unicodedata
+
+from django.contrib.auth.models import User
+from django.db.models.functions import Lower
+
+from common import files
+from conference import models as cmodels
+
+### Helpers
+
+def attendee_name(ticket_name, profile_name=None, assigned_to=''):
+
+    # Use ticket name if not set in profile
+    name = ticket_name.strip()
+
+    # Determine user name from profile, if available and ticket.name is not
+    # set
+    if not name and profile_name is not None:
+        name = profile_name.strip()
+
+    # Convert to title case, if not an email address
+    if '@' not in name:
+        name = name.title()
+
+    # Use email address if no ticket name set
+    if not name:
+        name = assigned_to.strip()
+
+    return name
+
+def get_ticket_class(fare_code):
+
+    """ Return a ticket class for fare_code
+
+        Possible values are:
+        - training = training ticket
+        - combined = training + conference ticket
+        - conference = conference ticket
+        - sprint = sprint-only ticket
+        - other = other ticket class
+
+    """
+    if fare_code.startswith('TRT'):
+        ticket_class = 'training'
+    elif fare_code.startswith('TRC'):
+        ticket_class = 'combined'
+    elif fare_code.startswith('TRP'):
+        ticket_class = 'sprint'
+    elif fare_code.startswith('TRS'):
+        ticket_class = 'conference'
+    else:
+        ticket_class = 'other'
+    return ticket_class
+
+def load_tickets(conference, ticket_type):
+
+    """ Return all valid tickets (frozen ones are not valid) of
+        conference with the given fare ticket_type, as dicts.
+    """
+    return list(cmodels.Ticket.objects
+        .filter(
+            fare__conference=conference,
+            fare__ticket_type=ticket_type,
+            orderitem__order___complete=True,
+            frozen=False)
+        .order_by('id')
+        .values(
+            'id',
+            'name',
+            'fare__code',
+            'user__email',
+            'user__first_name',
+            'user__last_name',
+            'user__attendeeprofile',
+            'p3_conference__ticket',
+            'p3_conference__assigned_to'))
+
+def load_speakers(conference):
+
+    """ Return the set of email addresses of the speakers with an
+        accepted talk in conference.
+    """
+    return set(cmodels.TalkSpeaker.objects
+        .filter(talk__conference=conference, talk__status='accepted')
+        .values_list('speaker__user__email', flat=True))
+
+def profile_names(tickets):
+
+    """ Return a dict mapping the ticket IDs to the name of the profile
+        of the attendee (see p3.models.TicketConference.profile), or None
+        if there's no such profile.
+
+        All the assigned user accounts are fetched with a single query.
+    """
+    emails = set(
+        t['p3_conference__assigned_to'].strip().lower()
+        for t in tickets
+        if t['p3_conference__assigned_to'])
+    accounts = {}
+    if emails:
+        users = User.objects\
+            .annotate(email_lower=Lower('email'))\
+            .filter(email_lower__in=emails, is_active=True)\
+            .values_list('email_lower', 'first_name', 'last_name',
+                         'attendeeprofile')
+        for email, first_name, last_name, profile in users:
+            accounts.setdefault(email, []).append(
+                (first_name, last_name, profile))
+
+    names = {}
+    for ticket in tickets:
+        assigned_to = ticket['p3_conference__assigned_to']
+        if assigned_to:
+            # Ticket assigned to someone else
+            matches = accounts.get(assigned_to.strip().lower(), [])
+            if len(matches) > 1:
+                # Profile assigned to multiple user accounts
+                sys.stderr.write('multiple users accounts for %r\n' %
+                                 assigned_to)
+                names[ticket['id']] = None
+                continue
+            account = matches[0] if matches else None
+        else:
+            # Ticket assigned to the buyer
+            account = (ticket['user__first_name'],
+                       ticket['user__last_name'],
+                       ticket['user__attendeeprofile'])
+        if account is None or account[2] is None:
+            # Missing profile for assigned user
+            sys.stderr.write('could not find profile for %r\n' %
+                             assigned_to)
+            names[ticket['id']] = None
+            continue
+        names[ticket['id']] = '%s %s' % (account[0], account[1])
+    return names
+
+### State of incremental builds
+
+def load_state(path):
+
+    """ Return the state saved by the previous build in path, or an
+        empty one.
+    """
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {'conference': None, 'tickets': {}}
+
+def save_state(path, state):
+    files.write_file(path, json.dumps(state).encode('utf-8'))
+
+def state_path(output_file):
+    return os.path.join(os.path.dirname(output_file) or '.',
+                        '.build-state.json')
+
+### Pipeline
+
+def _source(ticket):
+
+    # The values of the ticket the row depends on (besides the profile
+    # and the speakers, which are looked up separately)
+    return [ticket[k] for k in sorted(ticket)]
+
+def build_rows(conference, ticket_type='conference', social=False,
+               state=None):
+
+    """ Return (rows, state): the rows of the search app for conference,
+        sorted by name, and the state to pass to the next incremental
+        build.
+
+        Each row is a dict with the name, email, is_speaker, ticket_class,
+        tid and fare_code of a ticket.
+
+        For social apps, all tickets are listed with the email of the
+        ticket user and neither the profiles nor the speakers are looked
+        up.
+
+        If state (as returned by a previous build) is given, the rows of
+        the tickets which didn't change since then are reused; a state saved
+        by a build of another conference, ticket_type or kind of app (both
+        apps can be built in the same directory) is ignored.
+    """
+    build = {
+        'conference': conference,
+        'ticket_type': ticket_type,
+        'social': social,
+    }
+    if state is None or any(state.get(k) != v for k, v in build.items()):
+        state = dict(build, tickets={})
+    previous = state['tickets']
+
+    tickets = load_tickets(conference, ticket_type)
+    if not social:
+        assigned = []
+        for ticket in tickets:
+            if ticket['p3_conference__ticket'] is None:
+                sys.stderr.write('unassigned ticket ID %s: name=%r, '
+                                 'user: %s %s\n' %
+                                 (ticket['id'],
+                                  ticket['name'],
+                                  ticket['user__first_name'],
+                                  ticket['user__last_name']))
+            else:
+                assigned.append(ticket)
+        tickets = assigned
+        speakers = load_speakers(conference)
+    else:
+        speakers = set()
+
+    changed = [
+        ticket for ticket in tickets
+        if previous.get(str(ticket['id']), {}).get('source') != _source(ticket)
+    ]
+    names = {} if social else profile_names(changed)
+
+    entries = {}
+    for ticket in changed:
+        assigned_to = ticket['p3_conference__assigned_to'] or ''
+        entries[str(ticket['id'])] = {
+            'source': _source(ticket),
+            'row': {
+                'name': attendee_name(ticket['name'],
+                                      names.get(ticket['id']),
+                                      assigned_to),
+                'email': ticket['user__email'] if social else assigned_to,
+                'ticket_class': get_ticket_class(ticket['fare__code']),
+                'tid': ticket['id'],
+                'fare_code': ticket['fare__code'],
+            },
+        }
+
+    rows = []
+    for ticket in tickets:
+        tid = str(ticket['id'])
+        if tid not in entries:
+            entries[tid] = previous[tid]
+        row = dict(entries[tid]['row'])
+        row['is_speaker'] = row['email'] in speakers
+        rows.append(row)
+
+    rows.sort(key=lambda row: row['name'])
+    return rows, dict(build, tickets=entries)
+
+### Search index
+
+# Fields of the rows in the search index
+INDEX_FIELDS = ['name', 'email', 'is_speaker', 'ticket_class', 'tid',
+                'fare_code']
+
+def normalize(text):
+
+    """ Return text lower cased, without accents and with all
+        punctuation replaced by single spaces.
+
+        This must match normalize() in the JavaScript of the search app.
+    """
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+def trigrams(text):
+
+    """ Return the set of trigrams of the words in (normalized) text.
+    """
+    grams = set()
+    for word in text.split():
+        for ix in range(len(word) - 2):
+            grams.add(word[ix:ix + 3])
+    return grams
+
+def build_search_index(rows):
+
+    """ Return the search index of rows, as a JSON serializable dict:
+
+        - fields: names of the fields of the rows
+        - rows: the rows as lists of INDEX_FIELDS values
+        - text: the normalized searchable text (name, email and ticket ID)
+          of each row
+        - trigrams: maps every trigram to the (sorted) positions of the rows
+          with that trigram in their text
+
+        Words shorter than three characters are matched by the app by
+        scanning the text of the candidate rows.
+    """
+    records = []
+    texts = []
+    postings = {}
+    for ix, row in enumerate(rows):
+        records.append([
+            int(row[field]) if field == 'is_speaker' else row[field]
+            for field in INDEX_FIELDS])
+        text = normalize('%s %s %s' % (row['name'], row['email'], row['tid']))
+        texts.append(text)
+        for gram in trigrams(text):
+            postings.setdefault(gram, []).append(ix)
+    return {
+        'fields': INDEX_FIELDS,
+        'rows': records,
+        'text': texts,
+        'trigrams': postings,
+    }
+
+def write_search_index(path, rows, variable='TICKET_SEARCH_INDEX'):
+
+    """ Write the search index of rows to path, as a script defining the
+        global variable (so that the app also works from file:// URLs).
+    """
+    data = json.dumps(build_search_index(rows),
+                      separators=(',', ':'), sort_keys=True)
+    files.write_file(path, ('var %s = %s;\n' % (variable, data))
+                        .encode('utf-8'))
@@ -50,9 +50,16 @@ def assign_ticket_to_user(ticket, user=None):
         p3c = p3models.TicketConference(ticket=ticket)
 
     # Set attendee name on the ticket
+    previous_user_id = ticket.user_id
     ticket.name = ('%s %s' % (user.first_name, user.last_name)).strip()
     ticket.user = user
     ticket.save()
+    if previous_user_id != user.id:
+        cmodels.ticket_reassigned.send(
+            sender=cmodels.Ticket,
+            instance=ticket,
+            previous_user_id=previous_user_id,
+        )
 
     # Associate the email address with the ticket, if possible
     try:
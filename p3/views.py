@@ -1,28 +1,36 @@
+import hashlib
 import logging
 import os.path
 
 from django import http
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 
 from conference import models as cmodels
+from p3 import avatars
 
 log = logging.getLogger('p3.views')
 
 
 def p3_profile_avatar(request, slug):
     p = get_object_or_404(cmodels.AttendeeProfile, slug=slug).p3_profile
-    from urllib.request import urlopen
-    try:
-        response = urlopen(p.profile_image_url())
-    except Exception:
+    avatar = avatars.get_avatar(p.profile_id, p.profile_image_url())
+    if avatar is None:
         import p3
-        from django.conf import settings
         path = os.path.join(os.path.dirname(p3.__file__), 'static', settings.P3_ANONYMOUS_AVATAR)
-        with open(path, 'rb') as image_file:
-            image = image_file.read()
         ct = 'image/jpg'
     else:
-        headers = response.info()
-        image = response.read()
-        ct = headers.get('content-type')
-    return http.HttpResponse(image, content_type=ct)
+        path, ct = avatar
+
+    last_modified = int(os.path.getmtime(path))
+    etag = '"%s-%d"' % (hashlib.sha1(path.encode('utf-8')).hexdigest(), last_modified)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = http.FileResponse(open(path, 'rb'), content_type=ct)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=settings.P3_AVATAR_CACHE_TTL)
+    return response
@@ -29,6 +29,11 @@ ENABLE_LOCMEM_CACHE = {
 }
 
 CACHES = DISABLE_CACHING
+# ...and no in-process tiers (conference.cachef, the current conference, the
+# exchange rates)
+CONFERENCE_CACHEF_LOCAL_SIZE = 0
+CONFERENCE_CURRENT_MEMO_TIMEOUT = 0
+CONFERENCE_EXRATES_MEMO_TIMEOUT = 0
 
 TEMPLATES[0]['OPTIONS']['debug'] = True  # noqa
 
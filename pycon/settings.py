@@ -120,6 +120,22 @@ SITE_ID = 1
 MEDIA_ROOT = DATA_DIR + '/media_public'
 SECURE_MEDIA_ROOT = DATA_DIR + '/media_private'
 
+# Background threads of the files generated on the fly (see common.files),
+# like the refreshed avatars; 0 generates them within the request.
+BACKGROUND_WORKERS = config("BACKGROUND_WORKERS", default=2, cast=int)
+
+# Rendered invoice PDFs (see common.pdfcache), and how many background
+# threads render them when an invoice is saved; 0 renders them on the first
+# download.
+PDF_CACHE_DIR = config("PDF_CACHE_DIR", default=DATA_DIR + "/pdf_cache")
+PDF_RENDER_WORKERS = config("PDF_RENDER_WORKERS", default=2, cast=int)
+
+# Pre-rendered talk social cards (see conference.social_card), also rendered
+# by the PDF_RENDER_WORKERS threads when a talk changes.
+CONFERENCE_SOCIAL_CARDS_DIR = config(
+    "CONFERENCE_SOCIAL_CARDS_DIR", default=DATA_DIR + "/social_cards"
+)
+
 # Set the file upload permissions - otherwise large files
 # will not have the read permissions set.
 # https://docs.djangoproject.com/en/1.11/ref/settings/#std:setting-FILE_UPLOAD_PERMISSIONS
@@ -207,6 +223,7 @@ TEMPLATES = [
                 # epcon context processors
                 "p3.context_processors.settings",
                 "conference.context_processors.epcon_ctx",
+                "conference.context_processors.current_conference",
             ],
             "loaders": [
                 "django.template.loaders.filesystem.Loader",
@@ -220,6 +237,7 @@ MIDDLEWARE = (
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'conference.middleware.current_conference_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.http.ConditionalGetMiddleware',
@@ -510,6 +528,47 @@ CONFERENCE_ADMIN_TICKETS_STATS_EMAIL_LOG = (
 )
 CONFERENCE_ADMIN_TICKETS_STATS_EMAIL_LOAD_LIBRARY = ['conference']
 
+# Outbound mail queue (conference.mailqueue): maximum number of emails sent
+# per second by the send_queued_emails worker (0 for no limit), and number of
+# attempts before an email is marked as failed.
+CONFERENCE_MAIL_QUEUE_RATE = config(
+    "CONFERENCE_MAIL_QUEUE_RATE", default=5, cast=float
+)
+CONFERENCE_MAIL_QUEUE_MAX_ATTEMPTS = config(
+    "CONFERENCE_MAIL_QUEUE_MAX_ATTEMPTS", default=3, cast=int
+)
+
+# Size (number of entries) and timeout (seconds) of the in-process tier used
+# by conference.cachef in front of the shared cache; set the size to 0 to
+# disable it.
+CONFERENCE_CACHEF_LOCAL_SIZE = config(
+    "CONFERENCE_CACHEF_LOCAL_SIZE", default=2048, cast=int
+)
+CONFERENCE_CACHEF_LOCAL_TIMEOUT = config(
+    "CONFERENCE_CACHEF_LOCAL_TIMEOUT", default=60, cast=int
+)
+# How long (seconds) a single worker is allowed to recompute an invalidated
+# conference.cachef entry while the others keep serving the previous value;
+# set to 0 to disable the stampede protection.
+CONFERENCE_CACHEF_LEASE_TIMEOUT = config(
+    "CONFERENCE_CACHEF_LEASE_TIMEOUT", default=30, cast=int
+)
+
+# Seconds each process keeps its own copy of Conference.objects.current();
+# other processes notice a change to the conference after at most this long.
+# Set to 0 to always go through the shared cache.
+CONFERENCE_CURRENT_MEMO_TIMEOUT = config(
+    "CONFERENCE_CURRENT_MEMO_TIMEOUT", default=60, cast=int
+)
+
+# Seconds each process keeps its own copy of the exchange rates (see
+# conference.currencies.exrates_table); the rates stored by pull_latest_exrates
+# are noticed straight away by a cheap aggregate query. Set to 0 to always read
+# them from the DB.
+CONFERENCE_EXRATES_MEMO_TIMEOUT = config(
+    "CONFERENCE_EXRATES_MEMO_TIMEOUT", default=60 * 60, cast=int
+)
+
 # Conference sub-communities
 CONFERENCE_TALK_SUBCOMMUNITY = (
     ('', _('All')),
@@ -721,6 +780,13 @@ https://ep2021.europython.eu/accounts/profile/
 
 P3_ANONYMOUS_AVATAR = 'p5/images/headshot-default.jpg'
 
+# Local copies of the external avatars (see p3.avatars): where they are
+# stored, for how many seconds they are used before being fetched again and
+# their maximum width/height in pixels.
+P3_AVATAR_CACHE_DIR = config("P3_AVATAR_CACHE_DIR", default=DATA_DIR + "/avatars")
+P3_AVATAR_CACHE_TTL = config("P3_AVATAR_CACHE_TTL", default=60 * 60 * 24, cast=int)
+P3_AVATAR_SIZE = config("P3_AVATAR_SIZE", default=400, cast=int)
+
 
 # Stripe payment integration
 # --------------------------
@@ -767,6 +833,23 @@ MATRIX_AUTH_API_ALLOWED_IPS = config(
     default='',
     cast=lambda v: [s.strip() for s in v.split(',') if s.strip()]
 )
+# How long (in seconds) the speaker flag and the tickets returned by the
+# isauth API are cached for each user; they are also invalidated when the
+# tickets, orders or talks change.
+MATRIX_AUTH_API_CACHE_TIMEOUT = config(
+    'MATRIX_AUTH_API_CACHE_TIMEOUT',
+    default=15 * 60,
+    cast=int
+)
+
+# How long (in seconds) the fare codes giving access to the streams are
+# cached for each user; also invalidated when the tickets or orders change,
+# but only in the process saving them.
+MATRIX_STREAM_FARE_CODES_CACHE_TIMEOUT = config(
+    'MATRIX_STREAM_FARE_CODES_CACHE_TIMEOUT',
+    default=60,
+    cast=int
+)
 
 ### Matrix stream embedding
 
@@ -1,3 +1,5 @@
+import tempfile
+
 from .dev_settings import *  # noqa
 
 DATABASES = {
@@ -6,3 +8,9 @@ DATABASES = {
         'NAME': ':memory:',
     }
 }
+
+PDF_CACHE_DIR = tempfile.mkdtemp(prefix='epcon-pdf-cache-')
+CONFERENCE_SOCIAL_CARDS_DIR = tempfile.mkdtemp(prefix='epcon-social-cards-')
+PDF_RENDER_WORKERS = 0
+BACKGROUND_WORKERS = 0
+P3_AVATAR_CACHE_DIR = tempfile.mkdtemp(prefix='epcon-avatars-')
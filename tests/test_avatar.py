@@ -1,7 +1,64 @@
+import io
+
+import responses
 from django.urls import reverse
+from PIL import Image
+
+from p3 import avatars
+from p3.models import P3Profile
+from tests.factories import UserFactory
 
 
 def test_p3_profile_avatar(db, user_client):
     url = reverse('p3-profile-avatar', args=[user_client.user.attendeeprofile.slug])
     response = user_client.get(url)
     assert response.status_code == 200
+
+
+@responses.activate
+def test_p3_profile_avatar_is_fetched_once(db, client, settings, tmp_path):
+    settings.P3_AVATAR_CACHE_DIR = str(tmp_path)
+    settings.P3_AVATAR_SIZE = 50
+    image = io.BytesIO()
+    Image.new('RGB', (200, 100), 'red').save(image, 'PNG')
+    responses.add(
+        responses.GET, 'https://example.com/me.png', body=image.getvalue(),
+        content_type='image/png')
+
+    user = UserFactory()
+    p3_profile = P3Profile.objects.get(profile=user.attendeeprofile)
+    p3_profile.image_url = 'https://example.com/me.png'
+    p3_profile.save()
+    url = reverse('p3-profile-avatar', args=[user.attendeeprofile.slug])
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'image/jpeg'
+    avatar = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+    assert avatar.size == (50, 25)
+
+    not_modified = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    assert not_modified.status_code == 304
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_oversized_avatars_are_not_stored(settings, tmp_path, monkeypatch):
+    settings.P3_AVATAR_CACHE_DIR = str(tmp_path)
+    image = io.BytesIO()
+    Image.new('RGB', (200, 100), 'red').save(image, 'PNG')
+    responses.add(
+        responses.GET, 'https://example.com/me.png', body=image.getvalue(),
+        content_type='image/png')
+
+    monkeypatch.setattr(avatars, 'MAX_AVATAR_BYTES', 100)
+    assert avatars.fetch_avatar(1, 'https://example.com/me.png') is None
+
+    monkeypatch.setattr(avatars, 'MAX_AVATAR_BYTES', 10 ** 6)
+    monkeypatch.setattr(avatars, 'MAX_AVATAR_PIXELS', 100 * 100)
+    assert avatars.fetch_avatar(2, 'https://example.com/me.png') is None
+
+    monkeypatch.setattr(avatars, 'MAX_AVATAR_PIXELS', 200 * 100)
+    assert avatars.fetch_avatar(3, 'https://example.com/me.png') is not None
+    assert avatars.cached_avatar(1, 'https://example.com/me.png') is None
+    assert avatars.cached_avatar(2, 'https://example.com/me.png') is None
@@ -0,0 +1,206 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings
+
+from conference.cachef import CacheFunction, LocalCache, cache_invalidated
+
+
+def test_local_cache_evicts_least_recently_used_entry():
+    local = LocalCache(maxsize=2, timeout=60)
+    local.set('a', 1)
+    local.set('b', 2)
+    assert local.get('a') == 1
+
+    local.set('c', 3)
+
+    assert local.get('b') is None
+    assert local.get('a') == 1
+    assert local.get('c') == 3
+    assert len(local) == 2
+
+
+def test_local_cache_expires_entries():
+    local = LocalCache(maxsize=10, timeout=60)
+    local.set('a', 1, timeout=-1)
+
+    assert local.get('a', 'missing') == 'missing'
+    assert local.hits == 0
+    assert local.misses == 1
+
+
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_cache_function_serves_hits_from_the_local_tier():
+    cache.clear()
+    cache_me = CacheFunction(prefix='test:', local_size=10)
+    calls = []
+
+    @cache_me
+    def double(x):
+        calls.append(x)
+        return x * 2
+
+    assert double(2) == 4
+    assert double(2) == 4
+    assert calls == [2]
+    assert cache_me.stats() == {
+        'shared': {'hits': 0, 'misses': 1},
+        'local': {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 10},
+    }
+
+    # another process (simulated by a new local tier) still finds the value
+    # in the shared cache
+    cache_me.local = LocalCache(maxsize=10)
+    assert double(2) == 4
+    assert calls == [2]
+    assert cache_me.stats()['shared'] == {'hits': 1, 'misses': 1}
+
+
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_cache_function_invalidation_clears_the_local_tier_of_other_processes():
+    cache.clear()
+    cache_me = CacheFunction(prefix='test:', local_size=10, local_check=0)
+    other_process = CacheFunction(prefix='test:', local_size=10, local_check=0)
+    values = {'x': 1}
+
+    def value(x):
+        return values[x]
+
+    value_here = cache_me(key='value:%(x)s')(value)
+    value_there = other_process(key='value:%(x)s')(value)
+
+    assert value_here('x') == 1
+    assert value_there('x') == 1
+
+    values['x'] = 2
+    hashed = cache_me.fhash('test:value:x')
+    cache.delete(hashed)
+    cache_invalidated.send(cache_me, keys=[hashed])
+
+    assert value_here('x') == 2
+    assert value_there('x') == 2
+
+
+def test_local_cache_returns_copies_of_the_values():
+    local = LocalCache(maxsize=10, timeout=60)
+    local.set('a', {'tracks': []})
+    local.get('a')['tracks'].append('t1')
+
+    assert local.get('a') == {'tracks': []}
+
+
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_cache_function_many_loads_all_the_misses_at_once():
+    cache.clear()
+    cache_me = CacheFunction(prefix='test:')
+    loaded = []
+
+    def square(x, preload=None):
+        return preload['value'] if preload else x * x
+
+    square = cache_me(key='square:%(x)s')(square)
+
+    @square.bulk_loader
+    def _preload_squares(xs):
+        loaded.append(xs)
+        return {x: {'value': x * x} for x in xs}
+
+    assert square(2) == 4
+    assert square.many([1, 2, 3, 1]) == [1, 4, 9, 1]
+    assert loaded == [[1, 3]]
+
+    assert square.many([3, 1]) == [9, 1]
+    assert loaded == [[1, 3]]
+    assert cache_me.stats()['shared'] == {'hits': 3, 'misses': 3}
+
+
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_cache_function_lease_serves_the_previous_value_while_recomputing():
+    cache.clear()
+    cache_me = CacheFunction(prefix='test:', lease_timeout=30)
+    values = {'x': 1}
+
+    def value(x):
+        return values[x]
+
+    value = cache_me(key='value:%(x)s')(value)
+
+    assert value('x') == 1
+
+    values['x'] = 2
+    hashed = cache_me.fhash('test:value:x')
+    cache.delete(hashed)
+
+    # another worker is already recomputing the key
+    assert cache_me._acquire(hashed)
+    assert value('x') == 1
+
+    cache_me._release(hashed)
+    assert value('x') == 2
+
+
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_cache_function_without_stale_values_waits_for_the_new_value():
+    cache.clear()
+    cache_me = CacheFunction(prefix='test:', lease_timeout=0.2)
+    values = {'x': 1}
+
+    def value(x):
+        return values[x]
+
+    value = cache_me(key='value:%(x)s', stale=False)(value)
+
+    assert value('x') == 1
+
+    values['x'] = 2
+    hashed = cache_me.fhash('test:value:x')
+    cache.delete(hashed)
+
+    # another worker is recomputing the key, but it is too slow
+    assert cache_me._acquire(hashed)
+    assert value('x') == 2
+
+
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_cache_function_soft_timeout_refreshes_expired_values():
+    cache.clear()
+    cache_me = CacheFunction(prefix='test:')
+    values = {'x': 1}
+
+    def value(x):
+        return values[x]
+
+    value = cache_me(key='value:%(x)s', soft_timeout=-1)(value)
+    hashed = cache_me.fhash('test:value:x')
+
+    assert value('x') == 1
+    assert value.get_from_cache([('x',)]) == [1]
+
+    values['x'] = 2
+    cache_me._acquire(hashed)
+    # the value is expired but someone else is refreshing it
+    assert value('x') == 1
+    assert value.many(['x']) == [1]
+
+    cache_me._release(hashed)
+    assert value('x') == 2
+
+
+def test_compiled_keys_match_the_generic_ones():
+    cache_me = CacheFunction(prefix='test:')
+
+    def tickets(uid, conference, only_complete=False):
+        pass
+
+    def tags():
+        pass
+
+    calls = [
+        (tickets, 'tickets:%(uid)s:%(conference)s', (1, 'ep2021'), {}),
+        (tickets, 'tickets:%(uid)s:%(conference)s', (1,), {'conference': 'ep2021'}),
+        (tickets, 'tickets:%(conference)s', (), {'uid': 1, 'conference': 'ep2021'}),
+        (tickets, 'tickets:%s:%s', (1, 'ep2021'), {}),
+        (tags, 'tags', (), {}),
+    ]
+    for func, key, args, kwargs in calls:
+        expected = cache_me.fhash(cache_me.generate_key(key, func, args, kwargs))
+        assert cache_me.compile_key(key, func)(args, kwargs) == expected
@@ -12,7 +12,7 @@ from django.contrib.messages import constants as messages_constants
 from django.test import override_settings
 from django.utils import timezone
 
-from assopy.models import Order, ORDER_TYPE
+from assopy.models import Order, OrderItem, ORDER_TYPE, rebuild_coupon_usage
 from conference.cart import CartActions, ORDER_CONFIRMATION_EMAIL_SUBJECT
 from conference.models import Ticket, Fare, FARE_TICKET_TYPES, StripePayment
 from conference.fares import (
@@ -801,3 +801,38 @@ def test_order_aggregate_vat_rounding(db):
     assert order.total_vat_amount() == approx(
         (order.total() * vat.value / 100) / (1 + vat.value / 100), abs=0.01
     )
+
+
+def test_coupon_usage_is_counted_on_save(db, django_assert_num_queries):
+    get_default_conference()
+    vat = VatFactory(value=20)
+    fare = FareFactory(price=100, vat_set=[vat])
+    coupon = CouponFactory(code='TENOFF', max_usage=2)
+    order = OrderFactory(items=[(fare, {"qty": 1})])
+
+    def use_coupon():
+        return OrderItem.objects.create(
+            order=order, ticket=None, code=coupon.code, price=-10, vat=vat
+        )
+
+    first = use_coupon()
+    coupon.refresh_from_db()
+    assert coupon.usage == 1
+    with django_assert_num_queries(0):
+        assert coupon.valid()
+
+    use_coupon()
+    coupon.refresh_from_db()
+    assert coupon.usage == 2
+    assert not coupon.valid()
+
+    first.delete()
+    coupon.refresh_from_db()
+    assert coupon.usage == 1
+    assert coupon.valid()
+
+    # Bulk updates don't update the counters
+    OrderItem.objects.filter(code=coupon.code).update(code='OTHER')
+    assert rebuild_coupon_usage() == 1
+    coupon.refresh_from_db()
+    assert coupon.usage == 0
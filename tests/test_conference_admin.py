@@ -1,10 +1,18 @@
 
+import json
+from datetime import date
+from unittest import mock
+
 from pytest import mark
 
 from django.urls import reverse
+from freezegun import freeze_time
 
+from conference.models import TicketSalesDay
+from conference.tickets import count_ticket_sales
 from tests.factories import (
-    ConferenceFactory, ConferenceTagFactory, EventFactory, ScheduleFactory, TrackFactory,
+    AssopyUserFactory, ConferenceFactory, ConferenceTagFactory, EventFactory,
+    FareFactory, OrderFactory, ScheduleFactory, TrackFactory,
 )
 
 
@@ -58,6 +66,39 @@ def test_conference_ticket_stats_details_admin(admin_client):
     assert response.status_code == 200
 
 
+# /admin/conference/ticket/stats/data/  conference.admin.TicketAdmin.stats_data
+@mark.django_db
+@mock.patch('email_template.utils.email')
+def test_ticket_stats_data_reads_the_daily_rollup(mock_email, admin_client):
+    conference = ConferenceFactory(conference_start=date(2021, 7, 26))
+    fare = FareFactory(conference=conference.code, ticket_type='conference')
+    assopy_user = AssopyUserFactory()
+
+    with freeze_time('2021-07-16 12:00'):
+        # Bank orders are counted before they are paid
+        OrderFactory(user=assopy_user, payment='bank', items=[(fare, {'qty': 2})])
+    with freeze_time('2021-07-20 12:00'):
+        order = OrderFactory(user=assopy_user, items=[(fare, {'qty': 1})])
+        assert not TicketSalesDay.objects.filter(offset_day=-6).exists()
+        order._complete = True
+        order.save()
+
+    assert count_ticket_sales(conference) == {
+        ('conference', -10): 2,
+        ('conference', -6): 1,
+    }
+
+    response = admin_client.get(reverse('admin:p3-ticket-stats-data'))
+
+    assert response.status_code == 200
+    assert json.loads(response.content)[conference.code]['data'] == {
+        'conference': [[-10, 2], [-6, 1]],
+        'partner': [],
+        'event': [],
+        'other': [],
+    }
+
+
 # /admin/conference/speaker/stats/list/ conference.admin.stats_list
 @mark.django_db
 def test_conference_speaker_stat_list_admin(admin_client):
@@ -1,6 +1,7 @@
 from datetime import date
 from decimal import Decimal
 
+from django.test import override_settings
 from pytest import mark, raises
 import responses
 
@@ -11,11 +12,21 @@ from conference.currencies import (
     EXAMPLE_ECB_DAILY_XML,
     CurrencyNotSupported,
     ExchangeRate,
+    clear_exrates_table,
     get_ecb_rates_for_currency,
+    get_ecb_rates_for_date,
     convert_from_EUR_using_latest_exrates,
     fetch_and_store_latest_ecb_exrates,
+    import_ecb_historical_exrates,
 )
 
+EXAMPLE_ECB_HISTORICAL_CSV = """
+Date,USD,JPY,GBP,CHF,
+2018-03-06,1.2411,131.84,0.89165,1.15372,
+2018-03-05,1.2320,130.57,0.88983,1.15775,
+1999-01-04,1.1789,N/A,0.7111,1.6168,
+""".lstrip()
+
 
 @responses.activate
 @mark.django_db
@@ -52,3 +63,80 @@ def test_exchange_rates_are_working():
          'exrate': Decimal('0.89165')}
     assert a == b
     assert len(responses.calls) == 1   # no additional calls to API
+
+
+@mark.django_db
+def test_import_ecb_historical_exrates(tmp_path):
+    path = tmp_path / "eurofxref-hist.csv"
+    path.write_text(EXAMPLE_ECB_HISTORICAL_CSV)
+
+    assert import_ecb_historical_exrates(str(path)) == (6, 0)
+    assert ExchangeRate.objects.count() == 6
+
+    assert get_ecb_rates_for_currency("GBP") == (
+        date(2018, 3, 6), Decimal("0.89165")
+    )
+    # Weekends and holidays use the rate of the previous working day
+    assert get_ecb_rates_for_date("CHF", date(2010, 6, 1)) == (
+        date(1999, 1, 4), Decimal("1.6168")
+    )
+    with raises(ExchangeRate.DoesNotExist):
+        get_ecb_rates_for_date("GBP", date(1998, 12, 31))
+
+    path.write_text(EXAMPLE_ECB_HISTORICAL_CSV.replace("0.89165", "0.89166"))
+    assert import_ecb_historical_exrates(str(path)) == (0, 1)
+    assert get_ecb_rates_for_currency("GBP") == (
+        date(2018, 3, 6), Decimal("0.89166")
+    )
+
+
+@responses.activate
+@mark.django_db
+@override_settings(CONFERENCE_EXRATES_MEMO_TIMEOUT=60)
+def test_exchange_rates_are_loaded_once(django_assert_num_queries):
+    clear_exrates_table()
+    ExchangeRate.objects.create(
+        datestamp=date(2018, 3, 5), currency="GBP", rate=Decimal("0.88983")
+    )
+    get_ecb_rates_for_currency("GBP")
+
+    # Only the check of the stored rates
+    with django_assert_num_queries(10):
+        for _ in range(10):
+            assert get_ecb_rates_for_currency("GBP") == (
+                date(2018, 3, 5), Decimal("0.88983")
+            )
+
+    # Storing new rates refreshes the table
+    responses.add(responses.GET, DAILY_ECB_URL, body=EXAMPLE_ECB_DAILY_XML)
+    fetch_and_store_latest_ecb_exrates()
+    assert get_ecb_rates_for_currency("GBP") == (
+        date(2018, 3, 6), Decimal("0.89165")
+    )
+    clear_exrates_table()
+
+
+@mark.django_db
+@override_settings(CONFERENCE_EXRATES_MEMO_TIMEOUT=60)
+def test_exchange_rates_stored_by_other_processes_refresh_the_table():
+    clear_exrates_table()
+    rate = ExchangeRate.objects.create(
+        datestamp=date(2018, 3, 5), currency="GBP", rate=Decimal("0.88983")
+    )
+    assert get_ecb_rates_for_currency("GBP") == (
+        date(2018, 3, 5), Decimal("0.88983")
+    )
+
+    # Stored by another process: no signal is sent here
+    ExchangeRate.objects.bulk_create([ExchangeRate(
+        datestamp=date(2018, 3, 6), currency="GBP", rate=Decimal("0.89165")
+    )])
+    assert get_ecb_rates_for_currency("GBP") == (
+        date(2018, 3, 6), Decimal("0.89165")
+    )
+
+    ExchangeRate.objects.filter(id=rate.id).update(rate=Decimal("0.88984"))
+    assert get_ecb_rates_for_date("GBP", date(2018, 3, 5)) == (
+        date(2018, 3, 5), Decimal("0.88984")
+    )
+    clear_exrates_table()
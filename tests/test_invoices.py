@@ -1,9 +1,10 @@
 import csv
 import decimal
-from datetime import date
+from datetime import date, datetime
 from decimal import Decimal
 import random
 import json
+from unittest import mock
 
 from django.http import QueryDict
 from pytest import mark
@@ -15,12 +16,16 @@ from django.utils import timezone
 from freezegun import freeze_time
 import responses
 
-from assopy.models import Invoice, Order, Vat
+from assopy.models import Invoice, InvoiceLog, Order, Vat
 from tests.factories import FareFactory, OrderFactory
-from conference.models import Fare, Conference
+from conference.models import ExchangeRate, Fare, Conference
 from conference.invoicing import (
     EPS_18,
     CSV_2018_REPORT_COLUMNS,
+    create_invoices_for_orders,
+    export_invoices_to_tax_report,
+    export_invoices_for_payment_reconciliation,
+    render_invoice_as_html,
 )
 from conference.currencies import (
     DAILY_ECB_URL,
@@ -94,6 +99,28 @@ def test_invoice_pdf(client):
     assert response["Content-type"] == "application/pdf"
 
 
+@mark.django_db
+def test_invoice_pdf_is_rendered_once(client, settings, tmp_path):
+    settings.PDF_CACHE_DIR = str(tmp_path)
+    invoice_code, order_code = "I123", "asdf"
+    _prepare_invoice_for_basic_test(order_code, invoice_code)
+
+    client.login(email="joedoe@example.com", password="password123")
+    invoice_url = reverse(
+        "assopy-invoice-pdf",
+        kwargs={"order_code": order_code, "code": invoice_code},
+    )
+
+    with mock.patch("weasyprint.HTML") as html:
+        html.return_value.write_pdf.return_value = b"%PDF-1.4 invoice"
+        client.get(invoice_url)
+        response = client.get(invoice_url)
+
+    assert html.call_count == 1
+    assert response["Content-type"] == "application/pdf"
+    assert b"".join(response.streaming_content) == b"%PDF-1.4 invoice"
+
+
 def create_order_and_invoice(assopy_user, fare):
     order = OrderFactory(user=assopy_user, items=[(fare, {"qty": 1})])
 
@@ -228,6 +255,74 @@ def test_create_invoice_with_many_items(client):
     order.confirm_order(timezone.now())
 
 
+@mark.django_db
+@freeze_time("2018-05-05")
+def test_create_invoices_for_many_orders():
+    Conference.objects.create(
+        code=settings.CONFERENCE_CONFERENCE, name=settings.CONFERENCE_NAME
+    )
+    Email.objects.create(code="purchase-complete")
+    user = make_user()
+    fare = FareFactory()
+    orders = [
+        OrderFactory(user=user.assopy_user, items=[(fare, {"qty": qty})])
+        for qty in (1, 2, 3)
+    ]
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, DAILY_ECB_URL, body=EXAMPLE_ECB_DAILY_XML)
+        fetch_and_store_latest_ecb_exrates()
+
+    for order in orders:
+        order.payment_date = timezone.now()
+        order.save()
+    invoices = create_invoices_for_orders(orders, workers=2)
+
+    assert [invoice.code for invoice in invoices] == [
+        "I/18.0001", "I/18.0002", "I/18.0003",
+    ]
+    for order, invoice in zip(orders, invoices):
+        invoice = Invoice.objects.get(id=invoice.id)
+        assert invoice.order == order
+        assert invoice.exchange_rate == Decimal("0.89165")
+        # Same as rendering the invoices one by one
+        assert invoice.html == render_invoice_as_html(invoice)
+        assert InvoiceLog.objects.get(invoice=invoice).code == invoice.code
+        order.refresh_from_db()
+        assert order._complete
+
+
+@mark.django_db
+@freeze_time("2018-05-05")
+def test_invoices_use_the_exchange_rate_of_their_date():
+    Conference.objects.create(
+        code=settings.CONFERENCE_CONFERENCE, name=settings.CONFERENCE_NAME
+    )
+    Email.objects.create(code="purchase-complete")
+    user = make_user()
+    fare = FareFactory()
+    ExchangeRate.objects.create(
+        datestamp=date(2018, 3, 5), currency="GBP", rate=Decimal("0.88983")
+    )
+    ExchangeRate.objects.create(
+        datestamp=date(2018, 3, 6), currency="GBP", rate=Decimal("0.89165")
+    )
+    orders = [
+        OrderFactory(user=user.assopy_user, items=[(fare, {"qty": 1})])
+        for _ in range(2)
+    ]
+    orders[0].payment_date = timezone.make_aware(datetime(2018, 3, 5, 12))
+    orders[1].payment_date = timezone.now()
+    for order in orders:
+        order.save()
+
+    invoices = create_invoices_for_orders(orders, workers=1)
+
+    assert [(i.exchange_rate, i.exchange_rate_date) for i in invoices] == [
+        (Decimal("0.88983"), date(2018, 3, 5)),
+        (Decimal("0.89165"), date(2018, 3, 6)),
+    ]
+
+
 @mark.django_db
 @responses.activate
 def test_export_invoice_csv(client):
@@ -258,7 +353,8 @@ def test_export_invoice_csv(client):
     assert response.status_code == 200
     assert response["content-type"] == "text/csv"
 
-    invoice_reader = csv.reader(response.content.decode("utf-8").splitlines())
+    content = b"".join(response.streaming_content).decode("utf-8")
+    invoice_reader = csv.reader(content.splitlines())
     next(invoice_reader)  # skip header
     invoice = next(invoice_reader)
 
@@ -313,7 +409,8 @@ def test_export_invoice_csv_before_period(client):
     assert response.status_code == 200
     assert response["content-type"] == "text/csv"
 
-    invoice_reader = csv.reader(response.content.decode("utf-8").splitlines())
+    content = b"".join(response.streaming_content).decode("utf-8")
+    invoice_reader = csv.reader(content.splitlines())
     header = next(invoice_reader)
     assert header == CSV_2018_REPORT_COLUMNS
     assert next(invoice_reader, None) is None
@@ -384,7 +481,7 @@ def test_export_invoice_accounting_json(client):
     assert response.status_code == 200
     assert response["content-type"].startswith("application/json")
 
-    data = json.loads(response.content)["invoices"]
+    data = json.loads(b"".join(response.streaming_content))["invoices"]
     assert len(data) == 1
     assert data[0]["ID"] == invoice1.code
     assert decimal.Decimal(data[0]["net"]) == invoice1.net_price()
@@ -394,6 +491,44 @@ def test_export_invoice_accounting_json(client):
     assert data[0]["stripe"] == invoice1.order.stripe_charge_id
 
 
+@mark.django_db
+@responses.activate
+def test_export_invoices_uses_a_single_query(django_assert_num_queries):
+    Conference.objects.create(
+        code=settings.CONFERENCE_CONFERENCE, name=settings.CONFERENCE_NAME
+    )
+    responses.add(responses.GET, DAILY_ECB_URL, body=EXAMPLE_ECB_DAILY_XML)
+    Email.objects.create(code="purchase-complete")
+    fare = FareFactory()
+
+    with freeze_time("2018-05-05"):
+        invoices = [
+            create_order_and_invoice(make_user().assopy_user, fare)
+            for _ in range(3)
+        ]
+
+    with django_assert_num_queries(1):
+        exported = list(
+            export_invoices_to_tax_report(date(2018, 1, 1), date(2018, 12, 31))
+        )
+    assert [output["ID"] for _, output in exported] == [
+        invoice.code for invoice in invoices
+    ]
+    for (_, output), invoice in zip(exported, invoices):
+        assert output["Buyer Name"] == invoice.order.user.user.get_full_name()
+        assert output["Net Price"] == invoice.net_price_in_local_currency
+        assert output["Gross Price"] == invoice.price_in_local_currency
+
+    with django_assert_num_queries(1):
+        exported = list(export_invoices_for_payment_reconciliation(
+            date(2018, 1, 1), date(2018, 12, 31)
+        ))
+    for output, invoice in zip(exported, invoices):
+        assert output["net"] == str(invoice.net_price())
+        assert output["vat"] == str(invoice.vat_value())
+        assert output["order"] == invoice.order.code
+
+
 def test_reissue_invoice(admin_client):
     Conference.objects.create(
         code=settings.CONFERENCE_CONFERENCE, name=settings.CONFERENCE_NAME
@@ -0,0 +1,163 @@
+import smtplib
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from pytest import mark
+
+from conference import mailqueue
+from conference.forms import AdminSendMailForm
+from conference.models import MailBatch, QueuedEmail
+from email_template import utils
+from email_template.models import Email
+
+from tests.common_tools import get_default_conference, make_user
+
+
+class FlakyBackend(EmailBackend):
+    """
+    Stand-in for the SMTP backend which refuses the addresses in `refused`
+    and counts the connections.
+    """
+    refused = ('refused@example.com',)
+    opened = 0
+
+    def open(self):
+        FlakyBackend.opened += 1
+
+    def send_messages(self, messages):
+        for message in messages:
+            if set(message.to) & set(self.refused):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'')})
+        return super().send_messages(messages)
+
+
+def queue_messages(batch, addresses):
+    return mailqueue.enqueue(
+        [
+            mail.EmailMessage('Hello', 'Hi there', 'info@example.com', [to])
+            for to in addresses
+        ],
+        batch=batch,
+    )
+
+
+@mark.django_db
+def test_queued_emails_are_sent_and_reported():
+    batch = MailBatch.objects.create(
+        description='greetings', feedback_address='admin@example.com'
+    )
+    assert queue_messages(batch, ['a@example.com', 'b@example.com']) == 2
+    assert len(mail.outbox) == 0
+    assert batch.progress() == {'QUEUED': 2, 'SENDING': 0, 'SENT': 0, 'FAILED': 0}
+
+    assert mailqueue.send_queued(rate=0) == (2, 0)
+
+    assert [m.to for m in mail.outbox[:2]] == [['a@example.com'], ['b@example.com']]
+    assert batch.progress() == {'QUEUED': 0, 'SENDING': 0, 'SENT': 2, 'FAILED': 0}
+    assert all(e.sent for e in QueuedEmail.objects.all())
+
+    # The report of the batch
+    assert len(mail.outbox) == 3
+    assert mail.outbox[2].to == ['admin@example.com']
+    assert 'sent: 2, failed: 0' in mail.outbox[2].body
+    batch.refresh_from_db()
+    assert batch.completed
+
+    # Nothing left to send
+    assert mailqueue.send_queued(rate=0) == (0, 0)
+
+
+@mark.django_db
+def test_failed_emails_are_retried(settings):
+    settings.CONFERENCE_MAIL_QUEUE_MAX_ATTEMPTS = 2
+    batch = MailBatch.objects.create(
+        description='greetings', feedback_address='admin@example.com'
+    )
+    queue_messages(batch, ['a@example.com', 'refused@example.com', 'b@example.com'])
+    FlakyBackend.opened = 0
+
+    assert mailqueue.send_queued(rate=0, connection=FlakyBackend()) == (2, 1)
+    # All the messages went over the same connection
+    assert FlakyBackend.opened == 1
+    refused = QueuedEmail.objects.get(to='refused@example.com')
+    assert refused.status == QueuedEmail.STATUS.QUEUED
+    assert refused.attempts == 1
+    assert 'SMTPRecipientsRefused' in refused.last_error
+    assert not MailBatch.objects.get(id=batch.id).completed
+
+    assert mailqueue.send_queued(rate=0, connection=FlakyBackend()) == (0, 1)
+    refused.refresh_from_db()
+    assert refused.status == QueuedEmail.STATUS.FAILED
+    assert refused.attempts == 2
+
+    batch.refresh_from_db()
+    assert batch.completed
+    assert batch.progress() == {'QUEUED': 0, 'SENDING': 0, 'SENT': 2, 'FAILED': 1}
+    assert 'refused@example.com' in mail.outbox[-1].body
+
+
+@mark.django_db
+def test_concurrent_workers_send_every_email_once():
+    batch = MailBatch.objects.create(description='greetings')
+    queue_messages(batch, ['a@example.com', 'b@example.com', 'c@example.com'])
+    send = mailqueue._send
+    second_worker = []
+
+    def send_while_another_worker_runs(email, connection):
+        # The second worker starts after the first one loaded the queue
+        if not second_worker:
+            second_worker.append(None)
+            second_worker[0] = mailqueue.send_queued(rate=0)
+        send(email, connection)
+
+    with mock.patch(
+        'conference.mailqueue._send', side_effect=send_while_another_worker_runs
+    ):
+        first_worker = mailqueue.send_queued(rate=0)
+
+    assert first_worker == (1, 0)
+    assert second_worker == [(2, 0)]
+    assert sorted(m.to for m in mail.outbox) == [
+        ['a@example.com'], ['b@example.com'], ['c@example.com'],
+    ]
+    batch.refresh_from_db()
+    assert batch.completed
+    assert batch.progress()['SENT'] == 3
+
+
+@mark.django_db
+def test_admin_mass_mailing_is_queued():
+    get_default_conference()
+    user = make_user()
+    form = AdminSendMailForm(data={
+        'from_': 'info@example.com',
+        'subject': 'Hello {{ user.first_name }}',
+        'body': 'See you at {{ conf.name }}',
+        'send_email': True,
+    })
+    assert form.is_valid()
+
+    assert form.send_emails([user.id, user.id], 'admin@example.com') == 1
+    assert len(mail.outbox) == 0
+
+    email = QueuedEmail.objects.get()
+    assert email.to == user.email
+    assert email.subject == 'Hello %s' % user.first_name
+    assert email.batch.feedback_address == 'admin@example.com'
+
+
+@mark.django_db
+def test_email_template_is_loaded_once(django_assert_num_queries):
+    Email.objects.create(code='hello', subject='Hello {{ name }}', text='Hi')
+
+    with django_assert_num_queries(1):
+        messages = utils.emails('hello', [
+            ({'name': name}, {'to': ['%s@example.com' % name]})
+            for name in ('alice', 'bob')
+        ])
+
+    assert [(m.subject, m.to) for m in messages] == [
+        ('Hello alice', ['alice@example.com']),
+        ('Hello bob', ['bob@example.com']),
+    ]
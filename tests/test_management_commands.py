@@ -1,3 +1,4 @@
+import csv
 import json
 from io import StringIO
 
@@ -6,12 +7,13 @@ from django.core.management import call_command
 import pytest
 from freezegun import freeze_time
 
-from conference.models import TALK_STATUS
+from conference.models import TALK_STATUS, Fare
 from tests.common_tools import (
     create_talk_for_user,
     get_default_conference,
     create_user,
     create_valid_ticket_for_user_and_fare,
+    setup_conference_with_typical_fares,
 )
 
 pytestmark = pytest.mark.django_db
@@ -68,3 +70,35 @@ def test_speakers_csv():
     # Check there is a header line and a data line in the output (two non-empty lines)
     assert len([line for line in stdout.getvalue().split("\n") if line]) == 2
     assert f"{user.first_name} {user.last_name}" in stdout.getvalue()
+
+
+@freeze_time("2021-02-02")
+def test_build_ticket_search_app(tmp_path):
+    conference = get_default_conference()
+    setup_conference_with_typical_fares()
+    user = create_user()
+    ticket = create_valid_ticket_for_user_and_fare(
+        user=user, fare=Fare.objects.get(code="TRCC"))
+    create_talk_for_user(user=user, status=TALK_STATUS.accepted)
+    output_file = str(tmp_path / "index.html")
+    output_csv = str(tmp_path / "data.csv")
+
+    call_command("build_ticket_search_app", conference.code, output_file, output_csv)
+
+    with open(output_csv) as fp:
+        rows = list(csv.DictReader(fp))
+    assert [(r["ticket_id"], r["fare_code"], r["ticket_class"], r["is_speaker"]) for r in rows] == [
+        (str(ticket.id), "TRCC", "combined", "yes"),
+    ]
+    with open(str(tmp_path / "search-index.js")) as fp:
+        index = json.loads(fp.read().split(" = ", 1)[1].rstrip(";\n"))
+    assert index["rows"] == [[rows[0]["name"], rows[0]["email"], 1, "combined", ticket.id, "TRCC"]]
+
+    ticket.name = "Brian Cohen"
+    ticket.save()
+    call_command("build_ticket_search_app", conference.code, output_file, output_csv,
+                 "--incremental")
+
+    with open(output_csv) as fp:
+        rows = list(csv.DictReader(fp))
+    assert [r["name"] for r in rows] == ["Brian Cohen"]
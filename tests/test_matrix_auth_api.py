@@ -1,4 +1,9 @@
 from pytest import mark
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from conference.api import ApiError
 from conference.models import TALK_STATUS
@@ -7,8 +12,13 @@ from .common_tools import (
     make_user,
 )
 from .factories import (
+    CreditCardOrderFactory,
+    FareFactory,
+    OrderItemFactory,
     TalkFactory,
     TalkSpeakerFactory,
+    TicketFactory,
+    VatFactory,
 )
 
 
@@ -112,3 +122,69 @@ def test_staff_proposed_speaker_user_auth_success(client):
     assert result['last_name'] == user.last_name
     assert result['is_staff'] is True
     assert result['is_speaker'] is False
+
+
+@mark.django_db
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_entitlement_is_cached_until_tickets_or_talks_change(client):
+    cache.clear()
+    conference = get_default_conference()
+    user = make_user(is_staff=False)
+    fare = FareFactory(conference=conference.code, code='TRCC', name='Combined')
+    ticket = TicketFactory(fare=fare, user=user, frozen=False)
+    order = CreditCardOrderFactory(user=user.assopy_user)
+    order._complete = True
+    order.save()
+    OrderItemFactory(order=order, ticket=ticket, price=1, vat=VatFactory())
+
+    def isauth():
+        payload = {'email': user.email, 'password': 'password123'}
+        return client.post(reverse('api:isauth'), payload,
+                           content_type='application/json').json()
+
+    result = isauth()
+    assert result['is_speaker'] is False
+    assert result['tickets'] == [{'fare_name': 'Combined', 'fare_code': 'TRCC'}]
+
+    with CaptureQueriesContext(connection) as queries:
+        isauth()
+    assert not [q for q in queries if 'conference_ticket' in q['sql']]
+
+    talk = TalkFactory(created_by=user, status=TALK_STATUS.proposed)
+    TalkSpeakerFactory(talk=talk, speaker__user=user)
+    assert isauth()['is_speaker'] is False
+
+    talk.status = TALK_STATUS.accepted
+    talk.save()
+    assert isauth()['is_speaker'] is True
+
+    ticket.frozen = True
+    ticket.save()
+    assert isauth()['tickets'] == []
+
+
+@mark.django_db
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_entitlement_of_the_previous_owner_is_invalidated(client):
+    cache.clear()
+    conference = get_default_conference()
+    user = make_user(is_staff=False)
+    other = make_user(email='other@example.com', is_staff=False)
+    fare = FareFactory(conference=conference.code, code='TRCC', name='Combined')
+    ticket = TicketFactory(fare=fare, user=user, frozen=False)
+    order = CreditCardOrderFactory(user=user.assopy_user)
+    order._complete = True
+    order.save()
+    OrderItemFactory(order=order, ticket=ticket, price=1, vat=VatFactory())
+
+    def isauth(email):
+        payload = {'email': email, 'password': 'password123'}
+        return client.post(reverse('api:isauth'), payload,
+                           content_type='application/json').json()
+
+    assert isauth(user.email)['tickets'] == [{'fare_name': 'Combined', 'fare_code': 'TRCC'}]
+
+    # eg. edited in the admin, without ticket_reassigned
+    ticket.user = other
+    ticket.save()
+    assert isauth(user.email)['tickets'] == []
@@ -5,6 +5,9 @@ from django.utils import timezone
 
 import pytest
 
+from conference.cachef import LocalCache
+from conference.middleware import current_conference_middleware
+from conference.models import Conference, ConferenceManager
 from p3.models import TicketConference
 from p3.models import P3Profile
 from tests.factories import (
@@ -91,3 +94,36 @@ def test_public_profile_image_url(p3_profile):
     p3_profile.profile.visibility = 'p'
     url = p3_profile.public_profile_image_url()
     assert url == settings.STATIC_URL + settings.P3_ANONYMOUS_AVATAR
+
+
+def test_current_conference_is_memoised_until_the_conference_changes(
+    monkeypatch, django_assert_num_queries
+):
+    monkeypatch.setattr(
+        ConferenceManager, 'memo', LocalCache(maxsize=1, timeout=60)
+    )
+    conference = ConferenceFactory(code=settings.CONFERENCE_CONFERENCE)
+
+    assert Conference.objects.current().name == conference.name
+    with django_assert_num_queries(0):
+        assert Conference.objects.current().name == conference.name
+
+    conference.name = 'Renamed'
+    conference.save()
+
+    assert Conference.objects.current().name == 'Renamed'
+
+
+def test_current_conference_is_looked_up_once_per_request(
+    rf, django_assert_num_queries
+):
+    ConferenceFactory(code=settings.CONFERENCE_CONFERENCE)
+
+    def view(request):
+        return [request.conference.code, request.conference.name]
+
+    middleware = current_conference_middleware(view)
+    with django_assert_num_queries(1):
+        assert middleware(rf.get('/')) == [
+            settings.CONFERENCE_CONFERENCE, settings.CONFERENCE_NAME
+        ]
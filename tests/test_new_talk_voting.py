@@ -2,11 +2,24 @@ from datetime import timedelta
 from unittest import mock
 
 import pytest
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 
 from conference.models import Conference, VotoTalk, TALK_STATUS, TALK_TYPE_CHOICES, TALK_ADMIN_TYPE
 from conference.talk_voting import VotingOptions, find_talks
+from conference.utils import (
+    TALLY_MISSING_VOTE,
+    pairwise_preferences,
+    pairwise_tally,
+    ranking_of_talks,
+    rebuild_pairwise_tally,
+)
 from tests.factories import SpeakerFactory, TalkFactory, TalkSpeakerFactory, TalkVotingTicketFactory
 from tests.common_tools import make_user, create_talk_for_user, get_default_conference, template_used
 
@@ -362,7 +375,138 @@ def test_helper_query_talks_without_speaker_details_not_visible(user_client):
     speaker = SpeakerFactory(user=make_user())
     TalkSpeakerFactory(talk=talk2, speaker=speaker)
 
-    talks = find_talks(user_client.user, Conference.objects.current(), [])
-    assert talk not in talks
+    talks = find_talks(user_client.user, Conference.objects.current())
+    ids = [t['id'] for t in talks]
+    assert talk.id not in ids
 
-    assert talk2 in talks
+    assert talk2.id in ids
+
+
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_find_talks_caches_the_candidates_and_shuffles_them_per_user(user_client):
+    cache.clear()
+    conference = get_default_conference()
+    talks = [create_talk_for_user(user=None) for _ in range(10)]
+    other_user = make_user(email='other@example.com')
+
+    first = find_talks(user_client.user, conference)
+    assert sorted(t['id'] for t in first) == sorted(t.id for t in talks)
+    assert [t['id'] for t in find_talks(other_user, conference)] != [t['id'] for t in first]
+
+    VotoTalk.objects.create(talk=talks[0], user=user_client.user, vote=VotingOptions.maybe)
+    with CaptureQueriesContext(connection) as queries:
+        second = find_talks(user_client.user, conference)
+    # Only the votes of the user are loaded
+    assert len(queries) == 1
+    assert [t['id'] for t in second] == [t['id'] for t in first]
+    voted = [t for t in second if t['votes']]
+    assert [t['id'] for t in voted] == [talks[0].id]
+    assert voted[0]['votes'][0].vote == VotingOptions.maybe
+
+    talks[1].status = TALK_STATUS.accepted
+    talks[1].save()
+    assert talks[1].id not in [t['id'] for t in find_talks(user_client.user, conference, 'not-voted')]
+
+
+def test_ranking_of_talks_uses_the_schulze_method():
+    get_default_conference()
+    first, second, third = [
+        TalkFactory(status=TALK_STATUS.proposed) for _ in range(3)
+    ]
+    ballots = [
+        (VotingOptions.must_see, VotingOptions.want_to_see, VotingOptions.maybe),
+        (VotingOptions.must_see, VotingOptions.maybe, VotingOptions.want_to_see),
+        (VotingOptions.maybe, VotingOptions.must_see, VotingOptions.want_to_see),
+    ]
+    for ix, ballot in enumerate(ballots):
+        user = make_user(email='voter%s@example.com' % ix)
+        for talk, vote in zip((first, second, third), ballot):
+            VotoTalk.objects.create(talk=talk, user=user, vote=vote)
+
+    assert ranking_of_talks([third, second, first]) == [first, second, third]
+
+
+def test_ranking_of_talks_breaks_ties_by_submission_order():
+    get_default_conference()
+    first, second = [TalkFactory(status=TALK_STATUS.proposed) for _ in range(2)]
+    user = make_user()
+    VotoTalk.objects.create(talk=first, user=user, vote=VotingOptions.maybe)
+    VotoTalk.objects.create(talk=second, user=user, vote=VotingOptions.maybe)
+
+    assert ranking_of_talks([second, first]) == [first, second]
+
+
+def test_pairwise_tally_is_updated_when_votes_change():
+    conference = get_default_conference()
+    talks = [TalkFactory(status=TALK_STATUS.proposed) for _ in range(3)]
+    alice = make_user(email='alice@example.com')
+    bob = make_user(email='bob@example.com')
+
+    vote = VotoTalk.objects.create(talk=talks[0], user=alice, vote=VotingOptions.maybe)
+    VotoTalk.objects.create(talk=talks[1], user=alice, vote=VotingOptions.must_see)
+    VotoTalk.objects.create(talk=talks[2], user=bob, vote=VotingOptions.want_to_see)
+    vote.vote = VotingOptions.must_see
+    vote.save()
+    VotoTalk.objects.filter(talk=talks[2], user=bob).delete()
+    VotoTalk.objects.create(talk=talks[1], user=bob, vote=VotingOptions.not_interested)
+
+    expected = pairwise_preferences(talks, missing_vote=TALLY_MISSING_VOTE)
+    assert (pairwise_tally(talks) == expected).all()
+
+    rebuild_pairwise_tally(conference.code)
+    assert (pairwise_tally(talks) == expected).all()
+
+
+def test_pairwise_tally_is_updated_when_talks_are_added():
+    get_default_conference()
+    talks = [TalkFactory(status=TALK_STATUS.proposed) for _ in range(2)]
+    alice = make_user(email='alice@example.com')
+    bob = make_user(email='bob@example.com')
+    VotoTalk.objects.create(talk=talks[0], user=alice, vote=VotingOptions.maybe)
+    VotoTalk.objects.create(talk=talks[1], user=alice, vote=VotingOptions.must_see)
+    VotoTalk.objects.create(talk=talks[1], user=bob, vote=VotingOptions.not_interested)
+
+    talks.append(TalkFactory(status=TALK_STATUS.proposed))
+
+    expected = pairwise_preferences(talks, missing_vote=TALLY_MISSING_VOTE)
+    assert expected[:, 2].any()
+    assert (pairwise_tally(talks) == expected).all()
+
+
+def test_pairwise_tally_serializes_the_votes_of_a_user():
+    get_default_conference()
+    talks = [TalkFactory(status=TALK_STATUS.proposed) for _ in range(2)]
+    user = make_user()
+    locks = []
+
+    def lock_voter(user_id):
+        locks.append((user_id, len(queries)))
+
+    with mock.patch.object(VotoTalk, 'lock_voter', side_effect=lock_voter), \
+            CaptureQueriesContext(connection) as queries:
+        # Two requests voting the two talks: each one takes the voter lock
+        # before reading anything, so the second one (waiting on the lock
+        # of the first) sees the vote of the first one.
+        first = VotoTalk.objects.create(talk=talks[0], user=user, vote=VotingOptions.must_see)
+        second_starts = len(queries)
+        VotoTalk.objects.create(talk=talks[1], user=user, vote=VotingOptions.must_see)
+
+        expected = pairwise_preferences(talks, missing_vote=TALLY_MISSING_VOTE)
+        assert not expected.any()
+        assert (pairwise_tally(talks) == expected).all()
+
+        first.delete()
+
+    # save() and the tally of each vote; delete(), pre_delete and the tally
+    assert [user_id for user_id, _ in locks] == [user.id] * 7
+    assert locks[0][1] == 0
+    assert locks[2][1] == second_starts
+    expected = pairwise_preferences(talks, missing_vote=TALLY_MISSING_VOTE)
+    assert (pairwise_tally(talks) == expected).all()
+
+
+def test_ranking_of_talks_command_refuses_another_missing_vote_with_the_tally():
+    conference = get_default_conference()
+
+    with pytest.raises(CommandError):
+        call_command('ranking_of_talks', conference.code, '--use-tally', '--missing-vote', '5')
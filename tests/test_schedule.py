@@ -1,13 +1,17 @@
+from datetime import datetime
 from http.client import OK as HTTP_OK_200
 
 from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from pytest import mark
 
 from tests.common_tools import template_used
+from conference.schedule import schedule_grid
+from conference.utils import IntervalIndex
 from conference.models import (
     Conference,
     Schedule,
@@ -66,6 +70,65 @@ def test_names_are_not_abbreviated(client):
     assert 'Joejoe Doedoe' in response.content.decode()
 
 
+@mark.django_db
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_schedule_grid_is_cached_until_the_talks_change(django_assert_num_queries):
+    cache.clear()
+    conference = factories.ConferenceFactory()
+    talk = factories.TalkFactory(title='Original title')
+    schedule = Schedule.objects.create(
+        conference=conference.code,
+        slug='someslug',
+        date=timezone.now().date(),
+        description='Some Description'
+    )
+    track = Track.objects.create(schedule=schedule, track='t1', title='Test Track 1')
+    event = Event.objects.create(
+        schedule=schedule,
+        start_time=timezone.now().replace(hour=10, minute=0),
+        talk=talk,
+    )
+    EventTrack.objects.create(event=event, track=track)
+
+    grid = schedule_grid(schedule.id)
+    assert [t['title'] for t in grid['talks']] == ['Original title']
+    assert grid['titles'] == ['Test Track 1']
+
+    with django_assert_num_queries(0):
+        assert schedule_grid(schedule.id) == grid
+
+    talk.title = 'New title'
+    talk.save()
+
+    grid = schedule_grid(schedule.id)
+    assert [t['title'] for t in grid['talks']] == ['New title']
+
+
+def test_interval_index_counts_overlapping_events():
+    def event(id, hour, minute, duration):
+        return {
+            'id': id,
+            'time': datetime(2021, 7, 26, hour, minute),
+            'duration': duration,
+        }
+
+    keynote = event(1, 9, 0, 60)
+    talk = event(2, 9, 30, 30)
+    training = event(3, 9, 45, 180)
+    lunch = event(4, 13, 0, 60)
+    marker = event(5, 9, 50, 0)
+    index = IntervalIndex([lunch, training, talk, keynote, marker])
+
+    assert {e['id']: count for e, count in index.overlaps()} == {
+        1: 2,
+        2: 2,
+        3: 2,
+    }
+    assert index.running(datetime(2021, 7, 26, 9, 50)) == [keynote, talk, training]
+    assert index.running(datetime(2021, 7, 26, 12, 45)) == []
+    assert index.running(datetime(2021, 7, 26, 13, 0)) == [lunch]
+
+
 class TestView(TestCase):
     def setUp(self):
         self.user = factories.UserFactory(password='password1234', is_superuser=True)
@@ -0,0 +1,88 @@
+import threading
+
+from django.db import connection, transaction
+from freezegun import freeze_time
+from pytest import mark, raises
+
+from conference import sequences
+from conference.invoicing import (
+    REAL_INVOICE_PREFIX,
+    next_invoice_code_for_year,
+    reserve_invoice_codes,
+)
+from conference.models import CodeSequence
+from conference.orders import next_order_code_for_year
+from tests.factories import OrderFactory
+
+
+@mark.django_db
+def test_sequence_starts_after_the_existing_codes():
+    with freeze_time("2021-03-01"):
+        order = OrderFactory(items=[])
+    # As if the order was created before the sequence table
+    CodeSequence.objects.all().delete()
+    order.code = 'O/21.0041'
+    order.save()
+
+    assert next_order_code_for_year(2021) == 'O/21.0042'
+    assert next_order_code_for_year(2021) == 'O/21.0043'
+    assert next_order_code_for_year(2020) == 'O/20.0001'
+
+
+@mark.django_db
+def test_invoice_codes_are_reserved_in_blocks():
+    assert next_invoice_code_for_year(REAL_INVOICE_PREFIX, 2021) == 'I/21.0001'
+    assert reserve_invoice_codes(REAL_INVOICE_PREFIX, 2021, 3) == [
+        'I/21.0002', 'I/21.0003', 'I/21.0004',
+    ]
+    assert CodeSequence.objects.get(prefix=REAL_INVOICE_PREFIX, year=2021).last_number == 4
+
+
+@mark.django_db
+def test_reserved_numbers_are_released_on_rollback():
+    sequences.reserve('T/', 2021)
+
+    with raises(ValueError):
+        with transaction.atomic():
+            assert list(sequences.reserve('T/', 2021, 5)) == [2, 3, 4, 5, 6]
+            raise ValueError
+
+    assert list(sequences.reserve('T/', 2021)) == [2]
+
+
+@mark.django_db(transaction=True)
+def test_concurrent_reservations_get_distinct_numbers():
+    threads_count = 8
+    reservations = 20
+    results = []
+    errors = []
+    barrier = threading.Barrier(threads_count)
+
+    def worker(ix):
+        try:
+            barrier.wait()
+            numbers = []
+            for n in range(reservations):
+                # Mix single codes and blocks
+                count = 1 + (ix + n) % 3
+                with transaction.atomic():
+                    numbers.extend(sequences.reserve('T/', 2021, count))
+            results.append(numbers)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=worker, args=(ix,))
+        for ix in range(threads_count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    numbers = sorted(n for numbers in results for n in numbers)
+    assert numbers == list(range(1, len(numbers) + 1))
+    assert CodeSequence.objects.get(prefix='T/', year=2021).last_number == len(numbers)
@@ -99,3 +99,52 @@ class StatsTestCase(TestCase):
     def test_pp_tickets(self):
         from p3.stats import pp_tickets
         repartition = pp_tickets(self.conference)
+
+    @mock.patch('email_template.utils.email')
+    @mock.patch('django.core.mail.send_mail')
+    def test_ticket_counters_match_the_querysets(self, mock_send_email, mock_email):
+        from p3.stats import (
+            ticket_counters, _tickets, _assigned_tickets, _unassigned_tickets,
+            _tickets_with_unique_email, presence_days,
+        )
+        fare = factories.FareFactory(conference=self.conference.code, ticket_type='conference')
+        vat = factories.VatFactory()
+        complete_order = factories.CreditCardOrderFactory(user=self.assopy_user)
+        complete_order._complete = True
+        complete_order.save()
+        bank_order = factories.CreditCardOrderFactory(user=self.assopy_user, payment='bank')
+        # An order without items has a zero total, hence it is complete
+        bank_order._complete = False
+        bank_order.save()
+
+        def ticket(order, assigned_to=None, ticket_type='standard', days=''):
+            ticket = factories.TicketFactory(
+                fare=fare, user=self.user, frozen=False, ticket_type=ticket_type)
+            if assigned_to is not None:
+                factories.TicketConferenceFactory(
+                    ticket=ticket, assigned_to=assigned_to, days=days)
+            factories.OrderItemFactory(order=order, ticket=ticket, price=1, vat=vat)
+
+        ticket(complete_order, 'a@example.com', days='2021-07-26,2021-07-27')
+        ticket(complete_order, 'a@example.com', ticket_type='staff', days='2021-07-26')
+        ticket(complete_order, 'b@example.com')
+        ticket(complete_order, '')
+        ticket(complete_order)
+        ticket(bank_order)
+
+        counters = ticket_counters(self.conference)
+
+        assert counters['ticket_sold'] == _tickets(self.conference, 'conference').count() == 5
+        assert counters['assigned_tickets'] == _assigned_tickets(self.conference).count() == 3
+        assert counters['unassigned_tickets'] == _unassigned_tickets(self.conference).count() == 2
+        assert counters['tickets_with_unique_email'] == \
+            _tickets_with_unique_email(self.conference).count() == 2
+        assert counters['multiple_assignments'] == 1
+        assert presence_days(self.conference)['data'] == [
+            {'title': '2021-07-26', 'total': 2, 'total_nc': 6},
+            {'title': '2021-07-27', 'total': 1, 'total_nc': 3},
+            {'title': 'x', 'total': 1, 'total_nc': 0},
+            {'title': '2021-07-26 (no staff)', 'total': 1, 'total_nc': 5},
+            {'title': '2021-07-27 (no staff)', 'total': 1, 'total_nc': 5},
+            {'title': 'x (no staff)', 'total': 1, 'total_nc': 0},
+        ]
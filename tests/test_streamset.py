@@ -1,4 +1,13 @@
+from datetime import timedelta
+from unittest import mock
+
 from pytest import mark
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from tests import factories
 from tests import common_tools
@@ -57,3 +66,42 @@ def test_streamset_with_ticket(user_client):
     assert tracks['url'] == 'https://www.youtube.com/embed/EEIk7gwjgIM'
     assert 'reload_timeout_seconds' in data
     assert data['reload_timeout_seconds'] > 3600 # factory sets the end_date to now + 1 hour
+
+@mark.django_db
+@override_settings(CACHES=settings.ENABLE_LOCMEM_CACHE)
+def test_streamset_index_follows_the_time_windows(user_client):
+    cache.clear()
+    get_default_conference()
+    common_tools.setup_conference_with_typical_fares()
+    fare = models.Fare.objects.get(code='TRVC')
+    common_tools.create_valid_ticket_for_user_and_fare(
+        user_client.user, fare=fare)
+
+    now = timezone.now()
+    def stream(title, fare_codes):
+        return {"title": title, "fare_codes": fare_codes, "url": "https://example.com/" + title}
+    factories.StreamSetFactory(
+        streams=[stream("Day 1", ["TRVC"]), stream("Sprints", ["TRSC"])],
+        start_date=now - timedelta(hours=1),
+        end_date=now + timedelta(hours=1))
+    factories.StreamSetFactory(
+        streams=[stream("Day 2", ["TRVC", "TRCC"])],
+        start_date=now + timedelta(hours=1),
+        end_date=now + timedelta(hours=2))
+
+    data = user_panel.get_streams_for_current_conference(user_client.user)
+    assert [s['title'] for s in data['streams']] == ['Day 1']
+    assert 3500 < data['reload_timeout_seconds'] < 3700
+
+    with mock.patch('django.utils.timezone.now', return_value=now + timedelta(minutes=90)):
+        with CaptureQueriesContext(connection) as queries:
+            data = user_panel.get_streams_for_current_conference(user_client.user)
+    assert [s['title'] for s in data['streams']] == ['Day 2']
+    assert not [q for q in queries if 'conference_streamset' in q['sql']]
+
+    # Changing a stream set rebuilds the index
+    stream_set = models.StreamSet.objects.order_by('id').first()
+    stream_set.enabled = False
+    stream_set.save()
+    data = user_panel.get_streams_for_current_conference(user_client.user)
+    assert data['streams'] == []
@@ -1,4 +1,5 @@
 from datetime import timedelta
+from unittest import mock
 
 import pytest
 
@@ -347,3 +348,27 @@ def test_show_talk_link_in_schedule(client):
 
     schedule_string = event.get_schedule_string()
     assert schedule_string in html
+
+
+def test_talk_social_card_is_rendered_once_and_revalidated(client, settings, tmp_path):
+    settings.CONFERENCE_SOCIAL_CARDS_DIR = str(tmp_path)
+    get_default_conference()
+    talk = TalkFactory()
+    url = reverse("conference:conference-talk-social-card-png", args=[talk.slug])
+
+    with mock.patch("weasyprint.HTML") as html:
+        html.return_value.write_png.return_value = b"\x89PNG card"
+        response = client.get(url)
+        assert b"".join(response.streaming_content) == b"\x89PNG card"
+        assert response["Content-Type"] == "image/png"
+
+        not_modified = client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert not_modified.status_code == 304
+
+        talk.title = "A new title"
+        talk.save()
+        changed = client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        assert changed.status_code == 200
+        assert changed["ETag"] != response["ETag"]
+
+    assert html.call_count == 2
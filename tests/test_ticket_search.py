@@ -0,0 +1,53 @@
+from unittest import mock
+
+from p3 import ticket_search
+from p3.ticket_search import build_search_index, normalize
+
+
+def test_normalize_strips_accents_and_punctuation():
+    assert normalize("José Müller-Lüdenscheidt") == "jose muller ludenscheidt"
+    assert normalize("brian.cohen@example.com") == "brian cohen example com"
+
+
+def test_search_index_maps_trigrams_to_rows():
+    rows = [
+        dict(name="Brian Cohen", email="brian@example.com", is_speaker=True,
+             ticket_class="combined", tid=12, fare_code="TRCC"),
+        dict(name="Reg", email="reg@example.com", is_speaker=False,
+             ticket_class="conference", tid=7, fare_code="TRSP"),
+    ]
+
+    index = build_search_index(rows)
+
+    assert index["rows"][1] == ["Reg", "reg@example.com", 0, "conference", 7, "TRSP"]
+    assert index["text"] == [
+        "brian cohen brian example com 12",
+        "reg reg example com 7",
+    ]
+    assert index["trigrams"]["bri"] == [0]
+    assert index["trigrams"]["exa"] == [0, 1]
+    assert "12" not in index["trigrams"]
+
+
+def test_incremental_builds_ignore_the_state_of_the_other_app():
+    ticket = {
+        'id': 12,
+        'name': 'Brian Cohen',
+        'fare__code': 'TRCC',
+        'user__email': 'buyer@example.com',
+        'user__first_name': 'Mandy',
+        'user__last_name': 'Cohen',
+        'user__attendeeprofile': 1,
+        'p3_conference__ticket': 12,
+        'p3_conference__assigned_to': 'brian@example.com',
+    }
+
+    with mock.patch.object(ticket_search, 'load_tickets', return_value=[ticket]), \
+            mock.patch.object(ticket_search, 'load_speakers', return_value=set()), \
+            mock.patch.object(ticket_search, 'profile_names', return_value={}):
+        social_rows, social_state = ticket_search.build_rows('ep2021', social=True)
+        rows, state = ticket_search.build_rows('ep2021', state=social_state)
+
+    assert social_rows[0]['email'] == 'buyer@example.com'
+    assert rows[0]['email'] == 'brian@example.com'
+    assert state['social'] is False